@@ -1,19 +1,54 @@
 # app.py
+import io
 import os
+import re
+import gzip
 import csv
 import json
-from datetime import datetime, time, timedelta
+import heapq
+import hashlib
+import hmac
+import functools
+from collections import OrderedDict, defaultdict
+import mmap
+import atexit
+import random
+import shutil
+import struct
+import sys
+import weakref
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time, timedelta
+from time import monotonic, perf_counter, sleep, time as wall_time
 from zoneinfo import ZoneInfo
+try:
+    import fcntl  # cross-process locking for the shared counter file (POSIX)
+except ImportError:  # pragma: no cover - Windows falls back to per-process locking
+    fcntl = None
+from jinja2 import DictLoader, FileSystemBytecodeCache
 from flask import (
-    Flask, render_template_string, request, redirect, url_for,
-    session, send_file, flash, jsonify
+    Flask, render_template, request, redirect, url_for,
+    session, flash, jsonify, Response, stream_with_context,
+    g, abort, has_request_context, before_render_template, template_rendered
 )
 
 # =================== CONFIG ===================
 TZ = ZoneInfo("America/Los_Angeles")
 DATA_JSON = "schedules.json"          # primary storage for schedules
 COUNTERS_JSON = "counters.json"       # storage for boys/girls counters
-CSV_EXPORT = "schedules_export.csv"
+COUNTERS_SHM = "counters.shm"         # live counters shared by all workers (mmap)
+STORAGE = os.getenv("BATHROOM_STORAGE", "json")  # "json" (simple mode) or "sqlite", see STORAGE
+STORAGE_DB = "bathroom.db"            # SQLite backend: schedules, counters and revisions
+COUNTER_FLUSH_INTERVAL = float(os.getenv("BATHROOM_COUNTER_FLUSH", "2.0"))  # seconds
+SEQLOCK_SPINS = 1000                   # lock-free read attempts on shared memory before taking the lock
+STREAM_POLL = 1.0                      # seconds between checks for other workers' counter changes
+STREAM_KEEPALIVE = 25.0                # seconds between SSE keep-alive comments
+TIMELINE_MAX_DAYS = 400                # longest range /api/timeline will stream
+BATCH_MAX_OPS = 500                    # operations accepted per /api/counters/batch call
+BATCH_MAX_DELTA = 50                   # largest |delta| in one batch operation
+OP_ID_TTL = 7 * 24 * 3600              # seconds op ids are remembered for dedup (and max replay age)
+CSV_EXPORT = "schedules_export.csv"   # download name for /admin/download
 CLOSED_MIN = 15                        # first/last N minutes closed during class
 ADMIN_PIN = os.getenv("BATHROOM_ADMIN_PIN", "1234")  # change me (env var)
 SECRET = os.getenv("BATHROOM_SECRET_KEY", "change-me")  # Flask session key
@@ -22,6 +57,421 @@ PORT = int(os.getenv("PORT", "5050"))  # default 5050 to avoid AirPlay on macOS
 app = Flask(__name__)
 app.secret_key = SECRET
 
+# =================== METRICS ===================
+# /metrics serves Prometheus text format. Each worker process adds into one dict
+# per thread (so the request path takes no lock) and a background thread writes
+# the process totals to METRICS_DIR/<server pid>/<pid>.json every
+# METRICS_FLUSH_INTERVAL seconds if anything changed; a scrape adds up the files
+# of every worker of the same server (gunicorn master), including workers that
+# have since exited, whose files are folded into one METRICS_EXITED_JSON.
+METRICS_DIR = os.getenv("BATHROOM_METRICS_DIR", "metrics")
+METRICS_FLUSH_INTERVAL = 5.0           # seconds between per-worker snapshots
+METRICS_EXITED_JSON = "exited.json"    # summed series of exited workers, per server
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# name -> (type, label names, help); histograms use LATENCY_BUCKETS and gauges
+# are filled in at scrape time
+METRIC_DEFS = {
+    "bathroom_http_requests_total": (
+        "counter", ("route", "method", "code"), "HTTP requests by route, method and status code."),
+    "bathroom_http_request_duration_seconds": (
+        "histogram", ("route", "method"), "Time until the response starts, by route."),
+    "bathroom_schedule_reads_total": ("counter", (), "Schedules loaded from storage."),
+    "bathroom_schedule_writes_total": ("counter", (), "Schedules written to storage."),
+    "bathroom_counter_reads_total": ("counter", (), "Counter snapshots read from shared memory."),
+    "bathroom_counter_writes_total": ("counter", (), "Counter updates (presses, batches, resets)."),
+    "bathroom_counter_flushes_total": (
+        "counter", (), "Counter snapshots written to storage (counters.json or SQLite)."),
+    "bathroom_storage_duration_seconds": (
+        "histogram", ("op", "backend"), "Storage backend calls by operation and backend."),
+    "bathroom_render_duration_seconds": ("histogram", ("template",), "Template rendering time."),
+    "bathroom_transitions_total": ("counter", ("tenant",), "Status or reason changes (counted once per host)."),
+    "bathroom_hook_runs_total": ("counter", ("kind", "result"), "Transition hooks run, by kind (url/command) and result."),
+    "bathroom_open": ("gauge", ("tenant",), "1 while the bathroom is open."),
+    "bathroom_counter": ("gauge", ("tenant", "who"), "Current counter values (all hosts with peer sync)."),
+    "bathroom_occupancy": ("gauge", ("tenant", "who"), "Students out in each bathroom (occupancy tracking)."),
+    "bathroom_push_clients": ("gauge", ("tenant",), "Connected /api/stream clients across live workers."),
+    "bathroom_workers": ("gauge", (), "Worker processes currently reporting metrics."),
+}
+
+class Metrics:
+    """Per-process counters and histograms, keyed by (name, labels tuple).
+
+    Every thread writes only to its own shard (shards are keyed by thread id,
+    which no two live threads share), so ``inc``/``observe`` are a dict lookup
+    and an add. ``collect`` merges the shards; a read racing a write may be off
+    by that one update, which is fine for a scrape.
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.server_id = None  # set by `python app.py`; otherwise the parent (gunicorn master) pid
+        self._shards = {}
+        self._pid = None
+        self._lock = threading.Lock()
+        self._dirty = False     # anything recorded since the last flush
+        self._gauges = None     # gauges as last flushed
+
+    def _shard(self):
+        if self._pid != os.getpid():
+            self._start()
+        shard = self._shards.get(threading.get_ident())
+        if shard is None:
+            shard = self._shards[threading.get_ident()] = {}
+        return shard
+
+    def _start(self):
+        # After fork the parent's numbers belong to the parent, and the flusher is gone.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._shards = {}
+            self._pid = os.getpid()
+            if self.flush_interval > 0:
+                threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def inc(self, name, labels=(), n=1):
+        shard = self._shard()
+        v = shard.get((name, labels))
+        if v is None:
+            v = shard[(name, labels)] = [0]
+        v[0] += n
+        self._dirty = True
+
+    def observe(self, name, seconds, labels=()):
+        shard = self._shard()
+        v = shard.get((name, labels))
+        if v is None:
+            v = shard[(name, labels)] = [0, 0.0] + [0] * (len(LATENCY_BUCKETS) + 1)
+        v[0] += 1
+        v[1] += seconds
+        v[2 + bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self._dirty = True
+
+    def timed(self, name, labels=()):
+        return _Timer(self, name, labels)
+
+    def collect(self):
+        """{(name, labels): values} summed over this process's threads."""
+        total = {}
+        for shard in list(self._shards.values()):
+            for key, v in list(shard.items()):
+                t = total.get(key)
+                if t is None:
+                    total[key] = list(v)
+                else:
+                    for i, x in enumerate(v):
+                        t[i] += x
+        return total
+
+    # ----- across workers -----
+    def _server_dir(self):
+        server = self.server_id or os.getppid()
+        return os.path.join(self.directory, str(server))
+
+    def flush(self, gauges=None):
+        """Write this worker's totals (and its share of the summed gauges)."""
+        self._dirty = False  # before collecting: a racing update marks it again
+        if gauges is None:
+            gauges = local_gauges()
+        self._gauges = gauges
+        series = [[name, list(labels), v] for (name, labels), v in self.collect().items()]
+        gauges = [[name, list(labels), v] for (name, labels), v in gauges.items()]
+        write_json_atomic(os.path.join(self._server_dir(), f"{os.getpid()}.json"),
+                          {"pid": os.getpid(), "series": series, "gauges": gauges})
+
+    def gather(self):
+        """(summed series, summed per-worker gauges, live workers) for this server."""
+        gauges = local_gauges()
+        self.flush(gauges)
+        series, summed, live = {}, {}, 0
+        d = self._server_dir()
+        for fn in os.listdir(d):
+            if not fn.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(d, fn), encoding="utf-8") as f:
+                    doc = json.load(f)
+            except (OSError, ValueError):
+                continue  # being replaced right now, or a crash left a stub
+            _add_series(series, doc["series"])
+            if not doc["pid"] or not _pid_alive(doc["pid"]):
+                continue  # an exited worker's requests still count, its clients don't
+            live += 1
+            for name, labels, v in doc["gauges"]:
+                key = (name, tuple(labels))
+                summed[key] = summed.get(key, 0) + v
+        return series, summed, live
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        self._remove_stale_servers()
+        while self._pid == pid:
+            sleep(self.flush_interval)
+            try:
+                gauges = local_gauges()
+                if self._dirty or gauges != self._gauges:
+                    self.flush(gauges)
+                self._fold_exited()
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                app.logger.warning("metrics flush failed: %s", e)
+
+    def _fold_exited(self):
+        """Add the files of exited workers into EXITED_JSON and delete them, so
+        their requests still count but files don't pile up across restarts."""
+        d = self._server_dir()
+        try:
+            dead = [fn for fn in os.listdir(d)
+                    if fn.endswith(".json") and fn[:-5].isdigit() and not _pid_alive(int(fn[:-5]))]
+        except FileNotFoundError:
+            return
+        if not dead:
+            return
+        path = os.path.join(d, METRICS_EXITED_JSON)
+        with open(os.path.join(d, ".lock"), "a") as lock, _FileLock(lock.fileno()):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    doc = json.load(f)
+            except FileNotFoundError:
+                doc = {"pid": 0, "series": [], "gauges": [], "folded": []}
+            series = {}
+            _add_series(series, doc["series"])
+            folded = set(doc["folded"])  # already added, if a crash kept the file
+            for fn in dead:
+                if fn in folded:
+                    continue
+                try:
+                    with open(os.path.join(d, fn), encoding="utf-8") as f:
+                        _add_series(series, json.load(f)["series"])
+                except FileNotFoundError:
+                    continue  # folded by another worker meanwhile
+                except ValueError:
+                    pass  # a crash left a stub
+            write_json_atomic(path, {"pid": 0, "series": [[n, list(l), v] for (n, l), v in series.items()],
+                                     "gauges": [], "folded": dead})
+            for fn in dead:
+                try:
+                    os.remove(os.path.join(d, fn))
+                except FileNotFoundError:
+                    pass
+
+    def _remove_stale_servers(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.isdigit() and int(name) != (self.server_id or os.getppid()) and not _pid_alive(int(name)):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+def _add_series(total, series):
+    for name, labels, v in series:
+        key = (name, tuple(labels))
+        t = total.get(key)
+        if t is None:
+            total[key] = list(v)
+        else:
+            for i, x in enumerate(v):
+                t[i] += x
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics, self.name, self.labels = metrics, name, labels
+
+    def __enter__(self):
+        self.t0 = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, perf_counter() - self.t0, self.labels)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+metrics = Metrics()
+
+def storage_op(op, counter=None):
+    """Decorator for storage backend methods: time them by op and backend kind."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def timed(self, *args, **kwargs):
+            if counter:
+                metrics.inc(counter)
+            with metrics.timed("bathroom_storage_duration_seconds", (op, self.kind)):
+                return fn(self, *args, **kwargs)
+        return timed
+    return wrap
+
+@app.before_request
+def _start_request_timer():
+    g.request_t0 = perf_counter()
+    if profiler.running:
+        profiler.enter()
+
+@app.teardown_request
+def _end_profiled_request(exc):
+    # teardown, not after_request: it also runs when the request raised
+    if profiler.running:
+        profiler.exit()
+
+@app.after_request
+def _record_request(response):
+    t0 = g.pop("request_t0", None)
+    if t0 is not None:
+        route = request.url_rule.rule if request.url_rule else "(unmatched)"
+        metrics.observe("bathroom_http_request_duration_seconds", perf_counter() - t0, (route, request.method))
+        metrics.inc("bathroom_http_requests_total", (route, request.method, str(response.status_code)))
+    return response
+
+@before_render_template.connect_via(app)
+def _start_render_timer(sender, template, context, **extra):
+    g.render_t0 = perf_counter()
+
+@template_rendered.connect_via(app)
+def _record_render(sender, template, context, **extra):
+    t0 = g.pop("render_t0", None)
+    if t0 is not None:
+        metrics.observe("bathroom_render_duration_seconds", perf_counter() - t0, (template.name,))
+
+def _label_str(names, labels, extra=""):
+    parts = ['{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for k, v in zip(names, labels)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def render_metrics(series, gauges):
+    """Prometheus text exposition (format 0.0.4) of merged series and gauges."""
+    by_name = defaultdict(list)
+    for (name, labels), v in list(series.items()) + list(gauges.items()):
+        by_name[name].append((labels, v))
+    out = []
+    for name, (kind, label_names, help_text) in METRIC_DEFS.items():
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, v in sorted(by_name.get(name, ())):
+            if kind != "histogram":
+                value = v[0] if kind == "counter" else v
+                out.append(f"{name}{_label_str(label_names, labels)} {value}")
+                continue
+            cumulative = 0
+            for le, n in zip(LATENCY_BUCKETS + ("+Inf",), v[2:]):
+                cumulative += n
+                le_label = f'le="{le}"'
+                out.append(f"{name}_bucket{_label_str(label_names, labels, le_label)} {cumulative}")
+            out.append(f"{name}_sum{_label_str(label_names, labels)} {v[1]:.6f}")
+            out.append(f"{name}_count{_label_str(label_names, labels)} {v[0]}")
+    return "\n".join(out) + "\n"
+
+# =================== PROFILER ===================
+# An admin can sample the live process for a while (/admin/profile): a thread
+# snapshots the Python stacks of the threads that are serving a request every
+# PROFILE_INTERVAL seconds, until the time or request limit is reached, and
+# writes them to PROFILES_DIR in collapsed-stack format ("a;b;c <samples>",
+# for flamegraph.pl, speedscope, ...). Only the worker that received the start
+# request is sampled. While no profile runs the request path only checks a flag.
+PROFILES_DIR = "profiles"
+PROFILE_INTERVAL = 0.005               # seconds between samples
+PROFILE_MAX_SECONDS = 300
+PROFILES_KEEP = 20                     # newest profile files kept
+
+class SamplingProfiler:
+    def __init__(self, directory=PROFILES_DIR, interval=PROFILE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.running = False
+        self.threads = set()    # idents of threads inside a request
+        self.requests_left = None
+        self._lock = threading.Lock()
+
+    def start(self, seconds, requests=None, all_threads=False):
+        """Start sampling in this process; returns the file the profile will be
+        written to, or None if one is already running."""
+        with self._lock:
+            if self.running:
+                return None
+            name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.collapsed"
+            self.threads = set()
+            self.requests_left = requests
+            self.running = True
+        threading.Thread(target=self._run, args=(name, monotonic() + seconds, all_threads),
+                         name="profiler", daemon=True).start()
+        return name
+
+    # called from the request hooks only while running
+    def enter(self):
+        self.threads.add(threading.get_ident())
+
+    def exit(self):
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            return  # began before the profile started
+        self.threads.discard(tid)
+        if self.requests_left is not None:
+            with self._lock:  # requests end on several threads at once
+                self.requests_left -= 1
+
+    def _run(self, name, deadline, all_threads):
+        me = threading.get_ident()
+        labels = {}  # code object -> "module:function"
+        stacks = defaultdict(int)
+        samples = 0
+        # A thread only lets go of the GIL every switch interval (5 ms), so
+        # without this a request shorter than that is never caught mid-way.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, self.interval / 10))
+        try:
+            while monotonic() < deadline and (self.requests_left is None or self.requests_left > 0):
+                for tid, frame in sys._current_frames().items():
+                    if tid == me or not (all_threads or tid in self.threads):
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        label = labels.get(code)
+                        if label is None:
+                            qualname = getattr(code, "co_qualname", code.co_name)  # 3.11+
+                            label = labels[code] = f"{frame.f_globals.get('__name__', '?')}:{qualname}"
+                        stack.append(label)
+                        frame = frame.f_back
+                    stacks[";".join(reversed(stack))] += 1
+                    samples += 1
+                sleep(self.interval)
+        except Exception:
+            app.logger.exception("profile %s: sampling failed", name)  # keep what was sampled
+        finally:
+            sys.setswitchinterval(switch_interval)
+            self.running = False
+        try:
+            path = os.path.join(self.directory, name)
+            _ensure_dir(path)
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, n in sorted(stacks.items()):
+                    f.write(f"{stack} {n}\n")
+            for old in list_profiles()[PROFILES_KEEP:]:
+                os.remove(os.path.join(self.directory, old))
+        except OSError as e:
+            app.logger.error("profile %s not saved: %s", name, e)
+            return
+        app.logger.info("profile %s: %d samples", name, samples)
+
+profiler = SamplingProfiler()
+
+def list_profiles():
+    """Finished profile files, newest first."""
+    try:
+        names = os.listdir(PROFILES_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted((n for n in names if n.endswith(".collapsed")), reverse=True)
+
 # =================== DEFAULT SCHEDULES ===================
 # Stored as {"monday":[...], "tue-fri":[...]} rows:
 # {"label": "Period 2", "is_class": 1, "start": "08:10", "end": "08:48"}
@@ -53,113 +503,1987 @@ DAY_KEYS = ["monday", "tue-fri"]  # Monday modified, Tue–Fri regular
 WEEKDAY_TO_KEY = {0: "monday", 1: "tue-fri", 2: "tue-fri", 3: "tue-fri", 4: "tue-fri"}
 
 # =================== STORAGE (Schedules) ===================
-def load_schedules():
-    if not os.path.exists(DATA_JSON):
-        save_schedules(DEFAULT_SCHEDULES)
-        return DEFAULT_SCHEDULES
-    with open(DATA_JSON, "r", encoding="utf-8") as f:
-        return json.load(f)
+# Each tenant (see TENANTS) has a storage backend (see STORAGE); called without
+# one, these use the tenant of the current request, or the default tenant
+# outside a request.
+def load_schedules(tenant=None):
+    tenant = tenant or current_tenant()
+    data = tenant.storage.load_schedules()
+    if data is None:
+        data = tenant.default_schedules()
+        save_schedules(data, tenant, note="defaults")
+    return assign_row_ids(data)
+
+def save_schedules(data, tenant=None, note=""):
+    tenant = tenant or current_tenant()
+    tenant.storage.save_schedules(assign_row_ids(data), note)
+    tenant.invalidate()
+
+def update_schedules(fn, tenant=None, note=""):
+    """Read-modify-write: ``fn(schedules) -> schedules`` runs under the storage
+    write lock (across workers) on the latest stored copy; an exception in
+    ``fn`` leaves storage untouched."""
+    tenant = tenant or current_tenant()
+    load_schedules(tenant)  # writes the defaults on first use
+    data = tenant.storage.update_schedules(lambda d: assign_row_ids(fn(assign_row_ids(d))), note)
+    tenant.invalidate()
+    return data
+
+def file_version(path):
+    """Identity of a file on disk: (mtime_ns, size), or None."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+# Parsed schedules/calendars are kept in process and only re-read when the
+# file's mtime/size change. The stat itself is throttled so hot paths do no I/O.
+SCHEDULE_STAT_INTERVAL = 1.0  # seconds between stat() checks of a cached file
+
+class CachedFile:
+    """``loader()``'s result, reloaded when ``version()`` changes (e.g. a file_version())."""
 
-def save_schedules(data):
-    with open(DATA_JSON, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    def __init__(self, version, loader):
+        self.version_fn = version
+        self.loader = loader
+        self.version = None
+        self.data = None
+        self.checked = 0.0
+        self._lock = threading.RLock()  # a loader may save defaults -> invalidate()
+
+    def get(self):
+        """Return (version, data)."""
+        if self.data is not None and monotonic() - self.checked < SCHEDULE_STAT_INTERVAL:
+            return self.version, self.data
+        with self._lock:
+            version = self.version_fn()
+            if self.data is None or version != self.version:
+                # Stored under the version seen before loading: a change during
+                # the load then just means one more reload (a loader saving
+                # defaults included), never stale data under the new version.
+                self.version, self.data = version, self.loader()
+            self.checked = monotonic()
+            return self.version, self.data
+
+    def invalidate(self):
+        with self._lock:
+            self.data = None
+            self.checked = 0.0
+
+def get_schedules():
+    """Return (version, schedules) for the current tenant from its cache."""
+    return current_tenant().get_schedules()
+
+def _ensure_dir(path):
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+
+def write_json_atomic(path, data, **dump_args):
+    """Write ``data`` to a temp file and rename it over ``path``: readers (and a
+    crash mid-write) only ever see the old or the new file, never half of one."""
+    _ensure_dir(path)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, **dump_args)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
 
 # =================== STORAGE (Counters) ===================
-def load_counters():
-    if not os.path.exists(COUNTERS_JSON):
+def load_counters(path=COUNTERS_JSON):
+    if not os.path.exists(path):
         counters = {"girls": 0, "boys": 0}
-        save_counters(counters)
+        save_counters(counters, path)
         return counters
-    with open(COUNTERS_JSON, "r", encoding="utf-8") as f:
-        try:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
-            # sanity defaults
-            return {"girls": int(data.get("girls", 0)), "boys": int(data.get("boys", 0))}
-        except Exception:
-            return {"girls": 0, "boys": 0}
+        # sanity defaults
+        return {"girls": int(data.get("girls", 0)), "boys": int(data.get("boys", 0))}
+    except (ValueError, TypeError, AttributeError) as e:
+        # Keep the damaged file for a human instead of quietly starting over at 0.
+        aside = f"{path}.corrupt-{datetime.now():%Y%m%d-%H%M%S}"
+        os.replace(path, aside)
+        app.logger.error("counters file %s is unreadable (%s); moved to %s, counting from 0", path, e, aside)
+        return {"girls": 0, "boys": 0}
+
+def save_counters(counters, path=COUNTERS_JSON):
+    write_json_atomic(path, {"girls": int(counters["girls"]), "boys": int(counters["boys"])})
+
+class CounterStore:
+    """Girls/boys counters shared by every worker process through an mmap'd file.
+
+    Increments take an exclusive fcntl lock on ``shm_path``, so they are atomic
+    across gunicorn workers. Reads are lock-free (seqlock) and never touch the
+    filesystem. A background thread writes changes back to the tenant's storage
+    backend (counters.json or the SQLite db) every COUNTER_FLUSH_INTERVAL seconds.
+
+    Every change is also tallied as grow-only increments and decrements per
+    counter (the PN-counter state peer sync exchanges, see PEER SYNC), so
+    value == increments - decrements at all times.
+    """
+    MAGIC = b"BRCNT002"
+    # magic, seq (odd while a write is in progress), girls, boys, flushed seq,
+    # then girls +, girls -, boys +, boys -
+    LAYOUT = struct.Struct("<8sQqqQqqqq")
+    DATA = struct.Struct("<qqQqqqq")  # LAYOUT after seq, at offset 16
+    SEQ = struct.Struct("<Q")
+    KEYS = ("girls", "boys")
+
+    def __init__(self, shm_path, storage, flush_interval=COUNTER_FLUSH_INTERVAL, load_tallies=None):
+        self.shm_path = shm_path
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.load_tallies = load_tallies  # -> tallies saved by peer sync, to seed from
+        self._pid = None
+        self._tlock = threading.Lock()  # fcntl locks don't exclude threads of one process
+        self._fh = None
+        self._fd = None
+        self._mm = None
+        self._closed = False
+
+    # ----- setup -----
+    def _ensure_open(self):
+        # Re-open after fork: the mapping is inherited but the flusher thread is not.
+        if self._pid == os.getpid():
+            return
+        with self._tlock:
+            if self._pid == os.getpid():
+                return
+            _ensure_dir(self.shm_path)
+            # A file object (not a bare fd) so the descriptor is released with the store.
+            self._fh = os.fdopen(os.open(self.shm_path, os.O_RDWR | os.O_CREAT, 0o644), "r+b", buffering=0)
+            fd = self._fd = self._fh.fileno()
+            with self._locked():
+                if os.fstat(fd).st_size < self.LAYOUT.size:
+                    os.ftruncate(fd, self.LAYOUT.size)
+                mm = mmap.mmap(fd, self.LAYOUT.size)
+                if mm[:8] != self.MAGIC:
+                    # first start (or a corrupt file): seed from the stored snapshot
+                    c = self.storage.load_counters()
+                    mm[:] = self.LAYOUT.pack(self.MAGIC, 0, c["girls"], c["boys"], 0, *self._seed_tallies(c))
+                self._mm = mm
+                self._unpack_locked()
+            self._pid = os.getpid()
+            self._closed = False
+            _open_counter_stores.add(self)
+            if self.flush_interval > 0:
+                threading.Thread(target=self._flush_loop, name="counter-flush", daemon=True).start()
+
+    def _seed_tallies(self, c):
+        # Never below what was saved (peers may have seen it), and consistent with c.
+        saved = (self.load_tallies() if self.load_tallies else None) or {}
+        out = []
+        for k in self.KEYS:
+            inc, dec = saved.get(k, (0, 0))
+            inc = max(inc, c[k] + dec)
+            out += [inc, inc - c[k]]
+        return out
+
+    def _locked(self):
+        return _FileLock(self._fd)
+
+    # ----- reads -----
+    def _read_raw(self):
+        for _ in range(SEQLOCK_SPINS):
+            _, seq1, girls, boys, flushed, *tallies = self.LAYOUT.unpack_from(self._mm, 0)
+            if seq1 & 1:
+                continue
+            if self.LAYOUT.unpack_from(self._mm, 0)[1] == seq1:
+                return seq1, girls, boys, flushed, tallies
+        # A writer holds the lock for a long time or died mid-write: read under the lock.
+        with self._tlock, self._locked():
+            _, seq, girls, boys, flushed, *tallies = self._unpack_locked()
+        return seq, girls, boys, flushed, tallies
+
+    def _unpack_locked(self):
+        # The lock is held, so an odd seq means a writer died mid-write: make it
+        # even again, or every later write would leave it odd and readers
+        # would spin forever.
+        magic, seq, *rest = self.LAYOUT.unpack_from(self._mm, 0)
+        if seq & 1:
+            seq += 1
+            self._set_seq(seq)
+        return [magic, seq, *rest]
+
+    def _set_seq(self, seq):
+        # One 8-byte copy: pack_into zero-fills its target before writing, so a
+        # reader could briefly see seq 0 (even) and take the record as valid.
+        self._mm[8:16] = self.SEQ.pack(seq)
+
+    def _store(self, seq, *data):
+        """Seqlock write, lock held: odd seq, the fields after seq, then seq + 2."""
+        self._set_seq(seq + 1)
+        self.DATA.pack_into(self._mm, 16, *data)
+        self._set_seq(seq + 2)
+
+    def snapshot(self):
+        self._ensure_open()
+        metrics.inc("bathroom_counter_reads_total")
+        _, girls, boys, _, _ = self._read_raw()
+        return {"girls": girls, "boys": boys}
+
+    def tallies(self):
+        """{"girls": [increments, decrements], "boys": [...]}"""
+        self._ensure_open()
+        t = self._read_raw()[4]
+        return {"girls": t[0:2], "boys": t[2:4]}
+
+    def version(self):
+        """Monotonic change counter; bumps on every write."""
+        self._ensure_open()
+        return self._read_raw()[0] // 2
+
+    # ----- writes -----
+    def update(self, fn):
+        """Run ``fn(counters) -> counters`` under the cross-process lock and store the result."""
+        self._ensure_open()
+        metrics.inc("bathroom_counter_writes_total")
+        with self._tlock, self._locked():
+            _, seq, girls, boys, flushed, *tallies = self._unpack_locked()
+            values = fn({"girls": girls, "boys": boys})
+            for i, d in enumerate((values["girls"] - girls, values["boys"] - boys)):
+                tallies[2 * i + (d < 0)] += abs(d)
+            self._store(seq, values["girls"], values["boys"], flushed, *tallies)
+            return values
+
+    def absorb(self, tallies):
+        """Raise this node's tallies to ``tallies`` where those are higher (its
+        own state as remembered by a peer, after local state was lost); the
+        counters follow. Returns True if anything changed."""
+        self._ensure_open()
+        with self._tlock, self._locked():
+            _, seq, girls, boys, flushed, *old = self._unpack_locked()
+            new = [max(a, b) for a, b in zip(old, tallies["girls"] + tallies["boys"])]
+            if new == old:
+                return False
+            self._store(seq, new[0] - new[1], new[2] - new[3], flushed, *new)
+            return True
+
+    def apply(self, who, delta):
+        """Add ``delta``; returns (counters, delta actually applied after clamping)."""
+        applied = [0]
+
+        def fn(c):
+            new = max(0, c[who] + delta)  # clamp at 0 (no negatives)
+            applied[0] = new - c[who]
+            c[who] = new
+            return c
+        return self.update(fn), applied[0]
+
+    def add(self, who, delta):
+        return self.apply(who, delta)[0]
+
+    def set(self, counters):
+        return self.update(lambda c: {k: max(0, int(counters.get(k, 0))) for k in self.KEYS})
+
+    # ----- write-behind -----
+    def flush(self):
+        """Persist to storage if anything changed since the last flush (any worker)."""
+        self._ensure_open()
+        with self._tlock, self._locked():
+            magic, seq, girls, boys, flushed, *tallies = self._unpack_locked()
+            if seq == flushed:
+                return False
+            self.storage.save_counters({"girls": girls, "boys": boys})
+            self._store(seq, girls, boys, seq + 2, *tallies)
+            return True
+
+    def close(self):
+        """Flush and stop the write-behind thread; the mapping is freed with the store."""
+        if self._pid == os.getpid():
+            self.flush()
+        self._closed = True
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid and not self._closed:
+            sleep(self.flush_interval)
+            try:
+                self.flush()
+            except (OSError, db_error()) as e:
+                app.logger.warning("counter flush failed: %s", e)
+
+class _FileLock:
+    def __init__(self, fd):
+        self.fd = fd
+
+    def __enter__(self):
+        if fcntl:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+class LeaderLock:
+    """Picks one process per host for work that must not run once per worker:
+    the first to take the (non-blocking) lock on ``path`` keeps it until it exits."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+        self._pid = None
+
+    def held(self):
+        if self._pid == os.getpid() or not fcntl:
+            return True
+        _ensure_dir(self.path)
+        fh = open(self.path, "a")
+        try:
+            fcntl.lockf(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fh.close()
+            return False
+        self._fh, self._pid = fh, os.getpid()
+        return True
+
+_open_counter_stores = weakref.WeakSet()
+
+@atexit.register
+def _flush_counters_at_exit():
+    for store in list(_open_counter_stores):
+        if store._pid == os.getpid():
+            store.flush()
+
+# =================== OCCUPANCY ===================
+# Optional enter/exit tracking per bathroom, turned on by "occupancy" in
+# tenants.json or BATHROOM_CAPACITY (capacity per bathroom, 0 = no limit).
+# Like the counters, the state is an mmap'd file shared by all workers,
+# written under an fcntl lock and read lock-free (seqlock). Per bathroom:
+#   - a ring of the entry times of the students who are out. An exit closes
+#     the oldest one, and an entry older than OCCUPANCY_STALE_MIN counts as a
+#     forgotten exit and is dropped. Occupancy is the ring's length.
+#   - OCCUPANCY_WINDOW_MIN one-minute buckets, reused round-robin, holding
+#     visits, finished visits and their total time, for the rolling stats.
+# Every operation touches a fixed number of slots, however much history exists.
+OCCUPANCY_SHM = "occupancy.shm"
+OCCUPANCY_MAX = 32                     # most students out of one bathroom at once
+OCCUPANCY_WINDOW_MIN = 15              # rolling window for visits / average time out
+OCCUPANCY_STALE_MIN = 30               # an entry this old without an exit is dropped
+CAPACITY = os.getenv("BATHROOM_CAPACITY", "")  # "2" or "girls=2,boys=3"; turns occupancy on
+
+def parse_capacity(value):
+    """tenants.json "occupancy" / BATHROOM_CAPACITY -> {"girls": n, "boys": n}, or None (off)."""
+    if value is None or value is False or value == "":
+        return None
+    if value is True:
+        value = 0
+    if isinstance(value, str) and "=" in value:
+        value = dict(part.split("=", 1) for part in value.split(","))
+    if isinstance(value, dict):
+        return {k: max(0, int(value.get(k, 0))) for k in CounterStore.KEYS}
+    return {k: max(0, int(value)) for k in CounterStore.KEYS}
+
+class OccupancyStore:
+    """Students out of each bathroom plus rolling-window stats, shared by all workers."""
+    MAGIC = b"BROCC001"
+    HEADER = struct.Struct("<8sQ")  # magic, seq (odd while a write is in progress)
+    # head, count, entry times ring, then (minute, visits, finished, seconds) per bucket
+    ROOM = struct.Struct(f"<II{OCCUPANCY_MAX}d" + "qqqd" * OCCUPANCY_WINDOW_MIN)
+    KEYS = CounterStore.KEYS
+
+    def __init__(self, shm_path, capacity):
+        self.shm_path = shm_path
+        self.capacity = capacity
+        self.size = self.HEADER.size + self.ROOM.size * len(self.KEYS)
+        self._pid = None
+        self._tlock = threading.Lock()
+        self._fh = None
+        self._mm = None
+
+    def _ensure_open(self):
+        if self._pid == os.getpid():
+            return
+        with self._tlock:
+            if self._pid == os.getpid():
+                return
+            _ensure_dir(self.shm_path)
+            self._fh = os.fdopen(os.open(self.shm_path, os.O_RDWR | os.O_CREAT, 0o644), "r+b", buffering=0)
+            with _FileLock(self._fh.fileno()):
+                if os.fstat(self._fh.fileno()).st_size != self.size:
+                    os.ftruncate(self._fh.fileno(), 0)  # new file, or the layout changed
+                    os.ftruncate(self._fh.fileno(), self.size)
+                mm = mmap.mmap(self._fh.fileno(), self.size)
+                if mm[:8] != self.MAGIC:
+                    mm[:self.HEADER.size] = self.HEADER.pack(self.MAGIC, 0)
+                self._mm = mm
+                self._seq_locked()
+            self._pid = os.getpid()
+
+    def _offset(self, i):
+        return self.HEADER.size + i * self.ROOM.size
+
+    def _read(self):
+        for _ in range(SEQLOCK_SPINS):
+            seq1 = self.HEADER.unpack_from(self._mm, 0)[1]
+            if seq1 & 1:
+                continue
+            raw = self._mm[:self.size]
+            if self.HEADER.unpack_from(self._mm, 0)[1] == seq1:
+                return seq1, self._rooms(raw)
+        # A writer holds the lock for a long time or died mid-write: read under the lock.
+        with self._tlock, _FileLock(self._fh.fileno()):
+            return self._seq_locked(), self._rooms(self._mm)
+
+    def _rooms(self, buf):
+        return [list(self.ROOM.unpack_from(buf, self._offset(i))) for i in range(len(self.KEYS))]
+
+    def _seq_locked(self):
+        # Lock held, so an odd seq means a writer died mid-write (see
+        # CounterStore._unpack_locked): make it even again so readers don't spin.
+        seq = self.HEADER.unpack_from(self._mm, 0)[1]
+        if seq & 1:
+            seq += 1
+            self._set_seq(seq)
+        return seq
+
+    def _set_seq(self, seq):
+        self._mm[8:16] = CounterStore.SEQ.pack(seq)  # one copy, see CounterStore._set_seq
+
+    def _write(self, fn):
+        self._ensure_open()
+        with self._tlock, _FileLock(self._fh.fileno()):
+            seq = self._seq_locked()
+            rooms = self._rooms(self._mm)
+            result = fn(rooms)
+            self._set_seq(seq + 1)
+            for i, room in enumerate(rooms):
+                self.ROOM.pack_into(self._mm, self._offset(i), *room)
+            self._set_seq(seq + 2)
+            return result
+
+    def version(self):
+        self._ensure_open()
+        return self._read()[0] // 2
+
+    def event(self, who, kind, ts=None):
+        """Record an "enter" or "exit" (epoch seconds). Returns False for an
+        exit while nobody is out, which changes nothing."""
+        ts = wall_time() if ts is None else ts
+        i = self.KEYS.index(who)
+
+        def fn(rooms):
+            room = rooms[i]
+            _expire(room, ts - OCCUPANCY_STALE_MIN * 60)
+            b = _bucket(room, ts)
+            if kind == "enter":
+                if room[1] == OCCUPANCY_MAX:
+                    _pop(room)  # the ring is full: assume the oldest came back unseen
+                room[2 + (room[0] + room[1]) % OCCUPANCY_MAX] = ts
+                room[1] += 1
+                if b is not None:
+                    room[b + 1] += 1
+                return True
+            if not room[1]:
+                return False
+            seconds = ts - _pop(room)
+            if b is not None:
+                room[b + 2] += 1
+                room[b + 3] += seconds
+            return True
+        return self._write(fn)
+
+    def reset(self):
+        def fn(rooms):
+            for room in rooms:
+                room[:] = [0] * len(room)
+        self._write(fn)
+
+    def snapshot(self, ts=None):
+        """{"window_min": N, who: {"occupancy", "capacity", "full", "recent_visits", "avg_minutes"}}"""
+        self._ensure_open()
+        ts = wall_time() if ts is None else ts
+        _, rooms = self._read()
+        out = {"window_min": OCCUPANCY_WINDOW_MIN}
+        stale = ts - OCCUPANCY_STALE_MIN * 60
+        minute = int(ts // 60)
+        for who, room in zip(self.KEYS, rooms):
+            head, count = room[0], room[1]
+            inside = sum(1 for k in range(count) if room[2 + (head + k) % OCCUPANCY_MAX] >= stale)
+            visits = finished = seconds = 0
+            for j in range(OCCUPANCY_WINDOW_MIN):
+                b = 2 + OCCUPANCY_MAX + 4 * j
+                if minute - OCCUPANCY_WINDOW_MIN < room[b] <= minute:
+                    visits += room[b + 1]
+                    finished += room[b + 2]
+                    seconds += room[b + 3]
+            capacity = self.capacity[who]
+            out[who] = {
+                "occupancy": inside,
+                "capacity": capacity,
+                "full": bool(capacity) and inside >= capacity,
+                "recent_visits": visits,
+                "avg_minutes": round(seconds / finished / 60, 1) if finished else None,
+            }
+        return out
+
+def _pop(room):
+    """Oldest entry time off a room's ring."""
+    ts = room[2 + room[0]]
+    room[0] = (room[0] + 1) % OCCUPANCY_MAX
+    room[1] -= 1
+    return ts
+
+def _expire(room, before):
+    while room[1] and room[2 + room[0]] < before:
+        _pop(room)
+
+def _bucket(room, ts):
+    """Index of the bucket for ``ts``'s minute in a room, cleared if it last held
+    an older minute; None if it already holds a newer one (a late event)."""
+    minute = int(ts // 60)
+    b = 2 + OCCUPANCY_MAX + 4 * (minute % OCCUPANCY_WINDOW_MIN)
+    if room[b] > minute:
+        return None
+    if room[b] != minute:
+        room[b:b + 4] = [minute, 0, 0, 0.0]
+    return b
+
+def bathroom_states(status, occupancy):
+    """Per bathroom: the schedule's status, or FULL while it is OPEN and at capacity."""
+    return {who: "FULL" if status == "OPEN" and occupancy[who]["full"] else status
+            for who in OccupancyStore.KEYS}
+
+# =================== PEER SYNC ===================
+# Optional combined counters across kiosk hosts (one per building), with no
+# central server. Each host ("node") keeps its own counters as a PN-counter:
+# grow-only increments and decrements per counter (tallied by CounterStore).
+# Every SYNC_INTERVAL seconds one worker per host posts the tallies of every
+# node it knows to each peer in BATHROOM_PEERS (or "peers" in tenants.json)
+# and merges the peer's answer: per node, the larger of each tally wins, so
+# merging is order-free, repeatable and O(nodes). The combined count is the
+# sum over nodes of increments - decrements. Remote tallies are kept in
+# peers.json, so a host that is down simply catches up when it is back.
+# Resetting counters only clears this host's share of the total.
+PEERS = os.getenv("BATHROOM_PEERS", "")  # "http://10.0.1.12:5050,http://10.0.2.7:5050"
+PEERS_JSON = "peers.json"
+PEER_KEY = os.getenv("BATHROOM_PEER_KEY", "")  # shared secret for /api/peer/state (else: peers' addresses only)
+NODE_ID_FILE = "node_id"
+SYNC_INTERVAL = float(os.getenv("BATHROOM_SYNC_INTERVAL", "5"))  # seconds between exchanges
+SYNC_TIMEOUT = 2.0                     # seconds per peer request
+SYNC_MAX_NODES = 256                   # nodes kept in peers.json (and accepted in one exchange)
+SYNC_RESOLVE_INTERVAL = 60.0           # seconds before peer host names are looked up again
+
+_node_id = None
+
+def node_id():
+    """This host's id: BATHROOM_NODE_ID, or a random one saved in NODE_ID_FILE on first use."""
+    global _node_id
+    if _node_id is None:
+        nid = os.getenv("BATHROOM_NODE_ID", "")
+        if not nid:
+            try:
+                with open(NODE_ID_FILE, "x", encoding="utf-8") as f:
+                    f.write(os.urandom(6).hex())
+            except FileExistsError:
+                pass
+            with open(NODE_ID_FILE, encoding="utf-8") as f:
+                nid = f.read().strip()
+        _node_id = nid
+    return _node_id
+
+def parse_tallies(nodes):
+    """Validate {node: {"girls": [inc, dec], "boys": [inc, dec]}} from a peer."""
+    if not isinstance(nodes, dict) or len(nodes) > SYNC_MAX_NODES:
+        raise ValueError("nodes must be an object of at most %d nodes" % SYNC_MAX_NODES)
+    out = {}
+    for node, t in nodes.items():
+        out[str(node)[:64]] = {k: [max(0, int(t[k][0])), max(0, int(t[k][1]))] for k in CounterStore.KEYS}
+    return out
+
+class PeerSync:
+    """One tenant's replicated counters: local tallies (shared memory) plus
+    every other node's, as last merged into ``path`` by any worker."""
 
-def save_counters(counters):
-    with open(COUNTERS_JSON, "w", encoding="utf-8") as f:
-        json.dump({"girls": int(counters["girls"]), "boys": int(counters["boys"])}, f)
+    def __init__(self, tenant, peers, path):
+        self.tenant = tenant
+        if isinstance(peers, str):
+            peers = peers.split(",")
+        self.peers = [p.strip().rstrip("/") for p in peers if p.strip()]
+        self.path = path
+        self._remote = CachedFile(lambda: file_version(self.path), self._load)
+        self._down = set()  # peers whose last exchange failed, to log changes only
+        self._addrs = (None, set())  # (monotonic time resolved, peer IP addresses)
+        self._full = False  # SYNC_MAX_NODES reached (logged once)
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()  # the file lock doesn't exclude threads
+        self._wake = threading.Event()
+        self._pid = None
+        self.leader = LeaderLock(path + ".leader")
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return parse_tallies(json.load(f).get("nodes", {}))
+        except FileNotFoundError:
+            return {}
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
+            app.logger.error("peer state %s is unreadable (%s); starting over", self.path, e)
+            return {}
+
+    def own_tallies(self):
+        """This node's tallies as last saved, to seed the counters from."""
+        return self._load().get(node_id())
+
+    def state(self):
+        nodes = {n: t for n, t in self._remote.get()[1].items() if n != node_id()}
+        nodes[node_id()] = self.tenant.counters.tallies()
+        return nodes
+
+    def totals(self):
+        out = dict.fromkeys(CounterStore.KEYS, 0)
+        for t in self.state().values():
+            for k in out:
+                out[k] += t[k][0] - t[k][1]
+        return out
+
+    def version(self):
+        return self.tenant.counters.version(), self._remote.get()[0]
+
+    def allows(self, addr):
+        """Whether ``addr`` is a configured peer's (without PEER_KEY, only
+        they may exchange state with us)."""
+        import socket
+        import urllib.parse
+        resolved, addrs = self._addrs
+        if addr in addrs:
+            return True
+        if resolved is not None and monotonic() - resolved < SYNC_RESOLVE_INTERVAL:
+            return False
+        addrs = set()
+        for peer in self.peers:
+            try:
+                host = urllib.parse.urlsplit(peer).hostname
+                addrs.update(info[4][0] for info in socket.getaddrinfo(host, None))
+            except (OSError, ValueError, UnicodeError):
+                pass
+        self._addrs = (monotonic(), addrs)
+        return addr in addrs
+
+    def merge(self, nodes, own=False):
+        """Merge tallies from a peer into peers.json. With ``own`` (an answer
+        from a peer we called), also take our own node's tallies should the
+        peer remember more of them than we do; anyone else's claims about
+        this node are ignored. Returns True if anything changed."""
+        me = node_id()
+        nodes = dict(nodes)
+        claimed = nodes.pop(me, None)
+        changed = False
+        _ensure_dir(self.path)
+        with self._merge_lock, open(self.path + ".lock", "a") as lock, _FileLock(lock.fileno()):
+            if own and claimed:
+                changed = self.tenant.counters.absorb(claimed)
+            known = self._load()
+            for node, t in nodes.items():
+                old = known.get(node)
+                if old is None and len(known) + (me not in known) >= SYNC_MAX_NODES:
+                    if not self._full:
+                        self._full = True
+                        app.logger.warning("peer state is full (%d nodes); ignoring new nodes", SYNC_MAX_NODES)
+                    continue
+                new = {k: [max(a, b) for a, b in zip(t[k], old[k])] for k in t} if old else t
+                if new != old:
+                    known[node], changed = new, True
+            mine = self.tenant.counters.tallies()
+            if changed or known.get(me) != mine:
+                known[me] = mine  # saved before it is ever sent, for seeding
+                write_json_atomic(self.path, {"node": me, "nodes": known})
+                self._remote.invalidate()
+        if changed:
+            self.tenant.hub.poke()
+        return changed
+
+    def exchange(self, peer):
+        import urllib.request
+        body = json.dumps({"node": node_id(), "nodes": self.state()}).encode()
+        req = urllib.request.Request(peer + "/api/peer/state", body, {"Content-Type": "application/json"})
+        if PEER_KEY:
+            req.add_header("X-Peer-Key", PEER_KEY)
+        with urllib.request.urlopen(req, timeout=SYNC_TIMEOUT) as resp:
+            self.merge(parse_tallies(json.load(resp)["nodes"]), own=True)
+
+    def sync_once(self):
+        self.merge({})  # save our own tallies before peers can see them
+        for peer in self.peers:
+            try:
+                self.exchange(peer)
+            except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+                if peer not in self._down:
+                    self._down.add(peer)
+                    app.logger.warning("peer %s unreachable: %s", peer, e)
+            else:
+                if peer in self._down:
+                    self._down.discard(peer)
+                    app.logger.info("peer %s is back", peer)
+
+    def ensure_running(self):
+        """Start the exchange loop in this process; only the worker holding
+        the leader lock actually talks to peers."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name=f"peer-sync-{self.tenant.id}", daemon=True).start()
+
+    def stop(self):
+        self._pid = None
+        self._wake.set()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                if self.leader.held():
+                    self.sync_once()
+            except Exception:
+                app.logger.exception("peer sync failed")
+            self._wake.wait(SYNC_INTERVAL)
+
+# =================== STORAGE (Backends) ===================
+# A tenant keeps its schedules and counter snapshot in one of two backends,
+# chosen with "storage" in tenants.json or BATHROOM_STORAGE:
+#   json   - schedules.json + counters.json, written atomically (the simple mode)
+#   sqlite - one STORAGE_DB per tenant (WAL) that also keeps every saved
+#            schedule as a revision the admin can restore
+# `python app.py migrate` copies the JSON files of every tenant into SQLite.
+# Both backends offer the same methods: load_schedules() (None if nothing is
+# stored yet), save_schedules(data, note), update_schedules(fn, note) (a locked
+# read-modify-write), schedules_version(), schedule_rows(day_keys),
+# revisions(), revision(id), load_counters(), save_counters(counters).
+SCHEDULE_REVISIONS_KEEP = 200          # newest schedule revisions kept in SQLite
+
+class _NoDBError(Exception):
+    pass
+
+def db_error():
+    """sqlite3.Error for except clauses, without importing sqlite3 on hosts
+    that never open a database (nothing raises it before one is opened)."""
+    mod = sys.modules.get("sqlite3")
+    return mod.Error if mod else _NoDBError
+
+class SqliteDB:
+    """One connection per thread (and per process, for forked workers) to a
+    SQLite file in WAL mode. sqlite3 keeps compiled statements per connection,
+    so the fixed SQL strings below are only prepared once per worker thread."""
+    SCHEMA = ""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            import sqlite3  # JSON-only kiosks start without it
+            _ensure_dir(self.path)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def transaction(self):
+        return _Transaction(self._conn())
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK on an autocommit connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+class JsonStorage:
+    """schedules.json + counters.json; no revision history."""
+    kind = "json"
+
+    def __init__(self, schedules_path, counters_path):
+        self.schedules_path = schedules_path
+        self.counters_path = counters_path
+        self._lock = threading.Lock()  # fcntl locks don't exclude threads of one process
+
+    def schedules_version(self):
+        return file_version(self.schedules_path)
+
+    @storage_op("load_schedules", "bathroom_schedule_reads_total")
+    def load_schedules(self):
+        if not os.path.exists(self.schedules_path):
+            return None
+        with open(self.schedules_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @storage_op("save_schedules", "bathroom_schedule_writes_total")
+    def save_schedules(self, data, note=""):
+        write_json_atomic(self.schedules_path, data, indent=2)
+
+    @storage_op("update_schedules", "bathroom_schedule_writes_total")
+    def update_schedules(self, fn, note=""):
+        _ensure_dir(self.schedules_path)
+        with self._lock, open(self.schedules_path + ".lock", "ab") as lock, _FileLock(lock.fileno()):
+            data = fn(self.load_schedules())
+            write_json_atomic(self.schedules_path, data, indent=2)
+            return data
+
+    def schedule_rows(self, day_keys):
+        """(day, label, is_class, start, end) in schedule order."""
+        data = self.load_schedules() or {}
+        for key in day_keys:
+            for r in data.get(key, []):
+                yield key, r["label"], int(r["is_class"]), r["start"], r["end"]
+
+    def revisions(self, limit=20, tz=None):
+        return []
+
+    def revision(self, rev_id):
+        return None
+
+    @storage_op("load_counters")
+    def load_counters(self):
+        return load_counters(self.counters_path)
+
+    @storage_op("save_counters", "bathroom_counter_flushes_total")
+    def save_counters(self, counters):
+        save_counters(counters, self.counters_path)
+
+STORAGE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedule_rows (
+    day_key TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    is_class INTEGER NOT NULL,
+    start TEXT NOT NULL,
+    "end" TEXT NOT NULL,
+    PRIMARY KEY (day_key, pos)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS revisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    note TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    who TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+class SqliteStorage(SqliteDB):
+    """Schedules as rows plus a JSON revision per save, and the counter snapshot.
+
+    The newest revision is the schedule (one row to read, key order kept);
+    ``schedule_rows`` mirrors it so exports stream straight from a query.
+    Its id is the schedule version, so other workers notice a save with one
+    cheap SELECT.
+    """
+    kind = "sqlite"
+    SCHEMA = STORAGE_SCHEMA
+
+    def schedules_version(self):
+        return self._conn().execute("SELECT max(id) FROM revisions").fetchone()[0]
+
+    @storage_op("load_schedules", "bathroom_schedule_reads_total")
+    def load_schedules(self, conn=None):
+        conn = conn or self._conn()
+        row = conn.execute("SELECT data FROM revisions ORDER BY id DESC LIMIT 1").fetchone()
+        return json.loads(row[0]) if row else None
+
+    @storage_op("save_schedules", "bathroom_schedule_writes_total")
+    def save_schedules(self, data, note=""):
+        with self.transaction() as conn:
+            self._write(conn, data, note)
+
+    @storage_op("update_schedules", "bathroom_schedule_writes_total")
+    def update_schedules(self, fn, note=""):
+        with self.transaction() as conn:  # BEGIN IMMEDIATE: one writer at a time
+            data = fn(self.load_schedules(conn))
+            self._write(conn, data, note)
+            return data
+
+    def _write(self, conn, data, note):
+        rows = [(key, pos, r["label"], int(r["is_class"]), r["start"], r["end"])
+                for key, blocks in data.items() for pos, r in enumerate(blocks)]
+        conn.execute("DELETE FROM schedule_rows")
+        conn.executemany(
+            'INSERT INTO schedule_rows (day_key, pos, label, is_class, start, "end") '
+            "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        rev = conn.execute("INSERT INTO revisions (ts, note, data) VALUES (?, ?, ?)",
+                           (datetime.now().timestamp(), note, json.dumps(data))).lastrowid
+        conn.execute("DELETE FROM revisions WHERE id <= ?", (rev - SCHEDULE_REVISIONS_KEEP,))
+
+    def schedule_rows(self, day_keys):
+        conn = self._conn()
+        for key in day_keys:
+            yield from conn.execute(
+                'SELECT day_key, label, is_class, start, "end" FROM schedule_rows '
+                "WHERE day_key = ? ORDER BY pos", (key,))
+
+    def revisions(self, limit=20, tz=None):
+        """Newest first: (id, datetime, note)."""
+        return [(rid, datetime.fromtimestamp(ts, tz), note) for rid, ts, note in self._conn().execute(
+            "SELECT id, ts, note FROM revisions ORDER BY id DESC LIMIT ?", (limit,))]
+
+    def revision(self, rev_id):
+        row = self._conn().execute("SELECT data FROM revisions WHERE id = ?", (rev_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @storage_op("load_counters")
+    def load_counters(self):
+        counters = {"girls": 0, "boys": 0}
+        counters.update(self._conn().execute("SELECT who, value FROM counters"))
+        return counters
+
+    @storage_op("save_counters", "bathroom_counter_flushes_total")
+    def save_counters(self, counters):
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO counters (who, value) VALUES (?, ?) "
+                "ON CONFLICT (who) DO UPDATE SET value = excluded.value",
+                [(k, int(counters[k])) for k in ("girls", "boys")])
+
+def migrate_to_sqlite(force=False):
+    """Copy schedules and counters of every configured tenant from their JSON
+    files into SQLite. Tenants whose database already has a schedule are
+    skipped unless ``force``. Returns the number of tenants migrated."""
+    migrated = 0
+    for tid in [DEFAULT_TENANT] + [t for t in _tenant_configs if t != DEFAULT_TENANT]:
+        cfg = _tenant_configs.get(tid, {})
+        src = Tenant(tid, dict(cfg, storage="json")).storage
+        dst = Tenant(tid, dict(cfg, storage="sqlite")).storage
+        if dst.load_schedules() is not None and not force:
+            print(f"{tid}: {dst.path} already has a schedule, skipped (--force to overwrite)")
+            continue
+        schedules = src.load_schedules()
+        if schedules is not None:
+            dst.save_schedules(schedules, note=f"migrated from {src.schedules_path}")
+        if os.path.exists(src.counters_path):
+            dst.save_counters(src.load_counters())
+        print(f"{tid}: {src.schedules_path}, {src.counters_path} -> {dst.path}")
+        migrated += 1
+    return migrated
+
+# =================== VISIT LOG ===================
+# Every counter press is appended to a per-tenant SQLite log (WAL mode) and, in
+# the same transaction, folded into `usage`: net visits per (day, period, open
+# window, gender). Analytics read `usage` only, so they cost the same with a
+# hundred events or millions.
+EVENTS_DB = "events.db"
+
+VISIT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    who TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    period TEXT NOT NULL,
+    open_window TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    period TEXT NOT NULL,
+    open_window TEXT NOT NULL,
+    who TEXT NOT NULL,
+    visits INTEGER NOT NULL,
+    PRIMARY KEY (day, period, open_window, who)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ops (
+    id TEXT PRIMARY KEY,
+    ts REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+class VisitLog(SqliteDB):
+    """Append-only counter-press log with incrementally maintained aggregates."""
+    SCHEMA = VISIT_SCHEMA
+
+    @staticmethod
+    def insert(conn, now, who, delta, period, window):
+        day = now.date().isoformat()
+        conn.execute(
+            "INSERT INTO events (ts, who, delta, day, period, open_window) VALUES (?, ?, ?, ?, ?, ?)",
+            (now.timestamp(), who, delta, day, period, window))
+        conn.execute(
+            "INSERT INTO usage (day, period, open_window, who, visits) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (day, period, open_window, who) DO UPDATE SET visits = visits + excluded.visits",
+            (day, period, window, who, delta))
+
+    def record(self, now, who, delta, period, window):
+        with self.transaction() as conn:
+            self.insert(conn, now, who, delta, period, window)
+
+    @staticmethod
+    def claim_op(conn, op_id, ts):
+        """True the first time ``op_id`` is seen (idempotent batch ops)."""
+        return conn.execute("INSERT OR IGNORE INTO ops (id, ts) VALUES (?, ?)", (op_id, ts)).rowcount == 1
+
+    @staticmethod
+    def prune_ops(conn, before_ts):
+        conn.execute("DELETE FROM ops WHERE ts < ?", (before_ts,))
+
+    def usage(self, first, last):
+        """Aggregated rows (day, period, open_window, who, visits) for a date range."""
+        return self._conn().execute(
+            "SELECT day, period, open_window, who, visits FROM usage "
+            "WHERE day BETWEEN ? AND ? AND visits != 0 ORDER BY day",
+            (first.isoformat(), last.isoformat())).fetchall()
+
+def record_visit(tenant, now, who, delta):
+    """Log a counter change with the period/open window it happened in."""
+    if not delta:
+        return
+    tl = tenant.get_timeline(now.date())
+    try:
+        tenant.visits.record(now, who, delta, tl.period_at(now), tl.window_at(now))
+    except db_error() as e:
+        # Analytics must never cost a kiosk its counter press.
+        app.logger.error("visit log write failed: %s", e)
 
 # =================== HELPERS ===================
 def parse_hhmm(s):
     h, m = s.split(":")
     return time(int(h), int(m))
 
-def as_dt(now_date, t):
-    return datetime.combine(now_date, t, tzinfo=TZ)
+def as_dt(now_date, t, tz=TZ):
+    return datetime.combine(now_date, t, tzinfo=tz)
+
+def fmt_next_change(next_dt, now):
+    if next_dt is None:
+        return None
+    if next_dt.date() == now.date():
+        return next_dt.strftime("%-I:%M %p")
+    if next_dt.date() == now.date() + timedelta(days=1):
+        return next_dt.strftime("tomorrow %-I:%M %p")
+    if next_dt.date() < now.date() + timedelta(days=7):
+        return next_dt.strftime("%A %-I:%M %p")
+    return next_dt.strftime("%a %b %-d, %-I:%M %p")
+
+def iter_csv(header, rows):
+    """CSV text for a streamed response, one chunk per row."""
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(header)
+    for row in rows:
+        w.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
 
 # =================== CORE LOGIC ===================
-def today_schedule(now, schedules):
-    key = WEEKDAY_TO_KEY.get(now.weekday())
+def today_schedule(now, schedules, tenant=None):
+    tenant = tenant or current_tenant()
+    day = now.date() if isinstance(now, datetime) else now
+    key, _ = tenant.get_calendar().resolve(day)
     if not key:
         return []
-    # Convert to list of tuples with parsed times
-    rows = []
-    for r in schedules.get(key, []):
-        rows.append((r["label"], bool(int(r["is_class"])), parse_hhmm(r["start"]), parse_hhmm(r["end"])))
-    return rows
-
-def compute_open_windows_for_today(now, schedules):
-    sched = today_schedule(now, schedules)
-    if not sched:
-        return []
+    return parse_rows(schedules.get(key, []))
+
+def parse_rows(blocks):
+    """Stored blocks -> [(label, is_class, start time, end time)]."""
+    return [(r["label"], bool(int(r["is_class"])), parse_hhmm(r["start"]), parse_hhmm(r["end"])) for r in blocks]
+
+def compute_open_windows_for_today(now, schedules=None):
+    if schedules is None:
+        return get_timeline(now.date()).open_blocks
+    return compile_timeline(now.date(), schedules).open_blocks
+
+def current_status(now, schedules=None):
+    if schedules is None:
+        return get_timeline(now.date()).status_at(now)
+    return compile_timeline(now.date(), schedules).status_at(now)
+
+# =================== CALENDAR ===================
+# Optional per-tenant calendar.json on top of the weekday -> day key map:
+#   {"overrides": {"2025-10-03": "minimum", "2026-05-11..2026-05-15": "testing"},
+#    "holidays":  {"2025-11-11": "Veterans Day", "2025-12-22..2026-01-02": "Winter Break"},
+#    "lookahead_days": 14}
+# Override values name a schedule template (any key in schedules.json). A
+# range override only covers the weekdays that normally have school (so a
+# two-week range leaves the weekend off); a single date applies as given.
+# Single dates beat ranges, later-starting ranges beat earlier ones, and a
+# holiday beats an override on the same footing.
+CALENDAR_JSON = "calendar.json"
+CALENDAR_LOOKAHEAD_DAYS = 14   # how far ahead to search for the next school day
+CALENDAR_MAX_RANGE_DAYS = 400  # longest accepted "from..to" range
+
+def parse_date_spec(spec):
+    """"YYYY-MM-DD" or "YYYY-MM-DD..YYYY-MM-DD" -> (first, last) dates, inclusive."""
+    first, _, last = spec.partition("..")
+    first = date.fromisoformat(first.strip())
+    last = date.fromisoformat(last.strip()) if last else first
+    if last < first or (last - first).days > CALENDAR_MAX_RANGE_DAYS:
+        raise ValueError(f"bad date range: {spec!r}")
+    return first, last
+
+class Calendar:
+    """Date -> (template key, holiday name), expanded up front so resolve() is a dict lookup."""
+
+    def __init__(self, weekday_to_key, data=None):
+        data = data or {}
+        self.weekday_to_key = weekday_to_key
+        self.lookahead_days = int(data.get("lookahead_days", CALENDAR_LOOKAHEAD_DAYS))
+        entries = []
+        for kind, rank in (("overrides", 0), ("holidays", 1)):
+            for spec, value in (data.get(kind) or {}).items():
+                first, last = parse_date_spec(spec)
+                entry = (str(value), None) if kind == "overrides" else (None, str(value))
+                entries.append((first == last, first, rank, last, entry))
+        # Apply least specific first so later writes win.
+        self.by_date = {}
+        for single, first, _, last, entry in sorted(entries, key=lambda e: e[:3]):
+            for i in range((last - first).days + 1):
+                d = first + timedelta(days=i)
+                if single or entry[0] is None or weekday_to_key.get(d.weekday()):
+                    self.by_date[d] = entry
+        self.templates = sorted({k for k, _ in self.by_date.values() if k})
+
+    def resolve(self, day):
+        """(schedule key or None, holiday name or None) for ``day``."""
+        hit = self.by_date.get(day)
+        if hit is not None:
+            return hit
+        return self.weekday_to_key.get(day.weekday()), None
+
+def load_calendar(tenant):
+    if not os.path.exists(tenant.calendar_path):
+        return Calendar(tenant.weekday_to_key)
+    try:
+        with open(tenant.calendar_path, "r", encoding="utf-8") as f:
+            calendar = Calendar(tenant.weekday_to_key, json.load(f))
+    except (ValueError, TypeError, AttributeError) as e:
+        # A broken calendar must not take the kiosk down; fall back to weekdays.
+        app.logger.error("ignoring %s: %s", tenant.calendar_path, e)
+        return Calendar(tenant.weekday_to_key)
+    schedules = tenant.get_schedules()[1]
+    missing = [k for k in calendar.templates if not schedules.get(k)]
+    if missing:
+        app.logger.warning("%s names template(s) with no blocks yet: %s (those days show as no school)",
+                           tenant.calendar_path, ", ".join(missing))
+    return calendar
+
+def next_school_start(day, schedules, tenant):
+    """First block start on the next school day after ``day``, within the lookahead."""
+    for i in range(1, tenant.get_calendar().lookahead_days + 1):
+        d = day + timedelta(days=i)
+        rows = today_schedule(d, schedules, tenant)
+        if rows:
+            return as_dt(d, rows[0][2], tenant.tz)
+    return None
+
+# =================== COMPILED TIMELINE ===================
+class Timeline:
+    """OPEN/CLOSED segments for one date, compiled once per schedule version.
+
+    ``starts[i]`` is the instant ``segments[i]`` begins; each segment is the
+    ``(status, reason, next_change)`` tuple returned by current_status() and
+    holds until ``starts[i + 1]``. ``starts`` are the day's transition instants.
+    ``periods[i]`` is the schedule block (or gap) label for the same segment.
+    """
+    __slots__ = ("date", "version", "starts", "segments", "periods", "open_blocks", "_open_starts")
+
+    def __init__(self, date, version, starts, segments, periods, open_blocks):
+        self.date = date
+        self.version = version
+        self.starts = starts
+        self.segments = segments
+        self.periods = periods
+        self.open_blocks = open_blocks
+        self._open_starts = [b[0] for b in open_blocks]
+
+    def index_at(self, now):
+        return max(0, bisect_right(self.starts, now) - 1)
+
+    def status_at(self, now):
+        return self.segments[self.index_at(now)]
+
+    def next_transition(self, now):
+        """Instant of the next segment boundary after ``now`` (same date), or None."""
+        i = self.index_at(now) + 1
+        return self.starts[i] if i < len(self.starts) else None
+
+    def period_at(self, now):
+        return self.periods[self.index_at(now)]
+
+    def window_at(self, now):
+        """Label of the open window containing ``now``, or "" while closed/outside."""
+        i = bisect_right(self._open_starts, now) - 1
+        if i >= 0 and now < self.open_blocks[i][1]:
+            return self.open_blocks[i][2]
+        return ""
+
+def _open_blocks(day, blocks):
     open_blocks = []
 
     def add_block(s_dt, e_dt, label):
         if e_dt > s_dt:
             open_blocks.append((s_dt, e_dt, label))
 
-    for i, (label, is_class, s, e) in enumerate(sched):
-        s_dt, e_dt = as_dt(now.date(), s), as_dt(now.date(), e)
+    for i, (label, is_class, s_dt, e_dt, closed_min) in enumerate(blocks):
         if is_class:
-            add_block(s_dt + timedelta(minutes=CLOSED_MIN),
-                      e_dt - timedelta(minutes=CLOSED_MIN),
+            add_block(s_dt + timedelta(minutes=closed_min),
+                      e_dt - timedelta(minutes=closed_min),
                       f"{label} (middle of class)")
         else:
             add_block(s_dt, e_dt, label)
 
-        if i < len(sched) - 1:
-            next_s = as_dt(now.date(), sched[i+1][2])
-            add_block(e_dt, next_s, "Passing time")
+        if i < len(blocks) - 1:
+            add_block(e_dt, blocks[i+1][2], "Passing time")
 
     return sorted(open_blocks, key=lambda x: x[0])
 
-def current_status(now, schedules):
-    sched = today_schedule(now, schedules)
-    if not sched:
-        return ("OUTSIDE", "No school today", None)
-
-    blocks = []
-    for label, is_class, s, e in sched:
-        s_dt, e_dt = as_dt(now.date(), s), as_dt(now.date(), e)
-        blocks.append((label, is_class, s_dt, e_dt))
-
-    day_start = blocks[0][2]
-    day_end = blocks[-1][3]
-
-    if now < day_start:
-        return ("OUTSIDE", "Before school hours", day_start)
-    if now >= day_end:
-        return ("OUTSIDE", "After school hours", None)
-
-    for (label, is_class, s_dt, e_dt) in blocks:
-        if s_dt <= now < e_dt:
-            if is_class:
-                if now < s_dt + timedelta(minutes=CLOSED_MIN):
-                    return ("CLOSED", f"{label}: first {CLOSED_MIN} min", s_dt + timedelta(minutes=CLOSED_MIN))
-                if now >= e_dt - timedelta(minutes=CLOSED_MIN):
-                    return ("CLOSED", f"{label}: last {CLOSED_MIN} min", e_dt)
-                return ("OPEN", f"{label}: middle of class", e_dt - timedelta(minutes=CLOSED_MIN))
+def _block_status(label, is_class, s_dt, e_dt, closed_min, now):
+    if is_class:
+        if now < s_dt + timedelta(minutes=closed_min):
+            return ("CLOSED", f"{label}: first {closed_min} min", s_dt + timedelta(minutes=closed_min))
+        if now >= e_dt - timedelta(minutes=closed_min):
+            return ("CLOSED", f"{label}: last {closed_min} min", e_dt)
+        return ("OPEN", f"{label}: middle of class", e_dt - timedelta(minutes=closed_min))
+    return ("OPEN", f"{label}", e_dt)
+
+def compile_timeline(day, schedules, version=None, tenant=None):
+    tenant = tenant or current_tenant()
+    rows = today_schedule(day, schedules, tenant)
+    if not rows:
+        _, holiday = tenant.get_calendar().resolve(day)
+        reason = f"No school today – {holiday}" if holiday else "No school today"
+        return Timeline(day, version, [as_dt(day, time.min, tenant.tz)],
+                        [("OUTSIDE", reason, next_school_start(day, schedules, tenant))], ["No school"], [])
+    starts, segments, periods, open_blocks = compile_day(day, rows, tenant.tz, tenant.closed_min)
+    segments.append(("OUTSIDE", "After school hours", next_school_start(day, schedules, tenant)))
+    periods.append("After school")
+    return Timeline(day, version, starts, segments, periods, open_blocks)
+
+def compile_day(day, rows, tz, closed_min, period_closed_min=None):
+    """The status rules for one school day's ``rows`` (from today_schedule()),
+    as (starts, segments, periods, open_blocks) up to the last block's end;
+    the caller adds the after-school segment. ``period_closed_min`` maps block
+    labels to their own closed minutes (the what-if simulator uses it)."""
+    period_closed_min = period_closed_min or {}
+    midnight = as_dt(day, time.min, tz)
+    blocks = [(label, is_class, as_dt(day, s, tz), as_dt(day, e, tz), period_closed_min.get(label, closed_min))
+              for label, is_class, s, e in rows]
+
+    day_start, day_end = blocks[0][2], blocks[-1][3]
+    starts = [midnight]
+    segments = [("OUTSIDE", "Before school hours", day_start)]
+    periods = ["Before school"]
+
+    # Every rule in current_status() compares `now` against one of these
+    # instants, so the result is constant between consecutive boundaries.
+    bounds = {day_start}
+    for label, is_class, s_dt, e_dt, closed in blocks:
+        bounds.update((s_dt, e_dt))
+        if is_class:
+            bounds.update((s_dt + timedelta(minutes=closed), e_dt - timedelta(minutes=closed)))
+
+    # Sweep the boundaries in order. Rows are matched in list order (lowest
+    # index wins), so both heaps are keyed by row index with lazy deletion.
+    by_start = sorted(range(len(blocks)), key=lambda i: blocks[i][2])
+    pending = 0
+    active = []                          # rows with start <= t
+    upcoming = list(range(len(blocks)))  # rows with start > t
+    for t in sorted(b for b in bounds if day_start <= b < day_end):
+        while pending < len(by_start) and blocks[by_start[pending]][2] <= t:
+            heapq.heappush(active, by_start[pending])
+            pending += 1
+        while active and blocks[active[0]][3] <= t:
+            heapq.heappop(active)
+        while upcoming and blocks[upcoming[0]][2] <= t:
+            heapq.heappop(upcoming)
+
+        if active:
+            seg = _block_status(*blocks[active[0]], t)
+            period = blocks[active[0]][0]
+        else:
+            seg = ("OPEN", "Passing time", blocks[upcoming[0]][2] if upcoming else None)
+            period = "Passing time"
+        if seg != segments[-1] or period != periods[-1]:
+            starts.append(t)
+            segments.append(seg)
+            periods.append(period)
+
+    starts.append(max(day_start, day_end))
+    return starts, segments, periods, _open_blocks(day, blocks)
+
+TIMELINE_CACHE_MAX = 16  # compiled days kept per tenant
+
+def get_timeline(day):
+    """Compiled Timeline for ``day`` for the current tenant."""
+    return current_tenant().get_timeline(day)
+
+TIMELINE_FIELDS = ["type", "date", "start", "end", "status", "label"]
+
+def iter_timeline_records(tenant, first, last):
+    """Yield every transition and open window from ``first`` to ``last`` (inclusive),
+    one day at a time. Days are compiled directly so the live cache isn't churned."""
+    version, schedules = tenant.get_schedules()
+    day = first
+    while day <= last:
+        tl = compile_timeline(day, schedules, version, tenant)
+        midnight = as_dt(day + timedelta(days=1), time.min, tenant.tz)
+        for i, (status, reason, _) in enumerate(tl.segments):
+            until = tl.starts[i + 1] if i + 1 < len(tl.starts) else midnight
+            yield {"type": "transition", "date": day.isoformat(),
+                   "start": tl.starts[i].isoformat(), "end": until.isoformat(),
+                   "status": status, "label": reason}
+        for s_dt, e_dt, label in tl.open_blocks:
+            yield {"type": "open", "date": day.isoformat(),
+                   "start": s_dt.isoformat(), "end": e_dt.isoformat(),
+                   "status": "OPEN", "label": label}
+        day += timedelta(days=1)
+
+# =================== PUSH (SSE) ===================
+def status_payload(now, tl):
+    status, reason, next_dt = tl.status_at(now)
+    return {
+        "status": status, "reason": reason,
+        "next_change": next_dt.isoformat() if next_dt else None,
+        "next_change_fmt": fmt_next_change(next_dt, now),
+        "date": now.date().isoformat(),
+        "version": str(tl.version),
+    }
+
+class StatusHub:
+    """Fan-out of one tenant's status/counter changes to its /api/stream clients.
+
+    A single scheduler thread sleeps until the next timeline boundary (or a
+    local write pokes it) and publishes only when something changed. Clients
+    block on one shared Condition, so an idle connection costs no timer.
+    Counter and occupancy writes from other workers are picked up by comparing the shared
+    counter version every STREAM_POLL seconds, which is a memory read. The
+    scheduler only runs while the tenant has clients. ``listeners`` are called
+    (from the scheduler thread) on every change; the async server uses one to
+    wake its streams without a thread per client.
+    """
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.status = None
+        self.counters = None
+        self.occupancy = None
+        self.clients = 0
+        self.listeners = set()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def poke(self):
+        """Ask the scheduler to re-evaluate now (after a local write)."""
+        self._wake.set()
+
+    def _ensure_scheduler(self):
+        if self._pid == os.getpid():
+            return
+        with self.cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.refresh()
+            threading.Thread(target=self._run, name=f"status-{self.tenant.id}", daemon=True).start()
+
+    def refresh(self):
+        tenant = self.tenant
+        now = tenant.now()
+        tl = tenant.get_timeline(now.date())
+        status = status_payload(now, tl)
+        counters = tenant.counter_totals()
+        occupancy = tenant.occupancy.snapshot() if tenant.occupancy else None
+        with self.cond:
+            if status != self.status or counters != self.counters or occupancy != self.occupancy:
+                self.status, self.counters, self.occupancy = status, counters, occupancy
+                self.seq += 1
+                self.cond.notify_all()
+                listeners = list(self.listeners)
             else:
-                return ("OPEN", f"{label}", e_dt)
+                listeners = ()
+        for fn in listeners:
+            fn()
+        nxt = tl.next_transition(now) or as_dt(now.date() + timedelta(days=1), time.min, tenant.tz)
+        return (nxt - now).total_seconds()
+
+    def _run(self):
+        pid = os.getpid()
+        while True:
+            with self.cond:
+                if self._pid != pid or not self.clients:
+                    if self._pid == pid:
+                        self._pid = None
+                    return
+            try:
+                until_next = self.refresh()
+            except Exception:
+                app.logger.exception("status scheduler refresh failed")
+                until_next = STREAM_POLL
+            self._wake.wait(max(0.05, min(until_next, STREAM_POLL)))
+            self._wake.clear()
+
+    def attach(self):
+        """Count a client in (starting the scheduler if needed)."""
+        with self.cond:
+            self.clients += 1
+        self._ensure_scheduler()
+
+    def detach(self):
+        with self.cond:
+            self.clients -= 1
+
+    def frames(self, seen):
+        """SSE frames for the status/counters a client hasn't seen yet; ``seen``
+        is the client's own dict and is updated in place."""
+        with self.cond:
+            status, counters, occupancy = self.status, self.counters, self.occupancy
+        out = ""
+        if status != seen.get("status"):
+            seen["status"] = status
+            out += f"event: status\ndata: {json.dumps(status)}\n\n"
+        if counters != seen.get("counters"):
+            seen["counters"] = counters
+            out += f"event: counters\ndata: {json.dumps(counters)}\n\n"
+        if occupancy != seen.get("occupancy"):
+            seen["occupancy"] = occupancy
+            out += f"event: occupancy\ndata: {json.dumps(occupancy)}\n\n"
+        return out
+
+    def subscribe(self):
+        """Generator of SSE frames for one client."""
+        self.attach()
+        try:
+            yield "retry: 5000\n\n"
+            seen = {}
+            seq = -1
+            while True:
+                with self.cond:
+                    changed = self.cond.wait_for(lambda: self.seq != seq, timeout=STREAM_KEEPALIVE)
+                    seq = self.seq
+                if not changed:
+                    yield ": keep-alive\n\n"
+                    continue
+                frames = self.frames(seen)
+                if frames:
+                    yield frames
+        finally:
+            self.detach()
+
+# =================== TRANSITIONS ===================
+# Each worker runs one timer thread per loaded tenant that sleeps until the
+# tenant's next timeline boundary (or midnight) and then recomputes the
+# status, rebuilds /api/today and the dashboard page for the new segment,
+# and wakes push clients, so the first request after a change finds
+# everything ready. One worker per host (leader lock) also runs the tenant's
+# hooks from hooks.json (next to schedules.json, or "hooks" in tenants.json):
+#   [{"url": "http://10.0.1.40/hall-light", "on": ["OPEN", "CLOSED"]},
+#    {"command": ["/usr/local/bin/bell", "{status}", "{reason}"], "all_changes": true}]
+# A url gets the event POSTed as JSON; a command runs without a shell, with
+# {tenant}/{status}/{reason}/{previous} filled in and BATHROOM_* env vars.
+# Hooks run when the status changes ("all_changes": also when only the reason
+# does, e.g. for a bell), optionally only for the statuses in "on".
+# Sleep times are taken from the wall clock (epoch seconds, so DST changes
+# don't matter) and capped at TRANSITION_MAX_SLEEP, so a clock jump delays
+# a transition by at most that. Hooks whose moment passed more than HOOK_GRACE
+# seconds ago (machine asleep, clock jumped forward) are skipped, not replayed.
+HOOKS_JSON = "hooks.json"
+TRANSITION_MAX_SLEEP = 60.0            # longest single sleep, in seconds
+CLOCK_JUMP_TOLERANCE = 5.0             # wall vs monotonic drift (s) logged as a clock jump
+HOOK_GRACE = 120.0                     # seconds after a transition its hooks may still run
+HOOK_TIMEOUT = 10.0                    # seconds per webhook / command
+
+def load_hooks(tenant):
+    """hooks.json -> list of valid hook dicts (bad entries are logged and skipped)."""
+    if not os.path.exists(tenant.hooks_path):
+        return []
+    try:
+        with open(tenant.hooks_path, encoding="utf-8") as f:
+            data = json.load(f)
+    except ValueError as e:
+        app.logger.error("hooks file %s is unreadable: %s", tenant.hooks_path, e)
+        return []
+    hooks = []
+    for i, hook in enumerate(data if isinstance(data, list) else []):
+        if not isinstance(hook, dict) or not (isinstance(hook.get("url"), str) or
+                                              (isinstance(hook.get("command"), list) and hook["command"])):
+            app.logger.error("%s: hook %d needs a \"url\" or a \"command\" list", tenant.hooks_path, i + 1)
+            continue
+        hooks.append(hook)
+    return hooks
+
+def run_hook(hook, event):
+    import subprocess  # only hosts with command hooks need it
+    import urllib.request
+    kind = "url" if "url" in hook else "command"
+    try:
+        if kind == "url":
+            req = urllib.request.Request(hook["url"], json.dumps(event).encode(), {"Content-Type": "application/json"})
+            urllib.request.urlopen(req, timeout=HOOK_TIMEOUT).close()
+        else:
+            fields = {"tenant": event["tenant"], "status": event["status"], "reason": event["reason"],
+                      "previous": event["previous"]["status"]}
+            env = dict(os.environ, **{f"BATHROOM_{k.upper()}": v for k, v in fields.items()})
+            subprocess.run([str(a).format_map(fields) for a in hook["command"]], env=env,
+                           timeout=HOOK_TIMEOUT, check=True, capture_output=True)
+        result = "ok"
+    except (OSError, ValueError, KeyError, subprocess.SubprocessError) as e:
+        result = "error"
+        app.logger.warning("%s hook %s failed: %s", event["tenant"], hook.get(kind), e)
+    metrics.inc("bathroom_hook_runs_total", (kind, result))
+
+class TransitionScheduler:
+    """One tenant's transition timer in this worker (see TRANSITIONS)."""
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.leader = LeaderLock(os.path.join(tenant.dir, "hooks.leader"))
+        self.page_root = None  # SCRIPT_NAME the dashboard was last served under
+        self.seen = None       # (date, timeline version, segment) last refreshed for
+        self.state = None      # (status, reason) hooks last ran for
+        self._checked = None   # epoch seconds of the last tick
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_running(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name=f"transitions-{self.tenant.id}", daemon=True).start()
+
+    def poke(self):
+        """Re-read the schedule now (after a local edit)."""
+        self._wake.set()
+
+    def stop(self):
+        self._pid = None
+        self._wake.set()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                delay = self.tick()
+            except Exception:
+                app.logger.exception("transition scheduler failed")
+                delay = TRANSITION_MAX_SLEEP
+            wall, mono = wall_time(), monotonic()
+            self._wake.wait(min(max(0.0, delay), TRANSITION_MAX_SLEEP))
+            self._wake.clear()
+            jump = (wall_time() - wall) - (monotonic() - mono)
+            if abs(jump) > CLOCK_JUMP_TOLERANCE:
+                app.logger.warning("clock jumped %+.0f s; re-reading %s's timeline", jump, self.tenant.id)
+
+    def tick(self):
+        """Bring everything up to date for now; returns the seconds until the next boundary."""
+        tenant = self.tenant
+        now = tenant.now()
+        tl = tenant.get_timeline(now.date())
+        i = tl.index_at(now)
+        if (now.date(), tl.version, i) != self.seen:
+            self.seen = (now.date(), tl.version, i)
+            self.refresh(now)
+        status, reason, _ = tl.segments[i]
+        if (status, reason) != self.state:
+            previous, self.state = self.state, (status, reason)
+            if previous is not None:
+                self.fire(previous, now, tl, i)
+        self._checked = now.timestamp()
+        nxt = tl.next_transition(now) or as_dt(now.date() + timedelta(days=1), time.min, tenant.tz)
+        return nxt.timestamp() - now.timestamp()  # epoch seconds: right across DST changes
+
+    def refresh(self, now):
+        tenant = self.tenant
+        tenant.today_payload(now.date())  # compiles tomorrow's timeline too
+        save_warm(tenant)
+        tenant.hub.refresh()
+        if self.page_root is not None:
+            with app.test_request_context("/", base_url="http://localhost" + self.page_root):
+                g.tenant = tenant
+                dashboard_page(tenant, now)
+
+    def fire(self, previous, now, tl, i):
+        if not self.leader.held():
+            return
+        metrics.inc("bathroom_transitions_total", (self.tenant.id,))
+        hooks = load_hooks(self.tenant)
+        if not hooks:
+            return
+        # Late relative to the boundary, or to our previous look if that was
+        # later (a schedule edit changes the status "now", not at a boundary).
+        late = now.timestamp() - max(tl.starts[i].timestamp(), self._checked or 0)
+        if late > HOOK_GRACE:
+            app.logger.warning("%s: skipping hooks for %s, %.0f s late", self.tenant.id, tl.segments[i][0], late)
+            return
+        status, reason, next_dt = tl.segments[i]
+        event = {
+            "tenant": self.tenant.id, "status": status, "reason": reason,
+            "previous": {"status": previous[0], "reason": previous[1]},
+            "at": now.isoformat(timespec="seconds"),
+            "next_change": next_dt.isoformat() if next_dt else None,
+        }
+        for hook in hooks:
+            if hook.get("on") and status not in hook["on"]:
+                continue
+            if status == previous[0] and not hook.get("all_changes"):
+                continue
+            threading.Thread(target=run_hook, args=(hook, event), name="hook", daemon=True).start()
+
+# =================== WARM START ===================
+# Kiosks reboot nightly, so start-up time is time the display is blank. Two
+# things that would otherwise be rebuilt on every boot are kept in WARM_DIR:
+#   - templates/: Jinja's compiled templates. Jinja checks each one against a
+#     hash of its source and recompiles it if the template changed.
+#   - <tenant>.json: the compiled timelines from today on, written whenever
+#     the transition timer moves to a new day or schedule version. A timeline
+#     is keyed by a hash of the schedule rows it was compiled from, so a stale
+#     one is never used, and the whole file is ignored unless it was written
+#     by this exact app.py and Python. Plain JSON (instants as epoch seconds),
+#     so a damaged or edited file can only be ignored, never run.
+# Nothing is written on import; templates compiled then are saved with the
+# first snapshot. Deleting WARM_DIR is always safe; the next start is just a
+# cold one.
+WARM_DIR = os.getenv("BATHROOM_WARM_DIR", "warm")
+
+_code_hash = None
+
+def code_hash():
+    global _code_hash
+    if _code_hash is None:
+        with open(__file__, "rb") as f:
+            _code_hash = hashlib.sha1(f.read() + sys.version.encode()).hexdigest()
+    return _code_hash
+
+def warm_path(tenant):
+    return os.path.join(WARM_DIR, f"{tenant.id}.json")
+
+def timeline_to_json(tl):
+    ts = lambda dt: dt.timestamp() if dt else None
+    return {"date": tl.date.isoformat(), "version": tl.version, "starts": [ts(s) for s in tl.starts],
+            "segments": [[status, reason, ts(nxt)] for status, reason, nxt in tl.segments],
+            "periods": tl.periods, "open": [[ts(s), ts(e), label] for s, e, label in tl.open_blocks]}
+
+def timeline_from_json(d, tz):
+    dt = lambda ts: datetime.fromtimestamp(float(ts), tz) if ts is not None else None
+    return Timeline(date.fromisoformat(d["date"]), str(d["version"]), [dt(s) for s in d["starts"]],
+                    [(str(status), str(reason), dt(nxt)) for status, reason, nxt in d["segments"]],
+                    [str(p) for p in d["periods"]], [(dt(s), dt(e), str(label)) for s, e, label in d["open"]])
+
+def load_warm(tenant):
+    """Seed ``tenant``'s compiled timelines from its snapshot, if it is valid."""
+    try:
+        with open(warm_path(tenant), encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get("code") != code_hash():
+            return
+        timelines = [timeline_from_json(d, tenant.tz) for d in data["timelines"]]
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError, TypeError, KeyError, OverflowError) as e:
+        app.logger.warning("ignoring warm snapshot %s: %s", warm_path(tenant), e)
+        return
+    tenant._timelines.update({(tl.date, tl.version): tl for tl in timelines})
+    tenant._warm = {(tl.date, tl.version) for tl in timelines}
+
+def save_warm(tenant):
+    """Snapshot the tenant's timelines from today on (only if they changed)."""
+    template_cache.start()
+    today = tenant.now().date()
+    timelines = {k: tl for k, tl in list(tenant._timelines.items()) if k[0] >= today}
+    if set(timelines) == tenant._warm:
+        return
+    try:
+        write_json_atomic(warm_path(tenant), {"code": code_hash(),
+                                              "timelines": [timeline_to_json(tl) for tl in timelines.values()]},
+                          separators=(",", ":"))
+    except OSError as e:
+        app.logger.warning("could not write warm snapshot %s: %s", warm_path(tenant), e)
+        return
+    tenant._warm = set(timelines)
+
+class TemplateCache(FileSystemBytecodeCache):
+    """Compiled templates under WARM_DIR; a read-only disk only costs the speed-up.
+    Templates compiled before start() are held back, so importing writes nothing."""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.pending = []
+
+    def start(self):
+        pending, self.pending = self.pending, None
+        for bucket in pending or ():
+            self.dump_bytecode(bucket)
+
+    def dump_bytecode(self, bucket):
+        if self.pending is not None:
+            self.pending.append(bucket)
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            super().dump_bytecode(bucket)
+        except OSError as e:
+            app.logger.warning("could not cache compiled template: %s", e)
+
+# =================== TENANTS ===================
+# One deployment can serve every campus and bathroom display in a district.
+# Each tenant has its own schedule file, counters, timezone, CLOSED_MIN and day
+# keys, and is picked per request by URL prefix (/t/<id>/...) or Host header.
+# The "default" tenant is the single-school setup from CONFIG and keeps the
+# original file locations. Other tenants are declared in TENANTS_JSON:
+#   {"lincoln-east": {"name": "Lincoln MS – East", "tz": "America/Chicago",
+#                     "closed_min": 10, "hosts": ["lincoln-east.local"],
+#                     "schedules": "tenants/lincoln/schedules.json"}}
+# Optional keys: dir, storage, db, schedules, counters, calendar, day_keys,
+# weekday_to_key, admin_pin, hooks, occupancy (capacity, see OCCUPANCY), peers (see
+# PEER SYNC). Per-tenant data files (counters, events.db,
+# bathroom.db) live in the data dir. With JSON storage, several displays of one
+# campus can point "schedules" at the same file.
+TENANTS_JSON = os.getenv("BATHROOM_TENANTS", "tenants.json")
+TENANTS_DIR = "tenants"                # default data dir: tenants/<id>/
+TENANT_CACHE_MAX = int(os.getenv("BATHROOM_TENANT_CACHE", "64"))  # tenants kept compiled
+DEFAULT_TENANT = "default"
+DAY_LABELS = {"monday": "Monday (Modified)", "tue-fri": "Tuesday–Friday"}
 
-    for (label, is_class, s_dt, e_dt) in blocks:
-        if now < s_dt:
-            return ("OPEN", "Passing time", s_dt)
+class Tenant:
+    """Config plus compiled state (schedule cache, timelines, counters, push hub)."""
 
-    return ("OPEN", "Passing time", None)
+    def __init__(self, tid, cfg=None):
+        cfg = cfg or {}
+        base = cfg.get("dir", "" if tid == DEFAULT_TENANT else os.path.join(TENANTS_DIR, tid))
+        self.id = tid
+        self.dir = base
+        self.name = cfg.get("name", tid)
+        self.tz = ZoneInfo(cfg["tz"]) if "tz" in cfg else TZ
+        self.closed_min = int(cfg.get("closed_min", CLOSED_MIN))
+        self.day_keys = list(cfg.get("day_keys", DAY_KEYS))
+        if "weekday_to_key" in cfg:
+            self.weekday_to_key = {int(k): v for k, v in cfg["weekday_to_key"].items()}
+        else:
+            self.weekday_to_key = WEEKDAY_TO_KEY
+        # Settings a compiled timeline depends on besides the files; part of its
+        # version, so a config change never reuses one (e.g. from warm/).
+        self.timeline_config = (self.tz.key, self.closed_min, self.day_keys, sorted(self.weekday_to_key.items()))
+        self.admin_pin = str(cfg.get("admin_pin", ADMIN_PIN))
+        self.schedules_path = cfg.get("schedules") or os.path.join(base, DATA_JSON)
+        self.calendar_path = cfg.get("calendar") or os.path.join(base, CALENDAR_JSON)
+        self.hooks_path = cfg.get("hooks") or os.path.join(base, HOOKS_JSON)
+        kind = cfg.get("storage", STORAGE)
+        if kind == "sqlite":
+            self.storage = SqliteStorage(cfg.get("db") or os.path.join(base, STORAGE_DB))
+        elif kind == "json":
+            self.storage = JsonStorage(self.schedules_path,
+                                       cfg.get("counters") or os.path.join(base, COUNTERS_JSON))
+        else:
+            raise ValueError(f"tenant {tid}: unknown storage {kind!r} (json or sqlite)")
+        peers = cfg.get("peers", PEERS)
+        self.sync = PeerSync(self, peers, os.path.join(base, PEERS_JSON)) if peers else None
+        self.counters = CounterStore(os.path.join(base, COUNTERS_SHM), self.storage,
+                                     load_tallies=self.sync and self.sync.own_tallies)
+        self.capacity = parse_capacity(cfg.get("occupancy", CAPACITY))
+        self.occupancy = OccupancyStore(os.path.join(base, OCCUPANCY_SHM), self.capacity) if self.capacity else None
+        self.hub = StatusHub(self)
+        self.transitions = TransitionScheduler(self)
+        self.visits = VisitLog(os.path.join(base, EVENTS_DB))
+        self._schedules = CachedFile(self.storage.schedules_version, lambda: load_schedules(self))
+        self._calendar = CachedFile(lambda: file_version(self.calendar_path), lambda: load_calendar(self))
+        self._timelines = {}  # (date, version of the day keys it reads) -> Timeline
+        self._current = {}    # (date, storage version, calendar version) -> Timeline
+        self._day_etags = None
+        self._today = None    # cached /api/today payload
+        self.pages = {}       # rendered dashboard pages, see dashboard_page()
+        self._warm = None     # timeline keys in the warm snapshot, see WARM START
+        load_warm(self)
+
+    def now(self):
+        return datetime.now(self.tz)
+
+    def counter_totals(self):
+        """What the displays show: this host's counters, or with peer sync the
+        combined counters of every host."""
+        if self.sync:
+            self.sync.ensure_running()
+            return self.sync.totals()
+        return self.counters.snapshot()
+
+    def counters_version(self):
+        return self.sync.version() if self.sync else self.counters.version()
+
+    def default_schedules(self):
+        if self.day_keys == DAY_KEYS:
+            return json.loads(json.dumps(DEFAULT_SCHEDULES))
+        return {k: [] for k in self.day_keys}
+
+    def day_label(self, key):
+        return DAY_LABELS.get(key, key.replace("-", "–").title())
+
+    def get_schedules(self):
+        """Return (version, schedules), re-reading only when storage changed."""
+        return self._schedules.get()
+
+    def get_calendar(self):
+        return self._calendar.get()[1]
+
+    def template_keys(self):
+        """Day keys plus any extra templates the calendar refers to."""
+        return self.day_keys + [k for k in self.get_calendar().templates if k not in self.day_keys]
+
+    def day_etags(self):
+        """{day key: day_etag(rows)} for the current schedules."""
+        sched_version, schedules = self._schedules.get()
+        cached = self._day_etags
+        if cached is None or cached[0] != sched_version:
+            cached = self._day_etags = (sched_version, {k: day_etag(rows) for k, rows in schedules.items()})
+        return cached[1]
+
+    def get_timeline(self, day):
+        sched_version, schedules = self._schedules.get()
+        cal_version, calendar = self._calendar.get()
+        seen = (day, sched_version, cal_version)
+        tl = self._current.get(seen)
+        if tl is not None:
+            return tl
+        # A timeline only depends on the rows of the day keys it reads, so one
+        # is kept across saves that don't touch them: editing "monday" leaves
+        # compiled Tuesdays alone.
+        etags = self.day_etags()
+        deps = [(k, etags.get(k)) for k in dict.fromkeys(self._timeline_keys(day, schedules, calendar)) if k]
+        version = hashlib.sha1(repr((deps, cal_version, self.timeline_config)).encode()).hexdigest()[:12]
+        tl = self._timelines.get((day, version))
+        if tl is None:
+            tl = compile_timeline(day, schedules, version, self)
+        if len(self._timelines) >= TIMELINE_CACHE_MAX:
+            self._timelines.clear()
+            self._current.clear()
+        self._timelines[(day, version)] = self._current[seen] = tl
+        return tl
+
+    @staticmethod
+    def _timeline_keys(day, schedules, calendar):
+        """Day keys ``day``'s timeline reads: its own, then each day up to the
+        first school day after tomorrow (next_school_start() looks ahead from
+        both). Covering tomorrow's lookahead too means today's version moves
+        whenever tomorrow's timeline does, which /api/today clients rely on."""
+        keys = []
+        for i in range(calendar.lookahead_days + 2):
+            key, _ = calendar.resolve(day + timedelta(days=i))
+            keys.append(key)
+            if i >= 2 and key and schedules.get(key):
+                break
+        return keys
+
+    def today_payload(self, day):
+        """(JSON body, etag) for /api/today, built once per (day, schedule version)."""
+        tls = [self.get_timeline(day), self.get_timeline(day + timedelta(days=1))]
+        key = (day, tls[0].version, tls[1].version)
+        cached = self._today
+        if cached and cached[0] == key:
+            return cached[1], cached[2]
+        ms = lambda dt: int(dt.timestamp() * 1000) if dt else None
+        payload = {
+            "date": day.isoformat(),
+            "version": str(tls[0].version),
+            "tz": self.tz.key,
+            "valid_until": ms(as_dt(day + timedelta(days=2), time.min, self.tz)),
+            "segments": [[ms(start), status, reason, ms(nxt)]
+                         for tl in tls for start, (status, reason, nxt) in zip(tl.starts, tl.segments)],
+            "open": [[ms(s_dt), ms(e_dt), label] for tl in tls for s_dt, e_dt, label in tl.open_blocks],
+        }
+        body = json.dumps(payload, separators=(",", ":"))
+        etag = hashlib.sha1(f"{self.id}|{body}".encode()).hexdigest()[:20]
+        self._today = (key, body, etag)
+        return body, etag
+
+    def invalidate(self):
+        self._schedules.invalidate()
+        self._calendar.invalidate()
+        self.hub.poke()
+        self.transitions.poke()
+
+    def close(self):
+        """Called on LRU eviction; open streams keep working until they disconnect."""
+        self.counters.close()
+        self.transitions.stop()
+        if self.sync:
+            self.sync.stop()
+
+def load_tenant_configs(path=TENANTS_JSON):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return {str(k): v for k, v in json.load(f).items()}
+
+_tenant_configs = load_tenant_configs()
+_tenant_hosts = {h.lower(): tid for tid, cfg in _tenant_configs.items() for h in cfg.get("hosts", [])}
+_default_tenant = Tenant(DEFAULT_TENANT, _tenant_configs.get(DEFAULT_TENANT))
+_tenants = OrderedDict()  # bounded LRU of compiled tenants (default is pinned)
+_tenants_lock = threading.Lock()
+
+def get_tenant(tid):
+    """Tenant by id from the LRU, or None if it isn't configured."""
+    if tid == DEFAULT_TENANT:
+        return _default_tenant
+    evicted = None
+    with _tenants_lock:
+        tenant = _tenants.get(tid)
+        if tenant is not None:
+            _tenants.move_to_end(tid)
+            return tenant
+        cfg = _tenant_configs.get(tid)
+        if cfg is None:
+            return None
+        tenant = _tenants[tid] = Tenant(tid, cfg)
+        if len(_tenants) > TENANT_CACHE_MAX:
+            _, evicted = _tenants.popitem(last=False)
+    if evicted is not None:
+        evicted.close()
+    return tenant
+
+def current_tenant():
+    if has_request_context() and "tenant" in g:
+        return g.tenant
+    return _default_tenant
+
+class TenantRouter:
+    """WSGI middleware: /t/<id>/... -> tenant <id> with the prefix moved to
+    SCRIPT_NAME (so url_for() keeps it); otherwise the tenant is picked by Host."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        tid, prefix, path = split_tenant(environ.get("PATH_INFO", ""), environ.get("HTTP_HOST", ""))
+        environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + prefix
+        environ["PATH_INFO"] = path
+        environ["bathroom.tenant"] = tid
+        return self.wsgi_app(environ, start_response)
+
+def split_tenant(path, host):
+    """(tenant id, URL prefix, path within the tenant) for a request."""
+    if path.startswith("/t/"):
+        tid, _, rest = path[3:].partition("/")
+        return tid, "/t/" + tid, "/" + rest
+    return _tenant_hosts.get(host.split(":")[0].lower(), DEFAULT_TENANT), "", path
+
+app.wsgi_app = TenantRouter(app.wsgi_app)
+
+@app.before_request
+def bind_tenant():
+    tenant = get_tenant(request.environ.get("bathroom.tenant", DEFAULT_TENANT))
+    if tenant is None:
+        abort(404)
+    g.tenant = tenant
+    tenant.transitions.ensure_running()
 
 # =================== TEMPLATES ===================
 DASHBOARD_HTML = """
@@ -168,97 +2492,15 @@ DASHBOARD_HTML = """
 <meta charset="utf-8" />
 <title>MTM Bathroom Status</title>
 <meta name="viewport" content="width=device-width, initial-scale=1" />
-<style>
-  html,body{margin:0;background:#0b0f14;color:#eaeff7;font-family:system-ui,-apple-system,Segoe UI,Roboto,Arial}
-  .wrap{max-width:1000px;margin:0 auto;padding:24px}
-  .clock{font-size:clamp(22px,4.8vw,48px);font-weight:700;opacity:.9}
-  .status{margin-top:8px;font-size:clamp(38px,10vw,92px);font-weight:900}
-  .open{color:#3ddc84}.closed{color:#ff5c5c}.outside{color:#9aa4b2}
-  .reason{margin-top:6px;font-size:clamp(16px,2.8vw,22px);color:#b5c0cd}
-  .next{margin-top:2px;font-size:clamp(14px,2.4vw,18px);color:#93a1af}
-  table{width:100%;border-collapse:collapse;margin-top:18px;background:#121821;border:1px solid #223040;border-radius:10px;overflow:hidden}
-  th,td{padding:12px 14px;border-bottom:1px solid #223040} th{text-align:left;background:#152030;color:#bcd0e5}
-  tr:last-child td{border-bottom:none}
-  .pill{padding:2px 8px;border-radius:999px;font-size:12px;background:#1b2533;color:#a9b8c7}
-  .footer{margin-top:14px;font-size:12px;color:#7f8b97}
-  .topbar{display:flex;justify-content:space-between;align-items:flex-start;gap:12px}
-  .rightcol{display:flex;flex-direction:column;align-items:flex-end;gap:6px;text-align:right}
-  .counters{font-size:clamp(16px,3vw,22px);color:#d7e3f0}
-  .kbd{display:inline-block;padding:2px 6px;border-radius:6px;background:#1b2330;border:1px solid #2a384a;font-size:12px;color:#a9b8c7}
-  .legend{font-size:12px;color:#8fa0b2}
-  a.link{color:#9ecbff;text-decoration:none}
-  .btn{padding:8px 10px;border:none;border-radius:10px;background:#263247;color:#cfe2ff;cursor:pointer;font-weight:700}
-  .btn:hover{filter:brightness(1.1)}
-</style>
-<script>
-// Auto-refresh overall status table every 30s (does NOT affect counters)
-setInterval(()=>{ location.reload(); }, 30000);
-
-// Live counters handler
-document.addEventListener("DOMContentLoaded", () => {
-  const girlsEl = document.getElementById("girlsCount");
-  const boysEl = document.getElementById("boysCount");
-  const totalEl = document.getElementById("totalCount");
-
-  function updateCountsUI(g, b){
-    girlsEl.textContent = g;
-    boysEl.textContent = b;
-    totalEl.textContent = g + b;
-  }
-
-  // Update from server on load (in case template was cached)
-  fetch("{{ url_for('get_counters') }}")
-    .then(r => r.json())
-    .then(d => { updateCountsUI(d.girls, d.boys); })
-    .catch(()=>{});
-
-  async function bump(who, delta){
-    try {
-      const r = await fetch("{{ url_for('update_counter') }}", {
-        method: "POST",
-        headers: {"Content-Type": "application/json"},
-        body: JSON.stringify({who, delta})
-      });
-      const data = await r.json();
-      updateCountsUI(data.girls, data.boys);
-    } catch (e) {
-      console.error(e);
-    }
-  }
-
-  // Ignore key presses when typing in inputs/textareas (admin or other pages)
-  function isTypingInField(ev){
-    const t = ev.target;
-    const tag = (t.tagName || "").toLowerCase();
-    return (tag === "input" || tag === "textarea" || t.isContentEditable);
-  }
-
-  window.addEventListener("keydown", (ev) => {
-    if (isTypingInField(ev)) return;
-
-    // Left/Right arrow to increment; Shift+arrow to decrement
-    if (ev.key === "ArrowLeft") {
-      ev.preventDefault();
-      const delta = ev.shiftKey ? -1 : 1;
-      bump("girls", delta);
-    } else if (ev.key === "ArrowRight") {
-      ev.preventDefault();
-      const delta = ev.shiftKey ? -1 : 1;
-      bump("boys", delta);
-    }
-  });
-
-  // Optional: Clickable fallback buttons (if you want to tap on touchscreen)
-  document.getElementById("girlsPlus").addEventListener("click", ()=>bump("girls", +1));
-  document.getElementById("girlsMinus").addEventListener("click", ()=>bump("girls", -1));
-  document.getElementById("boysPlus").addEventListener("click", ()=>bump("boys", +1));
-  document.getElementById("boysMinus").addEventListener("click", ()=>bump("boys", -1));
-});
-</script>
-</head><body>
+<link rel="stylesheet" href="{{ asset_url('dashboard.css') }}" />
+<script src="{{ asset_url('dashboard.js') }}" defer></script>
+</head><body data-tz="{{ tz }}" data-today-url="{{ url_for('get_today') }}"
+  data-stream-url="{{ url_for('stream') }}" data-counters-url="{{ url_for('get_counters') }}"
+  data-batch-url="{{ url_for('update_counters_batch') }}"
+  {%- if occupancy %} data-occupancy-url="{{ url_for('occupancy_event') }}"{% endif %}>
 <div class="wrap">
   <div class="topbar">
-    <div class="clock">{{ now_fmt }}</div>
+    <div class="clock" id="clock">{{ now_fmt }}</div>
 
     <div class="rightcol">
       <div class="counters">
@@ -267,27 +2509,50 @@ document.addEventListener("DOMContentLoaded", () => {
         Total: <strong id="totalCount">{{ counters.girls + counters.boys }}</strong>
       </div>
       <div class="legend">
+        {% if occupancy %}
+        <span class="kbd">←</span> Girls in &nbsp;·&nbsp; <span class="kbd">Shift</span>+<span class="kbd">←</span> Girls out &nbsp;&nbsp;
+        <span class="kbd">→</span> Boys in &nbsp;·&nbsp; <span class="kbd">Shift</span>+<span class="kbd">→</span> Boys out
+        {% else %}
         <span class="kbd">←</span> Girls +1 &nbsp;·&nbsp; <span class="kbd">Shift</span>+<span class="kbd">←</span> Girls −1 &nbsp;&nbsp;
         <span class="kbd">→</span> Boys +1 &nbsp;·&nbsp; <span class="kbd">Shift</span>+<span class="kbd">→</span> Boys −1
+        {% endif %}
         &nbsp; | &nbsp;<a class="link" href="{{ url_for('admin_login') }}">Admin</a>
       </div>
       <div>
         <!-- Touch/click buttons as a fallback -->
+        {% if occupancy %}
+        <button id="girlsPlus" class="btn">Girls in</button>
+        <button id="girlsMinus" class="btn">Girls out</button>
+        <button id="boysPlus" class="btn">Boys in</button>
+        <button id="boysMinus" class="btn">Boys out</button>
+        {% else %}
         <button id="girlsPlus" class="btn">+ Girls</button>
         <button id="girlsMinus" class="btn">− Girls</button>
         <button id="boysPlus" class="btn">+ Boys</button>
         <button id="boysMinus" class="btn">− Boys</button>
+        {% endif %}
       </div>
     </div>
   </div>
 
-  <div class="status {{ status|lower }}">{{ status }}</div>
-  <div class="reason">{{ reason }}</div>
-  {% if next_change %}
-    <div class="next">Next change: {{ next_change }}</div>
+  <div class="status {{ status|lower }}" id="status">{{ status }}</div>
+  <div class="reason" id="reason">{{ reason }}</div>
+  <div class="next" id="next">{% if next_change %}Next change: {{ next_change }}{% endif %}</div>
+
+  {% if occupancy %}
+  <div class="rooms" id="rooms">
+    {% for who in ("girls", "boys") %}{% set o = occupancy[who] %}
+      <div class="room {{ rooms[who]|lower }}" data-room="{{ who }}">
+        <div class="room-name">{{ who|capitalize }}</div>
+        <div class="room-state">{{ rooms[who] }}</div>
+        <div class="room-occ">{{ o.occupancy }}{% if o.capacity %} / {{ o.capacity }}{% endif %} out</div>
+        <div class="room-stats">{{ o.recent_visits }} in the last {{ occupancy.window_min }} min{% if o.avg_minutes is not none %} · avg {{ o.avg_minutes }} min{% endif %}</div>
+      </div>
+    {% endfor %}
+  </div>
   {% endif %}
 
-  <table>
+  <table id="openBlocks">
     <tr><th>Open From</th><th>Until</th><th>Context</th></tr>
     {% for s,e,label in open_blocks %}
       <tr>
@@ -349,14 +2614,42 @@ ADMIN_SCHEDULE_HTML = """
   .bar{display:flex;gap:10px;align-items:center;justify-content:space-between;margin-bottom:12px}
   a{color:#9ecbff;text-decoration:none}
   .pill{padding:2px 8px;border-radius:999px;font-size:12px;background:#1b2533;color:#a9b8c7}
+  .msg{margin:0 0 12px;padding:10px 12px;border-radius:10px;background:#152030;color:#bcd0e5}
+  .msg.err{background:#2a1418;color:#ff9b9b}
+  .edit-status{font-size:13px;color:#a9b8c7;margin-left:10px;font-weight:normal}
+  .edit-status.err{color:#ff9b9b}
+  input.invalid{border-color:#ff5c5c}
 </style>
-</head><body><div class="wrap">
+</head><body data-schedule-api="{{ url_for('schedule_api') }}"><div class="wrap">
+  {% for m in get_flashed_messages() %}<div class="msg">{{ m }}</div>{% endfor %}
+  {% if form_errors %}
+  <div class="msg err">
+    <strong>Changes not saved: {{ form_errors|length }} problem{{ 's' if form_errors|length != 1 }} found.</strong>
+    The schedule below is unchanged.
+    <ul>{% for error in form_errors %}<li>{{ error }}</li>{% endfor %}</ul>
+  </div>
+  {% endif %}
+  {% if import_report %}
+  <div class="msg err">
+    <strong>Upload not saved: {{ import_report.count }} problem{{ 's' if import_report.count != 1 }} found.</strong>
+    The schedule below is unchanged.
+    <ul>
+      {% for line, error in import_report.errors %}<li>Line {{ line }}: {{ error }}</li>{% endfor %}
+      {% if import_report.count > import_report.errors|length %}
+        <li>… and {{ import_report.count - import_report.errors|length }} more</li>
+      {% endif %}
+    </ul>
+  </div>
+  {% endif %}
   <div class="bar">
     <div>
       <a href="{{ url_for('index') }}">⟵ Dashboard</a>
+      {% if tenant.id != 'default' %}<span class="pill">{{ tenant.name }}</span>{% endif %}
       <span class="pill">Closed-min: {{ closed_min }}</span>
     </div>
     <div style="display:flex;gap:8px;">
+      <a href="{{ url_for('admin_analytics') }}">Analytics</a>
+      <a href="{{ url_for('simulate_api') }}" title="Open minutes over the next term with 10/15/20 closed minutes">What-if</a>
       <a href="{{ url_for('download_csv') }}">Export CSV</a>
       <form method="post" action="{{ url_for('upload_csv') }}" enctype="multipart/form-data" style="display:inline">
         <input type="file" name="file" accept=".csv" required>
@@ -368,64 +2661,628 @@ ADMIN_SCHEDULE_HTML = """
     </div>
   </div>
 
+  {# Without JavaScript this is a plain form; static/admin.js saves each edit
+     through /api/schedule instead (see ROUTES). #}
   <form method="post">
     {% for key in day_keys %}
-      <h3 style="margin:6px 0 8px 2px;">{{ 'Monday (Modified)' if key=='monday' else 'Tuesday–Friday' }}</h3>
-      <table>
-        <tr><th>Label</th><th>Is Class?</th><th>Start (HH:MM)</th><th>End (HH:MM)</th><th class="row-actions">Actions</th></tr>
-        {% for row in schedules[key] %}
+      <h3 style="margin:6px 0 8px 2px;">{{ day_label(key) }}<span class="edit-status" data-status="{{ key }}"></span></h3>
+      <table data-day="{{ key }}" data-etag="{{ etags[key] }}">
+        <thead><tr><th>Label</th><th>Is Class?</th><th>Start (HH:MM)</th><th>End (HH:MM)</th><th class="row-actions">Actions</th></tr></thead>
+        <tbody>
+        {% for row in schedules.get(key, []) %}
             {% set i = loop.index0 %}
-             <tr>
-                <td><input type="text" name="{{ key }}__label__{{ i }}" value="{{ row['label'] }}"></td>
+             <tr data-id="{{ row['id'] }}">
+                <td><input type="text" name="{{ key }}__label__{{ i }}" data-field="label" value="{{ row['label'] }}"></td>
                 <td>
-                    <select name="{{ key }}__is_class__{{ i }}">
+                    <select name="{{ key }}__is_class__{{ i }}" data-field="is_class">
                         <option value="1" {% if row['is_class']|int==1 %}selected{% endif %}>Yes</option>
                         <option value="0" {% if row['is_class']|int==0 %}selected{% endif %}>No</option>
                     </select>
                 </td>
-                <td><input type="text" name="{{ key }}__start__{{ i }}" value="{{ row['start'] }}" placeholder="08:10"></td>
-                <td><input type="text" name="{{ key }}__end__{{ i }}" value="{{ row['end'] }}" placeholder="08:48"></td>
+                <td><input type="text" name="{{ key }}__start__{{ i }}" data-field="start" value="{{ row['start'] }}" placeholder="08:10"></td>
+                <td><input type="text" name="{{ key }}__end__{{ i }}" data-field="end" value="{{ row['end'] }}" placeholder="08:48"></td>
                 <td class="row-actions"><button class="warn" name="delete" value="{{ key }}__{{ i }}">Delete</button></td>
             </tr>
         {% endfor %}
-        <tr>
-          <td><input type="text" name="{{ key }}__new__label" placeholder="New block label"></td>
+        </tbody>
+        <tfoot>
+        <tr data-new>
+          <td><input type="text" name="{{ key }}__new__label" data-field="label" placeholder="New block label"></td>
           <td>
-            <select name="{{ key }}__new__is_class"><option value="1">Yes</option><option value="0">No</option></select>
+            <select name="{{ key }}__new__is_class" data-field="is_class"><option value="1">Yes</option><option value="0">No</option></select>
           </td>
-          <td><input type="text" name="{{ key }}__new__start" placeholder="HH:MM"></td>
-          <td><input type="text" name="{{ key }}__new__end" placeholder="HH:MM"></td>
-          <td></td>
+          <td><input type="text" name="{{ key }}__new__start" data-field="start" placeholder="HH:MM"></td>
+          <td><input type="text" name="{{ key }}__new__end" data-field="end" placeholder="HH:MM"></td>
+          <td class="row-actions"><button class="primary" name="add" value="{{ key }}">Add</button></td>
         </tr>
+        </tfoot>
       </table>
       <br/>
     {% endfor %}
-    <button class="primary" type="submit">Save Changes</button>
+    <button class="primary" type="submit" data-save-all>Save Changes</button>
+  </form>
+
+  {% if revisions %}
+  <h3 style="margin:24px 0 8px 2px;">History</h3>
+  <table>
+    <tr><th>#</th><th>Saved</th><th>Change</th><th class="row-actions"></th></tr>
+    {% for rid, saved, note in revisions %}
+      <tr>
+        <td>{{ rid }}</td>
+        <td>{{ saved.strftime('%a %b %-d, %-I:%M %p') }}</td>
+        <td>{{ note }}</td>
+        <td class="row-actions">
+          {% if not loop.first %}
+          <form method="post" action="{{ url_for('restore_schedule', rev_id=rid) }}" style="display:inline">
+            <button class="primary" type="submit">Restore</button>
+          </form>
+          {% endif %}
+        </td>
+      </tr>
+    {% endfor %}
+  </table>
+  {% endif %}
+
+  <h3 style="margin:24px 0 8px 2px;">Profiler</h3>
+  <form method="post" action="{{ url_for('start_profile') }}" class="bar" style="justify-content:flex-start">
+    Sample the worker serving this page for
+    <input type="text" name="seconds" value="30" style="width:60px"> seconds or
+    <input type="text" name="requests" placeholder="all" style="width:60px"> requests
+    <label><input type="checkbox" name="all_threads" value="1"> idle threads too</label>
+    <button class="primary" type="submit">Start</button>
   </form>
+  {% if profiles %}
+  <table>
+    <tr><th>Collapsed stacks (flamegraph.pl, speedscope)</th></tr>
+    {% for name in profiles %}
+      <tr><td><a href="{{ url_for('download_profile', name=name) }}">{{ name }}</a></td></tr>
+    {% endfor %}
+  </table>
+  {% endif %}
+</div>
+<script src="{{ asset_url('admin.js') }}" defer></script>
+</body></html>
+"""
+
+ADMIN_ANALYTICS_HTML = """
+<!doctype html>
+<html><head>
+<meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Bathroom Usage</title>
+<style>
+  body{background:#0b0f14;color:#eaeff7;font-family:system-ui;-apple-system,Segoe UI,Roboto,Arial}
+  .wrap{max-width:1400px;margin:4vh auto;padding:24px}
+  table{border-collapse:collapse;background:#121821;border:1px solid #223040;border-radius:10px;overflow:hidden;margin-bottom:18px}
+  th,td{padding:8px 10px;border-bottom:1px solid #223040}
+  th{background:#152030;color:#bcd0e5;text-align:left}
+  .heat-wrap{overflow-x:auto}
+  .heat td.cell{min-width:18px;padding:4px;text-align:center;font-size:11px;color:#0b0f14}
+  .heat th.day{font-size:10px;writing-mode:vertical-rl;padding:6px 2px}
+  input[type=date]{padding:6px;border:1px solid #223040;border-radius:8px;background:#0e141c;color:#eaeff7}
+  button.primary{padding:8px 12px;border:none;border-radius:10px;background:#3ddc84;color:#0b0f14;font-weight:800;cursor:pointer}
+  .bar{display:flex;gap:10px;align-items:center;justify-content:space-between;margin-bottom:12px}
+  .cols{display:flex;gap:18px;flex-wrap:wrap;align-items:flex-start}
+  a{color:#9ecbff;text-decoration:none}
+  .pill{padding:2px 8px;border-radius:999px;font-size:12px;background:#1b2533;color:#a9b8c7}
+</style>
+</head><body><div class="wrap">
+  <div class="bar">
+    <div>
+      <a href="{{ url_for('admin_schedule') }}">⟵ Schedule</a>
+      {% if tenant.id != 'default' %}<span class="pill">{{ tenant.name }}</span>{% endif %}
+      <span class="pill">{{ total }} visits</span>
+    </div>
+    <form method="get" style="display:flex;gap:8px;align-items:center">
+      <input type="date" name="from" value="{{ first }}"> – <input type="date" name="to" value="{{ last }}">
+      <button class="primary" type="submit">Show</button>
+    </form>
+  </div>
+
+  <h3>Visits per period</h3>
+  {% if days %}
+  <div class="heat-wrap"><table class="heat">
+    <tr><th>Period</th>{% for d in days %}<th class="day" title="{{ d }}">{{ d[5:] }}</th>{% endfor %}<th>Total</th></tr>
+    {% for p in periods %}
+      <tr>
+        <td>{{ p }}</td>
+        {% for d in days %}{% set v = heat.get((p, d), 0) %}
+          <td class="cell" title="{{ d }} · {{ p }}: {{ v }}"
+              style="background:rgba(61,220,132,{{ '%.2f'|format(v / max_cell) if v > 0 else 0 }})">{{ v or '' }}</td>
+        {% endfor %}
+        <td>{{ by_period[p] }}</td>
+      </tr>
+    {% endfor %}
+  </table></div>
+  {% else %}
+    <p>No visits recorded in this range.</p>
+  {% endif %}
+
+  <div class="cols">
+    <table>
+      <tr><th>Who</th><th>Visits</th></tr>
+      {% for who, v in by_who %}<tr><td>{{ who|capitalize }}</td><td>{{ v }}</td></tr>{% endfor %}
+    </table>
+    <table>
+      <tr><th>Open window</th><th>Visits</th></tr>
+      {% for w, v in by_window %}<tr><td>{{ w or 'While closed / outside hours' }}</td><td>{{ v }}</td></tr>{% endfor %}
+    </table>
+  </div>
 </div></body></html>
 """
 
+# Compiled once per process (and cached by Jinja) instead of on every request;
+# the compiled code is also kept on disk (see WARM START). Only the dashboard
+# is compiled at import, the admin pages on first use.
+TEMPLATES = {
+    "dashboard.html": DASHBOARD_HTML,
+    "admin_login.html": ADMIN_LOGIN_HTML,
+    "admin_schedule.html": ADMIN_SCHEDULE_HTML,
+    "admin_analytics.html": ADMIN_ANALYTICS_HTML,
+}
+app.jinja_loader = DictLoader(TEMPLATES)
+app.jinja_env.bytecode_cache = template_cache = TemplateCache(os.path.join(WARM_DIR, "templates"))
+app.jinja_env.get_template("dashboard.html")
+
+# =================== STATIC ASSETS ===================
+# Dashboard CSS/JS live in static/ and are held in memory with a gzip variant.
+# URLs carry a content hash (?v=...), so browsers may cache them for a year.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSET_TYPES = {".css": "text/css", ".js": "text/javascript"}
+
+def load_assets():
+    assets = {}
+    for name in sorted(os.listdir(STATIC_DIR)):
+        mimetype = ASSET_TYPES.get(os.path.splitext(name)[1])
+        if not mimetype:
+            continue
+        with open(os.path.join(STATIC_DIR, name), "rb") as f:
+            raw = f.read()
+        assets[name] = {
+            "raw": raw, "gz": gzip.compress(raw, 9, mtime=0), "mimetype": mimetype,
+            "etag": hashlib.sha1(raw).hexdigest()[:16],
+        }
+    return assets
+
+ASSETS = load_assets()
+
+@app.template_global()
+def asset_url(name):
+    return url_for("asset", name=name, v=ASSETS[name]["etag"])
+
+def accepts_gzip():
+    return "gzip" in request.headers.get("Accept-Encoding", "")
+
+def bytes_response(raw, gz, mimetype, etag, cache_control):
+    """Body (gzipped when the client accepts it) with ETag/304 handling."""
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    elif gz is not None and accepts_gzip():
+        resp = Response(gz, mimetype=mimetype)
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(raw, mimetype=mimetype)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = cache_control
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+@app.route("/assets/<name>")
+def asset(name):
+    a = ASSETS.get(name)
+    if a is None:
+        abort(404)
+    return bytes_response(a["raw"], a["gz"], a["mimetype"], a["etag"],
+                          f"public, max-age={ASSET_MAX_AGE}, immutable")
+
+# =================== DASHBOARD PAGE CACHE ===================
+# The rendered dashboard only changes when the schedule, the current timeline
+# segment, the counters or the occupancy change, so it is rendered once per such state and
+# the state's hash doubles as the ETag. (The live clock is filled in by JS.)
+DASHBOARD_CACHE_MAX = 8  # rendered pages kept per tenant
+
+def dashboard_page(tenant, now):
+    """Return (etag, page) where page is (html bytes, gzipped) or None if the
+    client's If-None-Match already matches (nothing gets rendered)."""
+    tl = tenant.get_timeline(now.date())
+    seg = tl.index_at(now)
+    occ_version = tenant.occupancy.version() if tenant.occupancy else None
+    key = (now.date(), tl.version, seg, tenant.counters_version(), occ_version)
+    etag = hashlib.sha1(f"{tenant.id}|{key}".encode()).hexdigest()[:20]
+    if etag in request.if_none_match:
+        return etag, None
+    page = tenant.pages.get(key)
+    if page is None:
+        status, reason, next_dt = tl.segments[seg]
+        occupancy = tenant.occupancy.snapshot() if tenant.occupancy else None
+        html = render_template(
+            "dashboard.html",
+            now_fmt=now.strftime("%A, %B %-d"),
+            status=status, reason=reason,
+            next_change=fmt_next_change(next_dt, now),
+            open_blocks=tl.open_blocks, closed_min=tenant.closed_min,
+            counters=tenant.counter_totals(), tz=tenant.tz.key,
+            occupancy=occupancy, rooms=occupancy and bathroom_states(status, occupancy)
+        ).encode("utf-8")
+        page = (html, gzip.compress(html, 6, mtime=0))
+        if len(tenant.pages) >= DASHBOARD_CACHE_MAX:
+            tenant.pages.clear()
+        tenant.pages[key] = page
+    return etag, page
+
+# =================== SCHEDULE ROWS ===================
+# Every block carries a stable "id", unique within its day key, so edits and
+# deletes name the row rather than its (shifting) position. Ids are derived
+# from the row itself when it is first stored, so every worker reading an old
+# file without ids assigns the same ones. Shared by the CSV importer and the
+# /api/schedule editing API.
+HHMM_RE = re.compile(r"(\d{1,2}):(\d{2})")
+BLOCK_FIELDS = ("label", "is_class", "start", "end")
+
+def normalize_hhmm(s):
+    """'8:05' -> '08:05'; None if ``s`` is not a valid 24-hour time."""
+    m = HHMM_RE.fullmatch(s)
+    if not m or int(m[1]) > 23 or int(m[2]) > 59:
+        return None
+    return f"{int(m[1]):02d}:{int(m[2]):02d}"
+
+def assign_row_ids(schedules):
+    """Give rows without an "id" one (in place); returns ``schedules``."""
+    for key, rows in schedules.items():
+        taken = {r["id"] for r in rows if "id" in r}
+        for pos, r in enumerate(rows):
+            if "id" in r:
+                continue
+            seed = f"{key}|{pos}|{r['label']}|{r['start']}|{r['end']}"
+            rid = hashlib.sha1(seed.encode()).hexdigest()[:8]
+            while rid in taken:
+                rid = hashlib.sha1(rid.encode()).hexdigest()[:8]
+            r["id"] = rid
+            taken.add(rid)
+    return schedules
+
+def day_etag(rows):
+    """Version of one day key's rows (for If-Match and timeline dependencies)."""
+    return hashlib.sha1(json.dumps(rows, sort_keys=True).encode()).hexdigest()[:16]
+
+def check_block(label, is_class, start, end):
+    """Validate one block's fields (strings). Returns (block or None, [errors])."""
+    errors = []
+    label, is_class = label.strip(), is_class.strip() or "1"
+    s, e = normalize_hhmm(start.strip()), normalize_hhmm(end.strip())
+    if not label:
+        errors.append("label is empty")
+    if is_class not in ("0", "1"):
+        errors.append(f"is_class must be 0 or 1, not {is_class!r}")
+    if s is None:
+        errors.append(f"start {start!r} is not a HH:MM time")
+    if e is None:
+        errors.append(f"end {end!r} is not a HH:MM time")
+    if s and e and e <= s:
+        errors.append(f"ends at {e}, not after it starts at {s}")
+    if errors:
+        return None, errors
+    return {"label": label, "is_class": int(is_class), "start": s, "end": e}, errors
+
+def check_day(key, blocks, where=lambda i: f"row {i + 1}"):
+    """Order and overlap problems in one day's blocks, as [(index, message)].
+
+    Sorts by start, then sweeps keeping the block that reaches furthest so
+    far: O(n log n), and a block nested inside a long one is still caught.
+    """
+    problems = []
+    for i in range(1, len(blocks)):
+        if blocks[i]["start"] < blocks[i - 1]["start"]:
+            problems.append((i, f"{key}: {blocks[i]['label']} ({blocks[i]['start']}) comes after "
+                                f"{blocks[i - 1]['label']} ({blocks[i - 1]['start']}) on {where(i - 1)}; "
+                                "rows must be in time order"))
+    reach = None
+    for i in sorted(range(len(blocks)), key=lambda i: (blocks[i]["start"], blocks[i]["end"])):
+        b = blocks[i]
+        if reach is not None and b["start"] < blocks[reach]["end"]:
+            r = blocks[reach]
+            problems.append((i, f"{key}: {b['label']} {b['start']}-{b['end']} overlaps "
+                                f"{r['label']} {r['start']}-{r['end']} on {where(reach)}"))
+        if reach is None or b["end"] > blocks[reach]["end"]:
+            reach = i
+    return problems
+
+# =================== CSV IMPORT ===================
+# Uploads are parsed row by row straight from the request stream (Werkzeug
+# spools large uploads to disk), so a district file with thousands of rows for
+# many tenants only keeps the current tenant's blocks in memory. An optional
+# "tenant" column selects that tenant's rows; without it every row is for the
+# tenant being edited. The schedule is only saved if every row is valid.
+IMPORT_COLUMNS = ("day", "label", "is_class", "start", "end")
+IMPORT_MAX_ERRORS = 200                # errors listed per upload; the rest are only counted
+
+class ImportReport:
+    """Row-level problems in an upload, as (csv line, message)."""
+
+    def __init__(self):
+        self.errors = []
+        self.count = 0
+        self.blocks = 0
+
+    def add(self, line, message):
+        self.count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append((line, message))
+
+def import_schedule_csv(lines, tenant):
+    """Parse and validate a schedule CSV from any iterable of text lines.
+
+    Returns (schedules, report); schedules is None unless the report is clean.
+    """
+    report = ImportReport()
+    schedules = {k: [] for k in tenant.template_keys()}
+    src_lines = {k: [] for k in schedules}  # csv line of each block, for messages
+    reader = csv.DictReader(lines)
+    try:
+        missing = [c for c in IMPORT_COLUMNS if c not in (reader.fieldnames or ())]
+        if missing:
+            report.add(1, f"missing column(s): {', '.join(missing)}")
+            return None, report
+        by_tenant = "tenant" in reader.fieldnames
+        matched = 0
+        for row in reader:
+            line = reader.line_num
+            get = lambda c: (row.get(c) or "").strip()
+            if by_tenant and get("tenant") != tenant.id:
+                continue
+            matched += 1
+            day = get("day").lower()
+            if day not in schedules:
+                report.add(line, f"unknown day {day!r} (expected {', '.join(schedules)})")
+            block, errors = check_block(*(get(c) for c in BLOCK_FIELDS))
+            for e in errors:
+                report.add(line, e)
+            if block and day in schedules:
+                schedules[day].append(block)
+                src_lines[day].append(line)
+        if by_tenant and not matched:
+            # a file for other schools only: importing it would empty every day
+            report.add(1, f"no rows for tenant {tenant.id!r}")
+    except csv.Error as e:
+        report.add(reader.line_num, f"unreadable CSV: {e}")
+
+    for key, blocks in schedules.items():
+        at = src_lines[key]
+        for i, message in check_day(key, blocks, where=lambda i: f"line {at[i]}"):
+            report.add(at[i], message)
+        report.blocks += len(blocks)
+    report.errors.sort(key=lambda e: e[0])
+    return (None if report.count else schedules), report
+
+# =================== WHAT-IF SIMULATOR ===================
+# "How many open minutes would students get with 10 instead of 15 closed
+# minutes, with lunch exempt, or with next year's bells?" over a whole term.
+# A term has only a few distinct school days, one per schedule template the
+# calendar uses. So the calendar is reduced to a day count per template in one
+# pass; each (variant, template) pair is run once through compile_day(), the
+# code behind the live status; and term totals are those per-day figures
+# weighted by the day counts. Hundreds of variants over 180 days come to a few
+# hundred compiles.
+SIMULATE_MAX_VARIANTS = 500
+SIMULATE_DEFAULT_DAYS = 180
+SIMULATE_MAX_CLOSED_MIN = 120
+
+def term_day_counts(tenant, first, last):
+    """{template key: school days using it} from ``first`` to ``last`` (inclusive)."""
+    resolve = tenant.get_calendar().resolve
+    counts = defaultdict(int)
+    day = first
+    while day <= last:
+        key, _ = resolve(day)
+        if key:
+            counts[key] += 1
+        day += timedelta(days=1)
+    return dict(counts)
+
+def parse_variant(raw, i, tenant, schedules):
+    """A variant from JSON: {"name", "closed_min", "period_closed_min": {label: min},
+    "schedules": {day key: [blocks]}} (every field optional). Raises ValueError."""
+    if not isinstance(raw, dict):
+        raise ValueError(f"variant {i + 1} must be an object")
+    name = str(raw.get("name") or f"variant {i + 1}")
+    errors = []
+
+    def minutes(value, what):
+        try:
+            n = int(value)
+        except (TypeError, ValueError):
+            n = -1
+        if not 0 <= n <= SIMULATE_MAX_CLOSED_MIN:
+            errors.append(f"{name}: {what} must be 0-{SIMULATE_MAX_CLOSED_MIN} minutes")
+        return n
+
+    closed_min = minutes(raw.get("closed_min", tenant.closed_min), "closed_min")
+    per_period = {str(label): minutes(n, f"closed minutes for {label}")
+                  for label, n in (raw.get("period_closed_min") or {}).items()}
+    variant_schedules = dict(schedules)
+    for key, blocks in (raw.get("schedules") or {}).items():
+        checked = []
+        for j, b in enumerate(blocks if isinstance(blocks, list) else [None]):
+            if not isinstance(b, dict):
+                errors.append(f"{name}: {key} row {j + 1} must be an object")
+                continue
+            block, problems = check_block(str(b.get("label", "")), str(b.get("is_class", "1")),
+                                          str(b.get("start", "")), str(b.get("end", "")))
+            errors += [f"{name}: {key} row {j + 1}: {p}" for p in problems]
+            if block:
+                checked.append(block)
+        errors += [f"{name}: {msg}" for _, msg in check_day(key, checked)]
+        variant_schedules[key] = checked
+    if errors:
+        raise ValueError(*errors)
+    return {"name": name, "closed_min": closed_min, "period_closed_min": per_period,
+            "schedules": variant_schedules}
+
+def simulate_day(day, rows, tz, closed_min, period_closed_min):
+    """(open minutes by period, longest closed stretch, its start, conflicts) for one school day."""
+    starts, segments, periods, _ = compile_day(day, rows, tz, closed_min, period_closed_min)
+    open_by_period = defaultdict(float)
+    longest, longest_at, run, run_start = 0.0, None, 0.0, None
+    for i in range(1, len(segments)):
+        minutes = (starts[i + 1] - starts[i]).total_seconds() / 60
+        if segments[i][0] == "OPEN":
+            open_by_period[periods[i]] += minutes
+            run = 0.0
+            continue
+        if not run:
+            run_start = starts[i]
+        run += minutes
+        if run > longest:
+            longest, longest_at = run, run_start
+    conflicts = []
+    for label, is_class, s, e in rows:
+        closed = period_closed_min.get(label, closed_min)
+        length = (e.hour * 60 + e.minute) - (s.hour * 60 + s.minute)
+        if is_class and length <= 2 * closed:
+            conflicts.append(f"{label} is never open ({length} min long, {closed} closed at each end)")
+    return open_by_period, longest, longest_at, conflicts
+
+def simulate(tenant, variants, first, last):
+    """Term totals for each parsed variant (see parse_variant)."""
+    counts = term_day_counts(tenant, first, last)
+    cache = {}  # same rows and rules -> same day, whichever variant asks
+    results = []
+    for v in variants:
+        days, open_total = 0, 0.0
+        by_period = defaultdict(float)
+        longest, longest_at, conflicts = 0.0, None, []
+        labels = set()
+        for key, n in sorted(counts.items()):
+            rows = parse_rows(v["schedules"].get(key, []))
+            if not rows:
+                continue
+            labels.update(r[0] for r in rows)
+            rules = tuple(sorted((label, c) for label, c in v["period_closed_min"].items()))
+            cache_key = (tuple(rows), v["closed_min"], rules)
+            day_result = cache.get(cache_key)
+            if day_result is None:
+                day_result = cache[cache_key] = simulate_day(
+                    first, rows, tenant.tz, v["closed_min"], v["period_closed_min"])
+            open_by_period, day_longest, day_longest_at, day_conflicts = day_result
+            days += n
+            for label, minutes in open_by_period.items():
+                by_period[label] += minutes * n
+                open_total += minutes * n
+            if day_longest > longest:
+                longest = day_longest
+                longest_at = {"template": key, "start": day_longest_at.strftime("%H:%M")}
+            conflicts += [f"{key}: {c}" for c in day_conflicts]
+        conflicts += [f"no block is labelled {label!r}" for label in v["period_closed_min"] if label not in labels]
+        results.append({
+            "name": v["name"],
+            "closed_min": v["closed_min"],
+            "period_closed_min": v["period_closed_min"],
+            "school_days": days,
+            "open_minutes": round(open_total),
+            "open_minutes_per_day": round(open_total / days, 1) if days else 0,
+            "periods": {label: {"open_minutes": round(m), "per_day": round(m / days, 1)}
+                        for label, m in sorted(by_period.items())},
+            "longest_closed_min": round(longest),
+            "longest_closed": longest_at,
+            "conflicts": conflicts,
+        })
+    return {"from": first.isoformat(), "to": last.isoformat(), "school_days_by_template": counts,
+            "variants": results}
+
 # =================== ROUTES ===================
 @app.route("/")
 def index():
-    schedules = load_schedules()
-    counters = load_counters()
-    now = datetime.now(TZ)
-    status, reason, next_dt = current_status(now, schedules)
-    opens = compute_open_windows_for_today(now, schedules)
-    return render_template_string(
-        DASHBOARD_HTML,
-        now_fmt=now.strftime("%A, %B %-d • %-I:%M %p"),
-        status=status, reason=reason,
-        next_change=next_dt.strftime("%-I:%M %p") if next_dt else None,
-        open_blocks=opens, closed_min=CLOSED_MIN,
-        counters=counters
+    tenant = current_tenant()
+    tenant.transitions.page_root = request.script_root
+    etag, page = dashboard_page(tenant, tenant.now())
+    raw, gz = page or (None, None)
+    return bytes_response(raw, gz, "text/html", etag, "no-cache")
+
+@app.route("/api/status", methods=["GET"])
+def get_status():
+    tenant = current_tenant()
+    now = tenant.now()
+    payload = status_payload(now, tenant.get_timeline(now.date()))
+    payload["now"] = now.isoformat(timespec="seconds")
+    if tenant.occupancy:
+        payload["bathrooms"] = bathroom_states(payload["status"], tenant.occupancy.snapshot())
+    return jsonify(payload)
+
+@app.route("/api/today", methods=["GET"])
+def get_today():
+    """
+    Compact compiled timeline for today and tomorrow, for kiosks that evaluate
+    status themselves. Versioned by ETag; a matching If-None-Match gets a 304.
+    Returns: {"date", "version", "tz", "valid_until",
+              "segments": [[start_ms, status, reason, next_change_ms|null], ...],
+              "open": [[start_ms, end_ms, label], ...]}
+    """
+    tenant = current_tenant()
+    body, etag = tenant.today_payload(tenant.now().date())
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@app.route("/api/timeline", methods=["GET"])
+def get_timeline_range():
+    """
+    Query: from=YYYY-MM-DD&to=YYYY-MM-DD[&format=ndjson|csv]
+    Streams one record per transition and per open window (see TIMELINE_FIELDS).
+    """
+    tenant = current_tenant()
+    try:
+        today = tenant.now().date()
+        first = date.fromisoformat(request.args.get("from") or today.isoformat())
+        last = date.fromisoformat(request.args.get("to") or first.isoformat())
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+    if last < first or (last - first).days >= TIMELINE_MAX_DAYS:
+        return jsonify({"error": f"range must be 1-{TIMELINE_MAX_DAYS} days"}), 400
+    fmt = request.args.get("format", "ndjson").lower()
+    records = iter_timeline_records(tenant, first, last)
+
+    if fmt == "csv":
+        rows = ([rec.get(f, "") for f in TIMELINE_FIELDS] for rec in records)
+        return Response(
+            stream_with_context(iter_csv(TIMELINE_FIELDS, rows)), mimetype="text/csv",
+            headers={"Content-Disposition": f"attachment; filename=timeline_{first}_{last}.csv"},
+        )
+    if fmt != "ndjson":
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    return Response(
+        stream_with_context(json.dumps(rec) + "\n" for rec in records),
+        mimetype="application/x-ndjson",
+    )
+
+@app.route("/api/stream")
+def stream():
+    """Server-Sent Events: `status` and `counters` events, sent only on change.
+
+    204 (clients poll instead) unless the server is threaded or async: on a
+    sync gunicorn worker every open stream would hold the whole worker.
+    """
+    if not request.environ.get("wsgi.multithread"):
+        return "", 204
+    return Response(
+        stream_with_context(current_tenant().hub.subscribe()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 # --- JSON endpoints for counters ---
+def json_int(value):
+    """``value`` if it is a JSON integer; ValueError for bools, floats and strings."""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"not an integer: {value!r}")
+    return value
+
 @app.route("/api/counters", methods=["GET"])
 def get_counters():
-    return jsonify(load_counters())
+    return jsonify(current_tenant().counter_totals())
 
 @app.route("/api/counter", methods=["POST"])
 def update_counter():
@@ -434,29 +3291,171 @@ def update_counter():
     Returns: {"girls": int, "boys": int}
     """
     data = request.get_json(silent=True) or {}
-    who = str(data.get("who", "")).lower()
-    delta = int(data.get("delta", 0))
+    try:
+        who = str(data.get("who", "")).lower()
+        delta = json_int(data.get("delta", 0))
+    except (AttributeError, ValueError):
+        return jsonify({"error": "invalid params"}), 400
     if who not in ("girls", "boys") or delta not in (-1, 1):
         return jsonify({"error": "invalid params"}), 400
 
-    counters = load_counters()
-    counters[who] = max(0, counters[who] + delta)  # clamp at 0 (no negatives)
-    save_counters(counters)
+    tenant = current_tenant()
+    counters, applied = tenant.counters.apply(who, delta)
+    tenant.hub.poke()
+    record_visit(tenant, tenant.now(), who, applied)
+    if tenant.sync:
+        counters = tenant.counter_totals()
     return jsonify(counters)
 
+@app.route("/api/counters/batch", methods=["POST"])
+def update_counters_batch():
+    """
+    Body JSON: {"ops": [{"id": str, "who": "girls"|"boys", "delta": int, "client_ts": ms}, ...]}
+    Applies all new ops in one locked transaction; ops whose id was already
+    applied are skipped, so clients can safely resend after a network error.
+    Returns: {"girls": int, "boys": int, "applied": [id, ...], "duplicates": int}
+    """
+    data = request.get_json(silent=True) or {}
+    ops = data.get("ops") if isinstance(data, dict) else None
+    if not isinstance(ops, list) or len(ops) > BATCH_MAX_OPS:
+        return jsonify({"error": f"ops must be a list of at most {BATCH_MAX_OPS}"}), 400
+    tenant = current_tenant()
+    now = tenant.now()
+    parsed = []
+    try:
+        for op in ops:
+            who = str(op["who"]).lower()
+            delta = json_int(op["delta"])
+            op_id = str(op["id"])[:64]
+            if who not in ("girls", "boys") or not op_id or not 0 < abs(delta) <= BATCH_MAX_DELTA:
+                raise ValueError
+            # Replayed presses are logged at the time they happened, within reason.
+            ts = now
+            if op.get("client_ts") is not None:
+                client = datetime.fromtimestamp(float(op["client_ts"]) / 1000, tenant.tz)
+                if now - timedelta(seconds=OP_ID_TTL) < client <= now + timedelta(minutes=1):
+                    ts = min(client, now)
+            parsed.append((op_id, who, delta, ts))
+    except (KeyError, TypeError, ValueError, OverflowError, OSError):
+        return jsonify({"error": "invalid ops"}), 400
+
+    applied = []
+
+    def apply(counters):
+        for op_id, who, delta, ts in parsed:
+            if not VisitLog.claim_op(conn, op_id, now.timestamp()):
+                continue
+            applied.append(op_id)
+            new = max(0, counters[who] + delta)  # clamp at 0 (no negatives)
+            if new != counters[who]:
+                tl = tenant.get_timeline(ts.date())
+                VisitLog.insert(conn, ts, who, new - counters[who], tl.period_at(ts), tl.window_at(ts))
+                counters[who] = new
+        return counters
+
+    try:
+        # The log's write lock first (BEGIN IMMEDIATE may wait on other
+        # writers); the counter lock is only held for the inserts themselves.
+        with tenant.visits.transaction() as conn:
+            if random.random() < 0.01:
+                VisitLog.prune_ops(conn, now.timestamp() - OP_ID_TTL)
+            counters = tenant.counters.update(apply)
+    except db_error() as e:
+        app.logger.error("counter batch failed: %s", e)
+        return jsonify({"error": "storage busy, retry"}), 503
+    if applied:
+        tenant.hub.poke()
+    if tenant.sync:
+        counters = tenant.counter_totals()
+    return jsonify({**counters, "applied": applied, "duplicates": len(parsed) - len(applied)})
+
+@app.route("/api/occupancy", methods=["GET", "POST"])
+def occupancy_event():
+    """
+    Only with occupancy tracking on (404 otherwise).
+    POST body JSON: {"who": "girls"|"boys", "event": "enter"|"exit", "id": optional op id}
+    An enter also counts as a visit (+1 on the counter). Resending an op id is a no-op.
+    Returns: {"window_min", "girls": {...}, "boys": {...}, "bathrooms": {who: status},
+              "counters": {...}, "applied": bool (POST only)}
+    """
+    tenant = current_tenant()
+    if not tenant.occupancy:
+        abort(404)
+    out = {}
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict) or not all(isinstance(data.get(f, ""), str) for f in ("who", "event", "id")):
+            return jsonify({"error": "invalid params"}), 400
+        who = data.get("who", "").lower()
+        kind = data.get("event", "").lower()
+        op_id = data.get("id", "")[:64]
+        if who not in OccupancyStore.KEYS or kind not in ("enter", "exit"):
+            return jsonify({"error": "invalid params"}), 400
+        now = tenant.now()
+        applied = True
+        if op_id:
+            try:
+                with tenant.visits.transaction() as conn:
+                    applied = VisitLog.claim_op(conn, op_id, now.timestamp())
+            except db_error() as e:
+                app.logger.error("occupancy op claim failed: %s", e)
+                return jsonify({"error": "storage busy, retry"}), 503
+        if applied:
+            applied = tenant.occupancy.event(who, kind, now.timestamp())
+        if applied and kind == "enter":
+            _, delta = tenant.counters.apply(who, 1)
+            record_visit(tenant, now, who, delta)
+        if applied:
+            tenant.hub.poke()
+        out["applied"] = applied
+    now = tenant.now()
+    occupancy = tenant.occupancy.snapshot(now.timestamp())
+    status = tenant.get_timeline(now.date()).status_at(now)[0]
+    return jsonify({**occupancy, "bathrooms": bathroom_states(status, occupancy),
+                    "counters": tenant.counter_totals(), **out})
+
+@app.route("/api/peer/state", methods=["GET", "POST"])
+def peer_state():
+    """
+    Peer sync exchange (404 unless peers are configured; X-Peer-Key must match
+    BATHROOM_PEER_KEY if that is set, else only the configured peers may call).
+    POST body JSON: {"node": str, "nodes": {node: {"girls": [inc, dec], "boys": [inc, dec]}}}
+    Merges the sender's tallies, then returns ours the same way, so one request
+    brings both sides up to date.
+    """
+    tenant = current_tenant()
+    if not tenant.sync:
+        abort(404)
+    if PEER_KEY:
+        if not hmac.compare_digest(request.headers.get("X-Peer-Key", ""), PEER_KEY):
+            abort(403)
+    elif not tenant.sync.allows(request.remote_addr):
+        abort(403)
+    tenant.sync.ensure_running()
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        try:
+            nodes = parse_tallies(data.get("nodes"))
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError):
+            return jsonify({"error": "invalid nodes"}), 400
+        tenant.sync.merge(nodes)
+    return jsonify({"node": node_id(), "nodes": tenant.sync.state()})
+
 # -------- Admin Auth --------
 @app.route("/admin", methods=["GET", "POST"])
 def admin_login():
     if request.method == "POST":
         pin = request.form.get("pin", "")
-        if pin == ADMIN_PIN:
-            session["admin"] = True
+        tenant = current_tenant()
+        if pin == tenant.admin_pin:
+            # Admin rights are per tenant; one browser may hold several.
+            session["admin_for"] = sorted(set(session.get("admin_for", [])) | {tenant.id})
             return redirect(url_for("admin_schedule"))
-        return render_template_string(ADMIN_LOGIN_HTML, msg="Incorrect PIN")
-    return render_template_string(ADMIN_LOGIN_HTML, msg=None)
+        return render_template("admin_login.html", msg="Incorrect PIN")
+    return render_template("admin_login.html", msg=None)
 
 def require_admin():
-    return session.get("admin") == True
+    return current_tenant().id in session.get("admin_for", ())
 
 # -------- Schedule Editor --------
 @app.route("/admin/schedule", methods=["GET", "POST"])
@@ -464,6 +3463,8 @@ def admin_schedule():
     if not require_admin():
         return redirect(url_for("admin_login"))
 
+    tenant = current_tenant()
+    day_keys = tenant.template_keys()
     schedules = load_schedules()
 
     if request.method == "POST":
@@ -475,36 +3476,254 @@ def admin_schedule():
         # Delete row?
         delete = request.form.get("delete")
         if delete:
-            key, idx = delete.split("__")
-            idx = int(idx)
+            try:
+                key, idx = delete.split("__")
+                idx = int(idx)
+            except ValueError:
+                abort(400)
             if key in schedules and 0 <= idx < len(schedules[key]):
-                schedules[key].pop(idx)
-                save_schedules(schedules)
+                removed = schedules[key].pop(idx)
+                save_schedules(schedules, note=f"deleted {removed['label']} ({key})")
             return redirect(url_for("admin_schedule"))
 
-        # Update existing rows
-        for key in DAY_KEYS:
-            for i in range(len(schedules[key])):
-                schedules[key][i]["label"] = request.form.get(f"{key}__label__{i}", schedules[key][i]["label"])
-                schedules[key][i]["is_class"] = int(request.form.get(f"{key}__is_class__{i}", schedules[key][i]["is_class"]))
-                schedules[key][i]["start"] = request.form.get(f"{key}__start__{i}", schedules[key][i]["start"])
-                schedules[key][i]["end"]   = request.form.get(f"{key}__end__{i}", schedules[key][i]["end"])
-
-        # Add new rows (if provided)
-        for key in DAY_KEYS:
+        # Update existing rows, add new ones (if provided); checked like the JSON API
+        edited, errors = {}, []
+        for key in day_keys:
+            rows = []
+            for i, row in enumerate(schedules.get(key, [])):
+                fields = [request.form.get(f"{key}__{f}__{i}", str(row[f])) for f in BLOCK_FIELDS]
+                block, problems = check_block(*fields)
+                errors += [f"{tenant.day_label(key)} row {i + 1}: {e}" for e in problems]
+                rows.append(dict(row, **block) if block else row)
             nlabel = request.form.get(f"{key}__new__label", "").strip()
             nstart = request.form.get(f"{key}__new__start", "").strip()
             nend   = request.form.get(f"{key}__new__end", "").strip()
             niscl  = request.form.get(f"{key}__new__is_class", "1").strip()
             if nlabel and nstart and nend:
-                schedules[key].append({"label": nlabel, "is_class": int(niscl), "start": nstart, "end": nend})
+                block, problems = check_block(nlabel, niscl, nstart, nend)
+                errors += [f"{tenant.day_label(key)} new row: {e}" for e in problems]
+                if block:
+                    rows.append(block)
+            rows.sort(key=lambda r: r["start"])
+            errors += [m for _, m in check_day(tenant.day_label(key), rows)]
+            edited[key] = rows
+        if errors:
+            return render_schedule_editor(tenant, schedules, form_errors=errors), 422
 
-        save_schedules(schedules)
+        schedules.update(edited)
+        save_schedules(schedules, note="edited")
         return redirect(url_for("admin_schedule"))
 
-    return render_template_string(
-        ADMIN_SCHEDULE_HTML,
-        schedules=schedules, day_keys=DAY_KEYS, closed_min=CLOSED_MIN
+    return render_schedule_editor(tenant, schedules)
+
+def render_schedule_editor(tenant, schedules, import_report=None, form_errors=None):
+    day_keys = tenant.template_keys()
+    return render_template(
+        "admin_schedule.html",
+        schedules=schedules, day_keys=day_keys, closed_min=tenant.closed_min,
+        day_label=tenant.day_label, tenant=tenant, revisions=tenant.storage.revisions(tz=tenant.tz),
+        import_report=import_report, form_errors=form_errors,
+        etags={k: day_etag(schedules.get(k, [])) for k in day_keys},
+        profiles=list_profiles(),
+    )
+
+@app.route("/admin/schedule/restore/<int:rev_id>", methods=["POST"])
+def restore_schedule(rev_id):
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+    data = current_tenant().storage.revision(rev_id)
+    if data is None:
+        abort(404)
+    save_schedules(data, note=f"restored revision {rev_id}")
+    return redirect(url_for("admin_schedule"))
+
+# -------- Schedule API (Admin only) --------
+# GET    /api/schedule                      every day key: {"days": {key: {"etag", "rows"}}}
+# GET    /api/schedule/<day_key>            one day key, with its ETag
+# POST   /api/schedule/<day_key>            add a row                  (If-Match)
+# PATCH  /api/schedule/<day_key>/<row_id>   change some fields of a row (If-Match)
+# DELETE /api/schedule/<day_key>/<row_id>   remove a row               (If-Match)
+# Writes must send the day key's ETag in If-Match and get 412 (with the
+# current rows) if someone changed that day since; other day keys can be
+# edited at the same time. PATCH takes a merge patch ({"start": "08:15"}) or
+# a JSON Patch list of add/replace/test operations on top-level fields (a
+# failed test gets 409 and changes nothing; other ops get 422). Rows are kept
+# in start order, and a change that would overlap another block gets 422.
+class ScheduleEditError(Exception):
+    def __init__(self, status, body):
+        super().__init__(status)
+        self.status, self.body = status, body
+
+@app.errorhandler(ScheduleEditError)
+def schedule_edit_error(e):
+    return jsonify(e.body), e.status
+
+def require_admin_api():
+    if not require_admin():
+        raise ScheduleEditError(401, {"error": "admin login required"})
+
+def schedule_day_response(key, rows, status=200, **extra):
+    etag = day_etag(rows)
+    resp = jsonify({"day": key, "etag": etag, "rows": rows, **extra})
+    resp.status_code = status
+    resp.set_etag(etag)
+    return resp
+
+def _field_text(value):
+    return str(int(value) if isinstance(value, bool) else value)
+
+def apply_block_patch(ops, base):
+    """Block fields set by a JSON Patch (add/replace; test checks a field
+    first and a failure aborts the whole patch)."""
+    if not isinstance(ops, list) or not ops:
+        raise ScheduleEditError(400, {"error": "bad JSON Patch document"})
+    doc, fields = dict(base or {}), {}
+    for op in ops:
+        try:
+            name, field = op["op"], op["path"].lstrip("/")
+            if name in ("add", "replace", "test"):
+                value = op["value"]
+        except (TypeError, KeyError, AttributeError):
+            raise ScheduleEditError(400, {"error": "bad JSON Patch document"})
+        if name in ("add", "replace"):
+            doc[field] = fields[field] = value
+        elif name == "test":
+            if field not in doc or _field_text(doc[field]) != _field_text(value):
+                raise ScheduleEditError(409, {"error": f"test failed: {op['path']} is not {value!r}"})
+        else:
+            raise ScheduleEditError(422, {"error": f"unsupported JSON Patch op {name!r} (use add, replace or test)"})
+    return fields
+
+def block_from_json(body, base=None):
+    """A validated block from request fields laid over ``base`` (for PATCH)."""
+    if isinstance(body, list):  # JSON Patch: [{"op": "replace", "path": "/start", "value": ...}]
+        body = apply_block_patch(body, base)
+    elif not isinstance(body, dict) or not body:
+        raise ScheduleEditError(400, {"error": "expected a JSON object of block fields"})
+    unknown = sorted(set(body) - set(BLOCK_FIELDS))
+    if unknown:
+        raise ScheduleEditError(422, {"errors": [f"unknown field(s): {', '.join(unknown)}"]})
+    fields = {f: str((base or {}).get(f, "")) for f in BLOCK_FIELDS}
+    fields.update({f: _field_text(v) for f, v in body.items()})
+    block, errors = check_block(*(fields[f] for f in BLOCK_FIELDS))
+    if errors:
+        raise ScheduleEditError(422, {"errors": errors})
+    return block
+
+def edit_day(key, change, note):
+    """Apply ``change(rows) -> rows`` to one day key under the storage write
+    lock, if the stored rows still match If-Match. Returns the saved rows."""
+    tenant = current_tenant()
+    if key not in tenant.template_keys():
+        raise ScheduleEditError(404, {"error": f"unknown day key {key!r}"})
+    if not request.if_match:
+        raise ScheduleEditError(428, {"error": "send the day's ETag in If-Match"})
+
+    def apply(schedules):
+        rows = schedules.get(key, [])
+        if day_etag(rows) not in request.if_match:
+            raise ScheduleEditError(412, {"error": f"{key} was changed by someone else",
+                                          "day": key, "etag": day_etag(rows), "rows": rows})
+        rows = sorted(change([dict(r) for r in rows]), key=lambda r: r["start"])
+        problems = check_day(key, rows)
+        if problems:
+            raise ScheduleEditError(422, {"errors": [m for _, m in problems]})
+        schedules[key] = rows
+        return schedules
+    return update_schedules(apply, tenant, note=note)[key]
+
+def find_row(rows, row_id, key):
+    for i, r in enumerate(rows):
+        if r.get("id") == row_id:
+            return i
+    raise ScheduleEditError(404, {"error": f"no row {row_id!r} in {key}"})
+
+@app.route("/api/schedule", methods=["GET"])
+def schedule_api():
+    require_admin_api()
+    tenant = current_tenant()
+    schedules = load_schedules()
+    return jsonify({"days": {k: {"etag": day_etag(schedules.get(k, [])), "rows": schedules.get(k, [])}
+                             for k in tenant.template_keys()}})
+
+@app.route("/api/schedule/<day_key>", methods=["GET", "POST"])
+def schedule_day_api(day_key):
+    require_admin_api()
+    if request.method == "GET":
+        if day_key not in current_tenant().template_keys():
+            abort(404)
+        return schedule_day_response(day_key, load_schedules().get(day_key, []))
+
+    block = block_from_json(request.get_json(silent=True))
+
+    def add(rows):
+        taken = {r.get("id") for r in rows}
+        block["id"] = os.urandom(4).hex()
+        while block["id"] in taken:
+            block["id"] = os.urandom(4).hex()
+        return rows + [block]
+    rows = edit_day(day_key, add, note=f"added {block['label']} ({day_key})")
+    return schedule_day_response(day_key, rows, 201, row=block)
+
+@app.route("/api/schedule/<day_key>/<row_id>", methods=["PATCH", "DELETE"])
+def schedule_row_api(day_key, row_id):
+    require_admin_api()
+    if request.method == "DELETE":
+        def delete(rows):
+            rows.pop(find_row(rows, row_id, day_key))
+            return rows
+        rows = edit_day(day_key, delete, note=f"deleted {day_key} row {row_id}")
+        return schedule_day_response(day_key, rows)
+
+    patch = request.get_json(silent=True)
+    changed = {}
+
+    def update(rows):
+        i = find_row(rows, row_id, day_key)
+        rows[i] = changed["row"] = dict(block_from_json(patch, base=rows[i]), id=row_id)
+        return rows
+    rows = edit_day(day_key, update, note=f"edited {day_key} row {row_id}")
+    return schedule_day_response(day_key, rows, row=changed["row"])
+
+# -------- Usage analytics (Admin only) --------
+ANALYTICS_DEFAULT_DAYS = 120
+OUTSIDE_PERIODS = ["Before school", "Passing time", "After school", "No school"]
+
+@app.route("/admin/analytics")
+def admin_analytics():
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+    tenant = current_tenant()
+    today = tenant.now().date()
+    try:
+        last = date.fromisoformat(request.args.get("to") or today.isoformat())
+        first = date.fromisoformat(request.args.get("from")
+                                   or (last - timedelta(days=ANALYTICS_DEFAULT_DAYS)).isoformat())
+    except ValueError:
+        abort(400)
+
+    heat = defaultdict(int)
+    by_period, by_who, by_window = defaultdict(int), defaultdict(int), defaultdict(int)
+    days = []
+    for day, period, window, who, visits in tenant.visits.usage(first, last):
+        if not days or days[-1] != day:
+            days.append(day)
+        heat[(period, day)] += visits
+        by_period[period] += visits
+        by_who[who] += visits
+        by_window[window] += visits
+
+    # Rows in schedule order, then the gaps around and between blocks.
+    _, schedules = tenant.get_schedules()
+    order = [r["label"] for k in tenant.template_keys() for r in schedules.get(k, [])]
+    order = list(dict.fromkeys(["Before school"] + order + OUTSIDE_PERIODS))
+    periods = [p for p in order if p in by_period] + sorted(p for p in by_period if p not in order)
+
+    return render_template(
+        "admin_analytics.html", tenant=tenant, first=first, last=last,
+        days=days, periods=periods, heat=heat, max_cell=max(heat.values(), default=1) or 1,
+        by_period=by_period, total=sum(by_who.values()),
+        by_who=sorted(by_who.items()), by_window=sorted(by_window.items(), key=lambda kv: -kv[1]),
     )
 
 # -------- Reset counters (Admin only) --------
@@ -512,7 +3731,12 @@ def admin_schedule():
 def reset_counters():
     if not require_admin():
         return redirect(url_for("admin_login"))
-    save_counters({"girls": 0, "boys": 0})
+    tenant = current_tenant()
+    tenant.counters.set({"girls": 0, "boys": 0})
+    tenant.counters.flush()
+    if tenant.occupancy:
+        tenant.occupancy.reset()
+    tenant.hub.poke()
     return redirect(url_for("admin_schedule"))
 
 # -------- CSV Import/Export --------
@@ -520,45 +3744,170 @@ def reset_counters():
 def download_csv():
     if not require_admin():
         return redirect(url_for("admin_login"))
-    schedules = load_schedules()
-    with open(CSV_EXPORT, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["day","label","is_class","start","end"])
-        for day in DAY_KEYS:
-            for r in schedules.get(day, []):
-                w.writerow([day, r["label"], int(r["is_class"]), r["start"], r["end"]])
-    return send_file(CSV_EXPORT, as_attachment=True)
+    tenant = current_tenant()
+    load_schedules()  # writes the defaults on first use
+    rows = tenant.storage.schedule_rows(tenant.template_keys())
+    return Response(
+        stream_with_context(iter_csv(["day", "label", "is_class", "start", "end"], rows)),
+        mimetype="text/csv", headers={"Content-Disposition": f"attachment; filename={CSV_EXPORT}"},
+    )
 
 @app.route("/admin/upload", methods=["POST"])
 def upload_csv():
     if not require_admin():
         return redirect(url_for("admin_login"))
+    tenant = current_tenant()
     file = request.files.get("file")
     if not file or not file.filename.lower().endswith(".csv"):
         flash("Please upload a CSV file.")
         return redirect(url_for("admin_schedule"))
-    content = file.read().decode("utf-8").splitlines()
-    reader = csv.DictReader(content)
-    new_sched = {k: [] for k in DAY_KEYS}
-    for row in reader:
-        day = (row.get("day","") or "").strip().lower()
-        if day not in DAY_KEYS:  # ignore unknown day keys
-            continue
-        new_sched[day].append({
-            "label": (row.get("label","") or "").strip(),
-            "is_class": int((row.get("is_class","1") or "1").strip()),
-            "start": (row.get("start","") or "").strip(),
-            "end": (row.get("end","") or "").strip()
-        })
-    save_schedules(new_sched)
+    try:
+        schedules, report = import_schedule_csv(
+            io.TextIOWrapper(file.stream, encoding="utf-8-sig", newline=""), tenant)
+    except UnicodeDecodeError:
+        flash("The file is not UTF-8 text.")
+        return redirect(url_for("admin_schedule"))
+    if schedules is None:
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify({"error_count": report.count,
+                            "errors": [{"line": l, "error": m} for l, m in report.errors]}), 400
+        return render_schedule_editor(tenant, load_schedules(), import_report=report), 400
+    # One storage write swaps the whole schedule and moves its version, so every
+    # worker recompiles from the new one on its next check.
+    save_schedules(schedules, note=f"CSV upload ({file.filename})")
+    flash(f"Imported {report.blocks} blocks from {file.filename}.")
     return redirect(url_for("admin_schedule"))
 
+# -------- What-if simulator (Admin only) --------
+@app.route("/admin/simulate", methods=["GET", "POST"])
+def simulate_api():
+    """
+    GET  ?closed_min=10,15,20&from=YYYY-MM-DD&to=YYYY-MM-DD
+    POST {"from": ..., "to": ..., "variants": [{"name", "closed_min",
+          "period_closed_min": {label: min}, "schedules": {day key: [blocks]}}]}
+    Term totals per variant against the saved schedule (see WHAT-IF SIMULATOR).
+    """
+    require_admin_api()
+    tenant = current_tenant()
+    if request.method == "POST":
+        params = request.get_json(silent=True) or {}
+        if not isinstance(params, dict):
+            return jsonify({"error": "expected a JSON object"}), 400
+    else:
+        params = request.args
+    try:
+        today = tenant.now().date()
+        first = date.fromisoformat(params.get("from") or today.isoformat())
+        last = date.fromisoformat(params.get("to") or (first + timedelta(days=SIMULATE_DEFAULT_DAYS - 1)).isoformat())
+    except (TypeError, ValueError):
+        return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+    if last < first or (last - first).days >= TIMELINE_MAX_DAYS:
+        return jsonify({"error": f"range must be 1-{TIMELINE_MAX_DAYS} days"}), 400
+    if request.method == "POST":
+        raw = params.get("variants") or [{}]
+    else:
+        raw = [{"name": f"{n} min", "closed_min": n}
+               for n in (params.get("closed_min") or f"{tenant.closed_min},10,15,20").split(",") if n.strip()]
+    if not isinstance(raw, list) or len(raw) > SIMULATE_MAX_VARIANTS:
+        return jsonify({"error": f"variants must be a list of at most {SIMULATE_MAX_VARIANTS}"}), 400
+
+    _, schedules = tenant.get_schedules()
+    variants, errors = [], []
+    for i, v in enumerate(raw):
+        try:
+            variants.append(parse_variant(v, i, tenant, schedules))
+        except ValueError as e:
+            errors += e.args
+    if errors:
+        return jsonify({"errors": errors[:IMPORT_MAX_ERRORS]}), 422
+    t0 = perf_counter()
+    result = simulate(tenant, variants, first, last)
+    result["seconds"] = round(perf_counter() - t0, 4)
+    return jsonify(result)
+
+# -------- Profiler (Admin only) --------
+@app.route("/admin/profile", methods=["POST"])
+def start_profile():
+    """Form or JSON: {"seconds": 30, "requests": 200, "all_threads": false}.
+    Sampling stops at whichever limit comes first."""
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+    params = request.get_json(silent=True) or request.form
+    try:
+        seconds = float(params.get("seconds") or PROFILE_MAX_SECONDS)
+        max_requests = int(params["requests"]) if params.get("requests") else None
+    except (TypeError, ValueError):
+        abort(400)
+    if seconds <= 0 or (max_requests is not None and max_requests <= 0):
+        abort(400)
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    all_threads = str(params.get("all_threads", "")).lower() in ("1", "true", "on")
+    name = profiler.start(seconds, max_requests, all_threads)
+    if request.is_json:
+        if name is None:
+            return jsonify({"error": "a profile is already running in this worker"}), 409
+        return jsonify({"profile": name, "pid": os.getpid(), "seconds": seconds, "requests": max_requests,
+                        "url": url_for("download_profile", name=name)}), 202
+    if name is None:
+        flash("A profile is already running in this worker.")
+    else:
+        flash(f"Profiling worker {os.getpid()}; {name} will be listed below when it finishes.")
+    return redirect(url_for("admin_schedule"))
+
+@app.route("/admin/profile/<name>")
+def download_profile(name):
+    if not require_admin():
+        return redirect(url_for("admin_login"))
+    if name not in list_profiles():
+        abort(404)
+    with open(os.path.join(PROFILES_DIR, name), encoding="utf-8") as f:
+        return Response(f.read(), mimetype="text/plain")
+
+# -------- Metrics --------
+def loaded_tenants():
+    with _tenants_lock:
+        return [_default_tenant] + list(_tenants.values())
+
+def local_gauges():
+    """This worker's part of the gauges that are summed over workers."""
+    return {("bathroom_push_clients", (t.id,)): t.hub.clients for t in loaded_tenants()}
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape target: request/storage/render metrics of every worker,
+    plus status and counter gauges of the tenants this worker has loaded."""
+    series, gauges, live = metrics.gather()
+    for tenant in loaded_tenants():
+        now = tenant.now()
+        gauges[("bathroom_open", (tenant.id,))] = int(tenant.get_timeline(now.date()).status_at(now)[0] == "OPEN")
+        for who, n in tenant.counter_totals().items():
+            gauges[("bathroom_counter", (tenant.id, who))] = n
+        if tenant.occupancy:
+            occupancy = tenant.occupancy.snapshot()
+            for who in OccupancyStore.KEYS:
+                gauges[("bathroom_occupancy", (tenant.id, who))] = occupancy[who]["occupancy"]
+    gauges[("bathroom_workers", ())] = live
+    return Response(render_metrics(series, gauges), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 # =================== MAIN ===================
 if __name__ == "__main__":
-    # ensure files exist
-    if not os.path.exists(DATA_JSON):
-        save_schedules(DEFAULT_SCHEDULES)
-    if not os.path.exists(COUNTERS_JSON):
-        save_counters({"girls": 0, "boys": 0})
+    if sys.argv[1:2] == ["migrate"]:
+        # python app.py migrate [--force]: JSON files -> SQLite, then set storage to sqlite
+        n = migrate_to_sqlite(force="--force" in sys.argv)
+        print(f"migrated {n} tenant(s); set BATHROOM_STORAGE=sqlite (or \"storage\": \"sqlite\") to use them")
+        sys.exit(0)
+    metrics.server_id = os.getpid()  # one process serves everything, no master
+    # ensure storage exists (default tenant; others are created on first use)
+    _default_tenant.get_schedules()
+    _default_tenant.counters.snapshot()
+    # Render the dashboard before the first request asks for it (see TRANSITIONS).
+    _default_tenant.transitions.page_root = ""
+    _default_tenant.transitions.ensure_running()
+    if "--async" in sys.argv or os.getenv("BATHROOM_SERVER") == "async":
+        # One event loop instead of a thread per connection (see asgi.py).
+        sys.modules.setdefault("app", sys.modules[__name__])  # asgi imports us as "app"
+        import asgi
+        asgi.main([a for a in sys.argv[1:] if a != "--async"])
+        sys.exit(0)
     app.run(host="0.0.0.0", port=PORT, debug=False)
 
@@ -0,0 +1,373 @@
+# asgi.py
+"""Async serving mode: one process, one event loop, thousands of kiosks.
+
+    python app.py --async                 # built-in asyncio HTTP/1.1 server
+    uvicorn asgi:application --port 5050  # or any ASGI server
+
+/api/stream runs natively on the event loop: an open Server-Sent Events
+connection is a coroutine and a socket, not a thread or a worker, and every
+stream of a tenant is woken by the tenant's one StatusHub scheduler. Every
+other route (dashboard, status, counters, admin ...) is the same Flask app,
+called through a small thread pool, so there is a single copy of the logic.
+"""
+import asyncio
+import io
+import os
+import signal
+import sys
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from urllib.parse import unquote
+
+import app as bathroom
+
+ASYNC_WSGI_THREADS = int(os.getenv("BATHROOM_ASYNC_THREADS", "16"))  # threads for Flask routes
+KEEPALIVE_IDLE = 75.0        # seconds an idle keep-alive connection is kept open
+BODY_TIMEOUT = 30.0          # seconds to receive a request body once the headers are in
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 16 * 1024 * 1024
+WSGI_CHUNKS_IN_FLIGHT = 8    # response chunks produced ahead of a slow client
+
+_pool = ThreadPoolExecutor(ASYNC_WSGI_THREADS, thread_name_prefix="wsgi")
+
+# =================== ASGI APP ===================
+class _Broadcast:
+    """Wakes the async streams of one StatusHub. Registered as a hub listener,
+    so it is called from the hub's scheduler thread."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    def __call__(self):
+        self.loop.call_soon_threadsafe(self._fire)
+
+    def _fire(self):
+        event, self.event = self.event, asyncio.Event()
+        event.set()
+
+_broadcasts = weakref.WeakKeyDictionary()  # StatusHub -> _Broadcast
+
+def _broadcast(hub):
+    bc = _broadcasts.get(hub)
+    if bc is None:
+        bc = _broadcasts[hub] = _Broadcast(asyncio.get_running_loop())
+        hub.listeners.add(bc)
+    return bc
+
+def _open_stream(tenant):
+    # What Flask's before_request hooks would do for the route (bind_tenant).
+    tenant.transitions.ensure_running()
+    tenant.hub.attach()
+
+async def stream(tenant, send, receive):
+    """/api/stream: the same frames as StatusHub.subscribe(), without a thread."""
+    t0 = perf_counter()
+    hub = tenant.hub
+    loop = asyncio.get_running_loop()
+    bc = _broadcast(hub)
+    await loop.run_in_executor(_pool, _open_stream, tenant)
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ]})
+        await send({"type": "http.response.body", "body": b"retry: 5000\n\n", "more_body": True})
+        # recorded like the Flask route's: time until the stream is open
+        bathroom.metrics.observe("bathroom_http_request_duration_seconds", perf_counter() - t0, ("/api/stream", "GET"))
+        bathroom.metrics.inc("bathroom_http_requests_total", ("/api/stream", "GET", "200"))
+        seen = {}
+        while True:
+            event = bc.event  # taken before reading the hub, so no change is missed
+            frames = hub.frames(seen)
+            if frames:
+                await send({"type": "http.response.body", "body": frames.encode(), "more_body": True})
+            woken = asyncio.ensure_future(event.wait())
+            done, _ = await asyncio.wait([disconnected, woken], timeout=bathroom.STREAM_KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            woken.cancel()
+            if disconnected in done:
+                return
+            if not done:
+                await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        disconnected.cancel()
+        hub.detach()
+
+async def _wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+async def call_wsgi(scope, body, send):
+    """Run the Flask app for one request in the thread pool."""
+    loop = asyncio.get_running_loop()
+    headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in headers:
+        key = name.upper().replace("-", "_")
+        if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[key] = value
+        else:
+            key = "HTTP_" + key
+            environ[key] = environ[key] + "," + value if key in environ else value
+    started = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in response_headers]
+
+    # The whole response is produced by one pool thread (Flask's streamed
+    # responses keep their request context in that thread) and handed over
+    # chunk by chunk, at most WSGI_CHUNKS_IN_FLIGHT ahead of the socket.
+    queue = asyncio.Queue()
+    room = threading.Semaphore(WSGI_CHUNKS_IN_FLIGHT)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        result = None
+        try:
+            result = bathroom.app(environ, start_response)
+            for chunk in result:
+                room.acquire()
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, chunk)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = loop.run_in_executor(_pool, produce)
+    try:
+        chunk = await queue.get()
+        if chunk is done:
+            await producer  # re-raises if the app failed before responding
+        await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+        while chunk is not done:
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            room.release()
+            chunk = await queue.get()
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        stop.set()
+        room.release()  # unblock the producer if the client went away mid-response
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    host = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"host"), "")
+    tid, _, path = bathroom.split_tenant(scope["path"], host)
+    if path == "/api/stream" and scope["method"] == "GET":
+        tenant = bathroom.get_tenant(tid)
+        if tenant is not None:
+            await receive()  # the (empty) request body
+            return await stream(tenant, send, receive)
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    await call_wsgi(scope, body, send)
+
+# =================== BUILT-IN SERVER ===================
+# A small HTTP/1.1 server for `application`, so the async mode needs nothing
+# beyond the standard library. Keep-alive, Content-Length request bodies, and
+# chunked responses when the length isn't known up front.
+STATUS_TEXT = {200: "OK", 201: "Created", 204: "No Content", 302: "Found", 304: "Not Modified",
+               400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+               405: "Method Not Allowed", 408: "Request Timeout", 409: "Conflict", 412: "Precondition Failed",
+               413: "Content Too Large", 422: "Unprocessable Content", 428: "Precondition Required",
+               500: "Internal Server Error", 501: "Not Implemented", 503: "Service Unavailable"}
+
+class _Connection:
+    def __init__(self, reader, writer, port):
+        self.reader = reader
+        self.writer = writer
+        self.port = port
+        self.peer = writer.get_extra_info("peername") or ("", 0)
+
+    async def serve(self):
+        try:
+            while await self.request():
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+        except asyncio.CancelledError:  # server shutting down
+            pass
+        finally:
+            self.writer.close()
+
+    async def request(self):
+        """Handle one request; False when the connection should close."""
+        head = await asyncio.wait_for(self.reader.readuntil(b"\r\n\r\n"), KEEPALIVE_IDLE)
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            return await self.error(400)
+        headers = []
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers.append((name.strip().lower().encode("latin-1"), value.strip().encode("latin-1")))
+        fields = dict(headers)
+        if b"chunked" in fields.get(b"transfer-encoding", b""):
+            return await self.error(501)
+        try:
+            length = int(fields.get(b"content-length", b"0") or 0)
+        except ValueError:
+            return await self.error(400)
+        if length < 0:
+            return await self.error(400)
+        if length > MAX_BODY_BYTES:
+            return await self.error(413)
+        try:
+            body = await asyncio.wait_for(self.reader.readexactly(length), BODY_TIMEOUT) if length else b""
+        except asyncio.TimeoutError:
+            return await self.error(408)
+        conn = fields.get(b"connection", b"").lower()
+        keep_alive = conn == b"keep-alive" if version == "HTTP/1.0" else conn != b"close"
+
+        path, _, query = target.partition("?")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": version[5:],
+            "method": method, "scheme": "http", "path": unquote(path), "raw_path": path.encode("latin-1"),
+            "query_string": query.encode("latin-1"), "root_path": "", "headers": headers,
+            "server": ("0.0.0.0", self.port), "client": self.peer[:2],
+        }
+        state = {"chunked": False, "sent": False, "done": False}
+        body_sent = False
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Only streaming responses get here: wait for the client to go away.
+            await self.reader.read(1)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            more = message.get("more_body", False)
+            chunk = message.get("body", b"")
+            if "start" in state:
+                start = state.pop("start")
+                out = [f"HTTP/1.1 {start['status']} {STATUS_TEXT.get(start['status'], 'Unknown')}\r\n".encode()]
+                names = set()
+                for k, v in start.get("headers", []):
+                    names.add(k.lower())
+                    out.append(k + b": " + v + b"\r\n")
+                if b"content-length" not in names:
+                    if more:
+                        state["chunked"] = True
+                        out.append(b"transfer-encoding: chunked\r\n")
+                    else:
+                        out.append(b"content-length: %d\r\n" % len(chunk))
+                out.append(b"connection: keep-alive\r\n\r\n" if keep_alive else b"connection: close\r\n\r\n")
+                self.writer.write(b"".join(out))
+                state["sent"] = True
+            if state["chunked"]:
+                if chunk:
+                    self.writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                if not more:
+                    self.writer.write(b"0\r\n\r\n")
+            elif chunk:
+                self.writer.write(chunk)
+            if not more:
+                state["done"] = True
+            await self.writer.drain()
+
+        try:
+            await application(scope, receive, send)
+        except ConnectionError:
+            return False  # the client went away mid-response
+        except Exception:
+            bathroom.app.logger.exception("async request failed: %s %s", method, target)
+            return await self.error(500) if not state["sent"] else False
+        return keep_alive and state["done"]
+
+    async def error(self, status):
+        text = STATUS_TEXT.get(status, "Error").encode()
+        self.writer.write(b"HTTP/1.1 %d %s\r\ncontent-type: text/plain\r\ncontent-length: %d\r\n"
+                          b"connection: close\r\n\r\n%s" % (status, text, len(text), text))
+        await self.writer.drain()
+        return False
+
+def raise_fd_limit():
+    """Every connection is a file descriptor; use as many as we're allowed."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+async def serve(host="0.0.0.0", port=bathroom.PORT, ready=None):
+    raise_fd_limit()
+    server = await asyncio.start_server(
+        lambda r, w: _Connection(r, w, port).serve(), host, port,
+        backlog=4096, limit=MAX_HEADER_BYTES)
+    print(f"async server on http://{host}:{port}/ ({ASYNC_WSGI_THREADS} threads for Flask routes)", flush=True)
+    if ready:
+        ready()
+    try:
+        # Stop cleanly on SIGTERM so atexit handlers (the counter flush) still run.
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, RuntimeError):
+        pass
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=bathroom.PORT)
+    args, _ = ap.parse_known_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+if __name__ == "__main__":
+    main()
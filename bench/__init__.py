@@ -0,0 +1 @@
+"""Benchmarks and stress tools for the bathroom dashboard. Run modules with ``python -m bench.<name>``."""
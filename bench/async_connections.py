@@ -0,0 +1,164 @@
+"""Open thousands of /api/stream connections against the async server at once.
+
+    python -m bench.async_connections --connections 5000
+
+Starts ``python app.py --async`` in a scratch directory, holds N live SSE
+streams open, then presses a counter and times how long every stream takes
+to receive the new counts. While all streams are open it also times plain
+/api/status requests. Prints JSON including the server's memory per open
+connection, and exits 1 if any stream failed to connect or missed the update.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def wait_for_port(port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server did not start on port {port}")
+
+
+async def request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode() if body is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+class Stream:
+    """One SSE client; records when it sees counters matching ``expect``."""
+
+    def __init__(self):
+        self.ready = asyncio.Event()
+        self.expect = None
+        self.seen_at = None
+        self.got = asyncio.Event()
+
+    async def run(self, port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /api/stream HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        buf = b""
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    return
+                buf += data
+                while b"\n\n" in buf:
+                    frame, buf = buf.split(b"\n\n", 1)
+                    if b"event: counters" in frame:
+                        counts = json.loads(frame.split(b"data: ", 1)[1].split(b"\r\n")[0])
+                        self.ready.set()
+                        if self.expect is not None and counts == self.expect and self.seen_at is None:
+                            self.seen_at = time.perf_counter()
+                            self.got.set()
+        finally:
+            writer.close()
+
+
+async def run(args):
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))  # one fd per stream
+    work = tempfile.mkdtemp(prefix="async-conns-")
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "app.py"), "--async", "--port", str(args.port)],
+                              cwd=work, stdout=subprocess.DEVNULL)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, wait_for_port, args.port)
+        await request(args.port, "GET", "/api/status")
+        base_rss = rss_kb(server.pid)
+
+        streams = [Stream() for _ in range(args.connections)]
+        t0 = time.perf_counter()
+        tasks = []
+        for i in range(0, len(streams), args.batch):  # don't overrun the listen backlog
+            tasks += [asyncio.ensure_future(s.run(args.port)) for s in streams[i:i + args.batch]]
+            await asyncio.sleep(0)
+            await asyncio.wait([asyncio.ensure_future(s.ready.wait()) for s in streams[i:i + args.batch]],
+                               timeout=args.timeout)
+        connected = sum(s.ready.is_set() for s in streams)
+        connect_secs = time.perf_counter() - t0
+        await asyncio.sleep(1.0)
+        open_rss = rss_kb(server.pid)
+
+        # /api/status while every stream is open
+        latencies = []
+        for _ in range(args.requests):
+            t = time.perf_counter()
+            await request(args.port, "GET", "/api/status")
+            latencies.append((time.perf_counter() - t) * 1000)
+
+        # One press, fanned out to every stream.
+        resp = await request(args.port, "GET", "/api/counters")
+        counts = json.loads(resp.split(b"\r\n\r\n", 1)[1])
+        counts["girls"] += 1
+        for s in streams:
+            s.expect = counts
+        pressed = time.perf_counter()
+        await request(args.port, "POST", "/api/counter", {"who": "girls", "delta": 1})
+        await asyncio.wait([asyncio.ensure_future(s.got.wait()) for s in streams if s.ready.is_set()],
+                           timeout=args.timeout)
+        delays = sorted((s.seen_at - pressed) * 1000 for s in streams if s.seen_at)
+
+        for t in tasks:
+            t.cancel()
+        q = lambda xs, p: round(xs[min(len(xs) - 1, int(p * len(xs)))], 1) if xs else None
+        result = {
+            "connections": args.connections,
+            "connected": connected,
+            "connect_seconds": round(connect_secs, 2),
+            "server_rss_mb": {"idle": round(base_rss / 1024, 1), "with_streams": round(open_rss / 1024, 1)},
+            "kb_per_connection": round((open_rss - base_rss) / max(connected, 1), 1),
+            "status_ms_while_open": {"p50": round(statistics.median(latencies), 2), "p99": q(sorted(latencies), 0.99)},
+            "update_fanout_ms": {"received": len(delays), "p50": q(delays, 0.5), "p99": q(delays, 0.99),
+                                 "max": q(delays, 1.0)},
+        }
+        print(json.dumps(result, indent=2))
+        return 0 if connected == args.connections and len(delays) == connected else 1
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--connections", type=int, default=2000)
+    ap.add_argument("--port", type=int, default=5077)
+    ap.add_argument("--batch", type=int, default=500, help="connections opened per step")
+    ap.add_argument("--requests", type=int, default=200, help="/api/status requests while streams are open")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    args = ap.parse_args(argv)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
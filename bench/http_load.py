@@ -0,0 +1,198 @@
+"""HTTP load test against a locally started server.
+
+    python -m bench.http_load [--workers 4] [--clients 16] [--duration 10] [--out http.json] [--compare old.json]
+
+Starts gunicorn (or ``app.py --async`` with ``--server async``) in a scratch
+directory and drives it from client threads over keep-alive connections with
+a mix of ``GET /``, ``GET /api/counters`` and ``POST /api/counter``. Reports
+p50/p95/p99 latency and throughput per endpoint, and lost counter updates:
+presses the server acknowledged but that are missing from the live counters
+or from the snapshot flushed to storage when the server shuts down.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import report  # noqa: E402
+
+ENDPOINTS = {
+    "GET /": ("GET", "/"),
+    "GET /api/counters": ("GET", "/api/counters"),
+    "POST /api/counter": ("POST", "/api/counter"),
+}
+
+
+def wait_for_port(port, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server did not start on port {port}")
+
+
+def start_server(args, work):
+    if args.server == "async":
+        cmd = [sys.executable, os.path.join(report.ROOT, "app.py"), "--async", "--port", str(args.port)]
+    else:
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "-b", f"127.0.0.1:{args.port}",
+               "--pythonpath", report.ROOT, "--log-level", "warning", "app:app"]
+    server = subprocess.Popen(cmd, cwd=work, stdout=subprocess.DEVNULL)
+    wait_for_port(args.port)
+    return server
+
+
+def get_json(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request("GET", path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+class Client(threading.Thread):
+    """One keep-alive connection issuing the weighted mix until ``stop_at``."""
+
+    def __init__(self, port, mix, stop_at, seed):
+        super().__init__(daemon=True)
+        self.port = port
+        self.mix = mix
+        self.stop_at = stop_at
+        self.rng = random.Random(seed)
+        self.latencies = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+        self.presses = 0  # acknowledged +1s
+
+    def run(self):
+        names, weights = zip(*self.mix.items())
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        while time.monotonic() < self.stop_at:
+            name = self.rng.choices(names, weights)[0]
+            method, path = ENDPOINTS[name]
+            body, headers = None, {}
+            if method == "POST":
+                body = json.dumps({"who": self.rng.choice(("girls", "boys")), "delta": 1})
+                headers = {"Content-Type": "application/json"}
+            t = time.perf_counter()
+            try:
+                conn.request(method, path, body, headers)
+                resp = conn.getresponse()
+                resp.read()
+            except (OSError, http.client.HTTPException):
+                self.errors[name] += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+                continue
+            self.latencies[name].append((time.perf_counter() - t) * 1000)
+            if resp.status >= 400:
+                self.errors[name] += 1
+            elif method == "POST":
+                self.presses += 1
+        conn.close()
+
+
+def parse_mix(text):
+    """``"/=2,/api/counters=5,/api/counter=3"`` -> weights by endpoint name."""
+    by_path = {path: name for name, (_, path) in ENDPOINTS.items()}
+    mix = {}
+    for part in text.split(","):
+        path, _, weight = part.partition("=")
+        if path not in by_path:
+            raise SystemExit(f"unknown endpoint in --mix: {path}")
+        mix[by_path[path]] = float(weight or 1)
+    return mix
+
+
+def run(args, work):
+    server = start_server(args, work)
+    try:
+        for _ in range(20):  # warm-up: imports, first timeline compile, shm open
+            get_json(args.port, "/api/counters")
+        before = get_json(args.port, "/api/counters")
+
+        stop_at = time.monotonic() + args.duration
+        clients = [Client(args.port, parse_mix(args.mix), stop_at, seed) for seed in range(args.clients)]
+        t0 = time.perf_counter()
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+        elapsed = time.perf_counter() - t0
+
+        after = get_json(args.port, "/api/counters")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    results = []
+    for name in ENDPOINTS:
+        lat = sorted(x for c in clients for x in c.latencies[name])
+        if not lat:
+            continue
+        results.append({
+            "name": name,
+            "requests": len(lat),
+            "errors": sum(c.errors[name] for c in clients),
+            "req_per_sec": round(len(lat) / elapsed, 1),
+            "p50_ms": round(report.percentile(lat, 50), 2),
+            "p95_ms": round(report.percentile(lat, 95), 2),
+            "p99_ms": round(report.percentile(lat, 99), 2),
+        })
+
+    # Counters flushed by the server on shutdown, read through the same storage it used.
+    import app
+    flushed = app.current_tenant().storage.load_counters()
+    presses = sum(c.presses for c in clients)
+    live = (after["girls"] + after["boys"]) - (before["girls"] + before["boys"])
+    total = sum(r["requests"] for r in results)
+    results.append({
+        "name": "total",
+        "requests": total,
+        "errors": sum(r["errors"] for r in results),
+        "req_per_sec": round(total / elapsed, 1),
+        "presses": presses,
+        "counters": after,
+        "flushed": flushed,
+        "lost_updates": (presses - live) + (0 if flushed == after else 1),
+    })
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--server", choices=("gunicorn", "async"), default="gunicorn")
+    ap.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    ap.add_argument("--clients", type=int, default=16, help="concurrent client connections")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    ap.add_argument("--port", type=int, default=5078)
+    ap.add_argument("--mix", default="/=1,/api/counters=6,/api/counter=3", help="endpoint weights")
+    report.add_arguments(ap)
+    args = ap.parse_args(argv)
+    if args.out:
+        args.out = os.path.abspath(args.out)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    work = tempfile.mkdtemp(prefix="http-load-")
+    os.chdir(work)
+    results = run(args, work)
+    status = report.finish("http", results, args)
+    total = results[-1]
+    return 1 if total["lost_updates"] or total["errors"] else status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
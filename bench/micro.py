@@ -0,0 +1,126 @@
+"""Micro-benchmarks for the schedule and storage hot paths.
+
+    python -m bench.micro [--sizes 10,100,1000,10000] [--out micro.json] [--compare old.json]
+
+Times parse_hhmm, today_schedule, compute_open_windows_for_today,
+current_status, load_schedules and load_counters on the built-in schedule
+("realistic", 8-9 blocks a day) and on synthetic days of N blocks, plus the
+what-if simulator on a 300-variant, 180-day term. The
+status functions are timed twice: "compile" passes the schedule explicitly
+(a full timeline compile per call), "cached" goes through the tenant's
+compiled-timeline cache like a request does. Storage is timed for both
+backends. Runs in a scratch directory, so real data files are never touched.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import report  # noqa: E402
+
+MIN_TIME = 0.2   # seconds each measurement runs for (at least one call)
+REPEATS = 3      # best of
+
+
+def bench(fn, min_time=MIN_TIME, repeats=REPEATS):
+    """Best ns per call of ``fn()`` over runs of at least ``min_time`` seconds."""
+    n = 1
+    while True:
+        t = time.perf_counter()
+        for _ in range(n):
+            fn()
+        dt = time.perf_counter() - t
+        if dt >= min_time:
+            break
+        n = max(n * 2, int(n * min_time / max(dt, 1e-9) * 1.1))
+    best = dt / n
+    for _ in range(repeats - 1):
+        t = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, (time.perf_counter() - t) / n)
+    return best * 1e9
+
+
+def synthetic_day(n):
+    """``n`` blocks spread over the school day, overlapping once n is large."""
+    blocks = []
+    for i in range(n):
+        start = 7 * 60 + (i * 7919) % (9 * 60)
+        length = 5 + (i * 31) % 50
+        end = min(start + length, 23 * 60 + 59)
+        blocks.append({"label": f"Block {i}", "is_class": i % 3 != 2,
+                       "start": f"{start // 60:02d}:{start % 60:02d}", "end": f"{end // 60:02d}:{end % 60:02d}"})
+    return sorted(blocks, key=lambda b: b["start"])
+
+
+def run(sizes):
+    import app
+    results = []
+
+    def record(name, size, fn):
+        ns = bench(fn)
+        results.append({"name": f"{name}[{size}]", "function": name, "size": size,
+                        "ns_per_op": round(ns, 1), "ops_per_sec": round(1e9 / ns, 1)})
+        print(f"{name:<40} {size!s:>9} {ns / 1000:>12.2f} us", file=sys.stderr)
+
+    record("parse_hhmm", 1, lambda: app.parse_hhmm("13:05"))
+
+    monday = date(2025, 9, 8)  # a Monday during term
+    now = datetime(2025, 9, 8, 11, 17, tzinfo=app.TZ)
+    cases = [("realistic", app.DEFAULT_SCHEDULES)]
+    cases += [(n, {"monday": synthetic_day(n), "tue-fri": synthetic_day(n)}) for n in sizes]
+
+    tenant = app.current_tenant()
+    sqlite_tenant = app.Tenant("bench-sqlite", {"storage": "sqlite", "dir": "sqlite"})
+    for size, schedules in cases:
+        record("today_schedule", size, lambda: app.today_schedule(monday, schedules, tenant))
+        record("compute_open_windows_for_today/compile", size,
+               lambda: app.compute_open_windows_for_today(now, schedules))
+        record("current_status/compile", size, lambda: app.current_status(now, schedules))
+
+        app.save_schedules(schedules, tenant)
+        app.current_status(now)  # warm the cache
+        record("compute_open_windows_for_today/cached", size, lambda: app.compute_open_windows_for_today(now))
+        record("current_status/cached", size, lambda: app.current_status(now))
+
+        record("load_schedules/json", size, lambda: app.load_schedules(tenant))
+        app.save_schedules(schedules, sqlite_tenant)
+        record("load_schedules/sqlite", size, lambda: app.load_schedules(sqlite_tenant))
+
+    tenant.storage.save_counters({"girls": 12, "boys": 7})
+    sqlite_tenant.storage.save_counters({"girls": 12, "boys": 7})
+    record("load_counters/json", 1, lambda: app.load_counters(tenant.storage.counters_path))
+    record("load_counters/sqlite", 1, sqlite_tenant.storage.load_counters)
+    record("counters.snapshot/shm", 1, tenant.counters.snapshot)
+
+    # What-if simulator: 300 rule variants over a 180-day term, cold cache each call.
+    app.save_schedules(app.DEFAULT_SCHEDULES, tenant)
+    _, schedules = tenant.get_schedules()
+    variants = [app.parse_variant({"closed_min": i % 31, "period_closed_min": {"Lunch": i % 7}}, i, tenant, schedules)
+                for i in range(300)]
+    record("simulate/300x180d", 300, lambda: app.simulate(tenant, variants, monday, monday + timedelta(days=179)))
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", default="10,100,1000,10000", help="synthetic blocks per day")
+    report.add_arguments(ap)
+    args = ap.parse_args(argv)
+    if args.out:
+        args.out = os.path.abspath(args.out)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    os.chdir(tempfile.mkdtemp(prefix="bench-micro-"))
+    results = run([int(s) for s in args.sizes.split(",") if s])
+    return report.finish("micro", results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Shared plumbing for benchmark results: run metadata, JSON output, comparisons.
+
+Every suite writes one JSON document::
+
+    {"suite": "micro", "meta": {...}, "results": [{"name": ..., <metric>: ...}, ...]}
+
+``compare()`` matches results by name against an earlier run and reports
+every metric that got worse by more than the tolerance.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# metric -> True if bigger is better
+METRICS = {
+    "ns_per_op": False,
+    "req_per_sec": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "lost_updates": False,
+    "import_ms": False,
+    "ttfb_ms": False,
+}
+
+
+def meta():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def write(suite, results, path=None):
+    doc = {"suite": suite, "meta": meta(), "results": results}
+    text = json.dumps(doc, indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return doc
+
+
+def compare(doc, baseline_path, tolerance):
+    """Print regressions against ``baseline_path``; returns how many there were."""
+    with open(baseline_path, encoding="utf-8") as f:
+        base = {r["name"]: r for r in json.load(f)["results"]}
+    regressions = 0
+    for r in doc["results"]:
+        old = base.get(r["name"])
+        if not old:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if r.get(metric) is None or old.get(metric) is None:
+                continue
+            new, was = r[metric], old[metric]
+            if metric == "lost_updates":
+                worse = new > was
+            elif higher_is_better:
+                worse = new < was * (1 - tolerance)
+            else:
+                worse = new > was * (1 + tolerance) and new - was > 1e-9
+            if worse:
+                regressions += 1
+                print(f"REGRESSION {r['name']}: {metric} {was} -> {new}", file=sys.stderr)
+    return regressions
+
+
+def add_arguments(ap):
+    ap.add_argument("--out", help="also write the JSON results to this file")
+    ap.add_argument("--compare", metavar="BASELINE.json", help="fail if worse than an earlier run")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown for --compare (0.25 = 25%%)")
+
+
+def finish(suite, results, args):
+    doc = write(suite, results, args.out)
+    if args.compare and compare(doc, args.compare, args.tolerance):
+        return 1
+    return 0
@@ -0,0 +1,126 @@
+"""Cold-start benchmark: import time and time to first byte of ``/``.
+
+    python -m bench.startup [--runs 5] [--out startup.json] [--compare old.json]
+
+Each run starts a fresh interpreter in a scratch data directory, the way a
+kiosk boots. "import" times ``import flask`` (the floor no change here can
+lower) and ``import app``. "ttfb" times from spawning the server until the
+first byte of a ``GET /`` response arrives, for ``python app.py`` (the
+source is compiled on every start) and ``python -m app`` (the compiled module
+is reused), each "cold" (no warm/ snapshot) and "warm" (the snapshot left by
+the previous start). The median of the runs is reported. Byte-code caching is
+left on for the child processes even if PYTHONDONTWRITEBYTECODE is set here.
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import report  # noqa: E402
+
+IMPORT_SNIPPET = """
+import sys, time
+t = time.perf_counter()
+import flask
+t1 = time.perf_counter()
+sys.path.insert(0, %r)
+import app
+t2 = time.perf_counter()
+print((t1 - t) * 1000, (t2 - t1) * 1000)
+"""
+
+
+def child_env(port):
+    env = dict(os.environ, PORT=str(port), PYTHONPATH=report.ROOT)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def time_import(work):
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET % report.ROOT], cwd=work, env=child_env(0),
+                         capture_output=True, text=True, check=True).stdout.split()
+    return float(out[0]), float(out[1])
+
+
+def first_byte(port, deadline):
+    """Connect as soon as the port accepts, send GET / and wait for a byte."""
+    while time.monotonic() < deadline:
+        try:
+            sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+        except OSError:
+            time.sleep(0.002)
+            continue
+        with sock:
+            sock.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+            if sock.recv(1):
+                return
+    raise RuntimeError(f"no response on port {port}")
+
+
+def time_ttfb(cmd, work, port, timeout=30.0):
+    t = time.perf_counter()
+    server = subprocess.Popen(cmd, cwd=work, env=child_env(port),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_byte(port, time.monotonic() + timeout)
+        return (time.perf_counter() - t) * 1000
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def run(args):
+    work = tempfile.mkdtemp(prefix="bench-startup-")
+    os.symlink(os.path.join(report.ROOT, "static"), os.path.join(work, "static"))
+    subprocess.run([sys.executable, "-m", "compileall", "-q", os.path.join(report.ROOT, "app.py")], check=True)
+    time_import(work)  # first boot: writes schedules.json and friends
+
+    results = []
+
+    def record(name, samples, metric):
+        results.append({"name": name, "runs": len(samples), metric: round(statistics.median(samples), 1),
+                        "min_ms": round(min(samples), 1), "max_ms": round(max(samples), 1)})
+        print(f"{name:<24} {statistics.median(samples):>8.1f} ms", file=sys.stderr)
+
+    imports = [time_import(work) for _ in range(args.runs)]
+    record("import/flask", [f for f, _ in imports], "import_ms")
+    record("import/app", [a for _, a in imports], "import_ms")
+
+    modes = {
+        "script": [sys.executable, os.path.join(report.ROOT, "app.py")],
+        "module": [sys.executable, "-m", "app"],
+    }
+    for mode, cmd in modes.items():
+        for state in ("cold", "warm"):
+            samples = []
+            for _ in range(args.runs):
+                if state == "cold":
+                    shutil.rmtree(os.path.join(work, "warm"), ignore_errors=True)
+                samples.append(time_ttfb(cmd, work, args.port))
+                time.sleep(0.2)  # let the port go
+            record(f"ttfb/{mode}/{state}", samples, "ttfb_ms")
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--runs", type=int, default=5, help="starts per case (median is reported)")
+    ap.add_argument("--port", type=int, default=5079)
+    report.add_arguments(ap)
+    args = ap.parse_args(argv)
+    if args.out:
+        args.out = os.path.abspath(args.out)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+    return report.finish("startup", run(args), args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
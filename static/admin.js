@@ -0,0 +1,127 @@
+// Inline schedule editing for /admin/schedule. Each change is sent on its own
+// through /api/schedule with the day's ETag in If-Match, so editing one start
+// time neither rewrites the rest of the schedule nor clobbers someone else's
+// edit of the same day (the server answers 412 with the latest rows).
+// Without JavaScript the page stays a plain form.
+document.addEventListener("DOMContentLoaded", () => {
+  const API = document.body.dataset.scheduleApi;
+  if (!API || !window.fetch) return;
+  const saveAll = document.querySelector("[data-save-all]");
+  if (saveAll) saveAll.hidden = true;
+
+  function say(day, text, isErr){
+    const el = document.querySelector(`[data-status="${day}"]`);
+    el.textContent = text ? " " + text : "";
+    el.className = "edit-status" + (isErr ? " err" : "");
+  }
+
+  function cell(child){
+    const td = document.createElement("td");
+    td.appendChild(child);
+    return td;
+  }
+  function input(day, field, i, value, placeholder){
+    const el = document.createElement("input");
+    el.type = "text";
+    el.name = `${day}__${field}__${i}`;
+    el.dataset.field = field;
+    el.value = value;
+    el.placeholder = placeholder;
+    return el;
+  }
+  function classSelect(day, i, value){
+    const el = document.createElement("select");
+    el.name = `${day}__is_class__${i}`;
+    el.dataset.field = "is_class";
+    for (const [v, text] of [["1", "Yes"], ["0", "No"]]) {
+      const o = document.createElement("option");
+      o.value = v;
+      o.textContent = text;
+      o.selected = String(value) === v;
+      el.appendChild(o);
+    }
+    return el;
+  }
+
+  // Redraw a day from the server's rows (they come back sorted by start).
+  function render(table, data){
+    const day = table.dataset.day;
+    table.dataset.etag = data.etag;
+    const body = table.tBodies[0];
+    body.textContent = "";
+    data.rows.forEach((r, i) => {
+      const tr = document.createElement("tr");
+      tr.dataset.id = r.id;
+      const del = document.createElement("button");
+      del.className = "warn";
+      del.name = "delete";
+      del.value = `${day}__${i}`;
+      del.textContent = "Delete";
+      const actions = cell(del);
+      actions.className = "row-actions";
+      tr.append(cell(input(day, "label", i, r.label, "")), cell(classSelect(day, i, r.is_class)),
+                cell(input(day, "start", i, r.start, "08:10")), cell(input(day, "end", i, r.end, "08:48")), actions);
+      body.appendChild(tr);
+    });
+  }
+
+  async function send(table, method, path, payload){
+    const day = table.dataset.day;
+    say(day, "Saving…");
+    let res, data;
+    try {
+      res = await fetch(`${API}/${encodeURIComponent(day)}${path}`, {
+        method,
+        headers: {"Content-Type": "application/json", "If-Match": `"${table.dataset.etag}"`},
+        body: payload ? JSON.stringify(payload) : undefined,
+        credentials: "same-origin",
+      });
+      data = await res.json();
+    } catch (e) {
+      say(day, "Couldn't reach the server; nothing was saved.", true);
+      return false;
+    }
+    if (res.ok) {
+      render(table, data);
+      say(day, "Saved");
+      return true;
+    }
+    if (res.status === 401) { location.reload(); return false; }
+    if (res.status === 412) {
+      render(table, data);
+      say(day, "Someone else changed this day; showing their version. Please redo your edit.", true);
+    } else {
+      say(day, (data.errors || [data.error]).join("; "), true);
+    }
+    return false;
+  }
+
+  for (const table of document.querySelectorAll("table[data-day]")) {
+    // Existing rows: save a field as soon as it changes.
+    table.tBodies[0].addEventListener("change", async (ev) => {
+      const el = ev.target, tr = el.closest("tr[data-id]");
+      if (!tr || !el.dataset.field) return;
+      const ok = await send(table, "PATCH", "/" + encodeURIComponent(tr.dataset.id), {[el.dataset.field]: el.value});
+      if (!ok) el.classList.add("invalid");
+    });
+    table.addEventListener("click", async (ev) => {
+      const btn = ev.target.closest("button");
+      if (!btn) return;
+      ev.preventDefault();
+      if (btn.name === "delete") {
+        const tr = btn.closest("tr[data-id]");
+        await send(table, "DELETE", "/" + encodeURIComponent(tr.dataset.id));
+      } else if (btn.name === "add") {
+        const fields = {};
+        table.tFoot.querySelectorAll("[data-field]").forEach(el => { fields[el.dataset.field] = el.value.trim(); });
+        if (!fields.label || !fields.start || !fields.end) {
+          say(table.dataset.day, "Fill in label, start and end first.", true);
+          return;
+        }
+        if (await send(table, "POST", "", fields)) {
+          table.tFoot.querySelectorAll("input[data-field]").forEach(el => { el.value = ""; });
+        }
+      }
+    });
+  }
+});
@@ -0,0 +1,313 @@
+// The kiosk evaluates status itself from the day's compiled timeline
+// (/api/today, re-fetched only when the date or schedule version changes, and
+// kept in localStorage so a sleeping server doesn't blank the display).
+// Counters and schedule edits are pushed over /api/stream (SSE); without
+// EventSource, or when the server can't hold streams open (204), we poll
+// instead. ?reload=1 keeps the old 30s full-page reload.
+// Per-page settings (timezone, tenant-prefixed URLs) come from <body data-*>.
+// With occupancy tracking on (data-occupancy-url) the buttons and arrow keys
+// record enter/exit instead of +1/-1, and each bathroom shows OPEN, CLOSED or
+// FULL from the local timeline plus the occupancy pushed by the server.
+const RELOAD = new URLSearchParams(location.search).has("reload");
+const LIVE = !RELOAD && !!window.EventSource;
+if (RELOAD) setInterval(()=>{ location.reload(); }, 30000);
+
+// Live counters handler
+document.addEventListener("DOMContentLoaded", () => {
+  const CFG = document.body.dataset;
+  const TZ = CFG.tz;
+  const TODAY_URL = CFG.todayUrl;
+  const girlsEl = document.getElementById("girlsCount");
+  const boysEl = document.getElementById("boysCount");
+  const totalEl = document.getElementById("totalCount");
+
+  // `server` holds the last counts from the server; the display adds presses
+  // still waiting in `queue` (see bump() below).
+  let server = null, queue = [];
+  function updateCountsUI(g, b){
+    server = {girls: g, boys: b};
+    showCounts();
+  }
+
+  // Occupancy: last snapshot from the server, shown against the schedule's
+  // current status (`segStatus`, kept up to date by tick()).
+  const OCCUPANCY_URL = CFG.occupancyUrl;
+  let occupancy = null, segStatus = null;
+  function renderRooms(){
+    if (!occupancy) return;
+    for (const el of document.querySelectorAll(".room")) {
+      const o = occupancy[el.dataset.room];
+      const base = segStatus || occupancy.bathrooms[el.dataset.room];
+      const state = base === "OPEN" && o.full ? "FULL" : base;
+      el.className = "room " + state.toLowerCase();
+      el.querySelector(".room-state").textContent = state;
+      el.querySelector(".room-occ").textContent = o.occupancy + (o.capacity ? " / " + o.capacity : "") + " out";
+      el.querySelector(".room-stats").textContent = o.recent_visits + " in the last " + occupancy.window_min + " min" +
+        (o.avg_minutes === null ? "" : " · avg " + o.avg_minutes + " min");
+    }
+  }
+  function updateOccupancy(o){
+    occupancy = {...occupancy, ...o};
+    renderRooms();
+  }
+  function fetchOccupancy(){
+    fetch(OCCUPANCY_URL).then(r => r.json()).then(updateOccupancy).catch(()=>{});
+  }
+  if (OCCUPANCY_URL) {
+    fetchOccupancy();
+    if (RELOAD) setInterval(fetchOccupancy, 30000);
+  }
+
+  // The clock always ticks locally; the server only renders the date.
+  const clockEl = document.getElementById("clock");
+  const dayFmt = new Intl.DateTimeFormat("en-US", {timeZone: TZ, weekday: "long", month: "long", day: "numeric"});
+  const timeFmt = new Intl.DateTimeFormat("en-US", {timeZone: TZ, hour: "numeric", minute: "2-digit"});
+  function tickClock(){
+    const d = new Date();
+    clockEl.textContent = dayFmt.format(d) + " • " + timeFmt.format(d);
+  }
+  tickClock();
+  setInterval(tickClock, 1000);
+
+  if (!RELOAD) {
+    const statusEl = document.getElementById("status");
+    const reasonEl = document.getElementById("reason");
+    const nextEl = document.getElementById("next");
+    const openEl = document.getElementById("openBlocks");
+    const wdFmt = new Intl.DateTimeFormat("en-US", {timeZone: TZ, weekday: "long"});
+    const farFmt = new Intl.DateTimeFormat("en-US", {timeZone: TZ, weekday: "short", month: "short", day: "numeric"});
+    const ymdFmt = new Intl.DateTimeFormat("en-CA", {timeZone: TZ, year: "numeric", month: "2-digit", day: "2-digit"});
+    const ymd = (ms) => ymdFmt.format(new Date(ms));
+    const dayNo = (key) => { const [y, m, d] = key.split("-").map(Number); return Date.UTC(y, m - 1, d) / 864e5; };
+
+    const CACHE_KEY = "bathroom-timeline:" + TODAY_URL;
+    let tl = null, etag = null, lastFetch = 0, shown = null, shownOpen = null;
+    try { const c = JSON.parse(localStorage.getItem(CACHE_KEY)); if (c) { tl = c.tl; etag = c.etag; } } catch (e) {}
+
+    async function fetchTimeline(){
+      lastFetch = Date.now();
+      try {
+        const r = await fetch(TODAY_URL, {cache: "no-store", headers: etag ? {"If-None-Match": etag} : {}});
+        if (r.status === 304 || !r.ok) return;
+        tl = await r.json();
+        etag = r.headers.get("ETag");
+        try { localStorage.setItem(CACHE_KEY, JSON.stringify({tl, etag})); } catch (e) {}
+        tick();
+      } catch (e) { /* server unreachable: keep evaluating the cached timeline */ }
+    }
+
+    // Same wording as fmt_next_change() on the server.
+    function fmtNext(ms, nowMs){
+      if (ms === null) return "";
+      const days = dayNo(ymd(ms)) - dayNo(ymd(nowMs));
+      const t = timeFmt.format(new Date(ms));
+      if (days === 0) return t;
+      if (days === 1) return "tomorrow " + t;
+      if (days < 7) return wdFmt.format(new Date(ms)) + " " + t;
+      return farFmt.format(new Date(ms)) + ", " + t;
+    }
+
+    function segmentAt(nowMs){
+      // segments: [start_ms, status, reason, next_change_ms|null], sorted by start
+      const segs = tl.segments;
+      let lo = 0, hi = segs.length - 1, found = -1;
+      while (lo <= hi) {
+        const mid = (lo + hi) >> 1;
+        if (segs[mid][0] <= nowMs) { found = mid; lo = mid + 1; } else { hi = mid - 1; }
+      }
+      return found < 0 ? null : segs[found];
+    }
+
+    function renderOpen(today){
+      const rows = tl.open.filter(o => ymd(o[0]) === today);
+      const key = today + "|" + tl.version;
+      if (key === shownOpen) return;
+      shownOpen = key;
+      while (openEl.rows.length > 1) openEl.deleteRow(1);
+      for (const [s, e, label] of rows) {
+        const tr = openEl.insertRow();
+        tr.insertCell().textContent = timeFmt.format(new Date(s));
+        tr.insertCell().textContent = timeFmt.format(new Date(e));
+        const pill = document.createElement("span");
+        pill.className = "pill";
+        pill.textContent = label;
+        tr.insertCell().appendChild(pill);
+      }
+    }
+
+    function tick(){
+      const nowMs = Date.now();
+      const today = ymd(nowMs);
+      const stale = !tl || tl.date !== today || nowMs >= tl.valid_until;
+      if (stale && Date.now() - lastFetch > 15000) fetchTimeline();
+      if (!tl || nowMs < tl.segments[0][0] || nowMs >= tl.valid_until) return;
+      const seg = segmentAt(nowMs);
+      if (seg[1] !== segStatus) { segStatus = seg[1]; renderRooms(); }
+      const next = fmtNext(seg[3], nowMs);
+      const key = seg[1] + "|" + seg[2] + "|" + next;
+      if (key !== shown) {
+        shown = key;
+        statusEl.textContent = seg[1];
+        statusEl.className = "status " + seg[1].toLowerCase();
+        reasonEl.textContent = seg[2];
+        nextEl.textContent = next ? "Next change: " + next : "";
+      }
+      renderOpen(today);
+    }
+    if (tl) tick();
+    fetchTimeline();
+    setInterval(tick, 1000);
+
+    // No push channel: cheap conditional polls instead.
+    function startPolling(){
+      setInterval(fetchTimeline, 60000);
+      setInterval(()=>{
+        fetch(CFG.countersUrl).then(r => r.json())
+          .then(c => updateCountsUI(c.girls, c.boys)).catch(()=>{});
+      }, 30000);
+      if (OCCUPANCY_URL) setInterval(fetchOccupancy, 30000);
+    }
+    if (LIVE) {
+      const es = new EventSource(CFG.streamUrl);
+      es.addEventListener("open", () => scheduleFlush(0));  // back online: replay queue
+      // CLOSED (not reconnecting) means the server declined, e.g. a sync worker.
+      es.addEventListener("error", () => { if (es.readyState === EventSource.CLOSED) startPolling(); });
+      es.addEventListener("status", (ev) => {
+        const s = JSON.parse(ev.data);
+        if (!tl || s.version !== tl.version || s.date !== tl.date) fetchTimeline();
+      });
+      es.addEventListener("counters", (ev) => {
+        const c = JSON.parse(ev.data);
+        updateCountsUI(c.girls, c.boys);
+      });
+      es.addEventListener("occupancy", (ev) => updateOccupancy(JSON.parse(ev.data)));
+    } else {
+      startPolling();
+    }
+  }
+
+  // Update from server on load (in case template was cached)
+  fetch(CFG.countersUrl)
+    .then(r => r.json())
+    .then(d => { updateCountsUI(d.girls, d.boys); })
+    .catch(()=>{});
+
+  // Presses go into a local queue (kept in localStorage) and are sent in
+  // batches every few hundred ms. Each op has an id, so the server applies it
+  // once even if a request is retried; failed sends are replayed with backoff.
+  const QUEUE_KEY = "bathroom-ops:" + CFG.batchUrl;
+  const FLUSH_MS = 300;
+  const idPrefix = Date.now().toString(36) + Math.random().toString(36).slice(2, 8);
+  let opSeq = 0, inflight = false, flushTimer = null, retryMs = 1000;
+  try { queue = JSON.parse(localStorage.getItem(QUEUE_KEY)) || []; } catch (e) {}
+
+  function saveQueue(){
+    try { localStorage.setItem(QUEUE_KEY, JSON.stringify(queue)); } catch (e) {}
+  }
+
+  // What the kiosk shows: last server counts plus presses not yet confirmed.
+  function showCounts(){
+    if (!server) return;
+    const shown = {girls: server.girls, boys: server.boys};
+    for (const op of queue) shown[op.who] = Math.max(0, shown[op.who] + op.delta);
+    girlsEl.textContent = shown.girls;
+    boysEl.textContent = shown.boys;
+    totalEl.textContent = shown.girls + shown.boys;
+  }
+  function scheduleFlush(ms){
+    if (flushTimer === null) flushTimer = setTimeout(flush, ms);
+  }
+
+  async function flush(){
+    flushTimer = null;
+    if (inflight || !queue.length) return;
+    inflight = true;
+    const ops = queue.slice(0, 200);
+    try {
+      const r = await fetch(CFG.batchUrl, {
+        method: "POST",
+        headers: {"Content-Type": "application/json"},
+        body: JSON.stringify({ops})
+      });
+      if (r.status >= 500) throw new Error("server error " + r.status);
+      const sent = new Set(ops.map(op => op.id));
+      queue = queue.filter(op => !sent.has(op.id));  // 4xx ops are dropped, not retried
+      saveQueue();
+      if (r.ok) {
+        const data = await r.json();
+        server = {girls: data.girls, boys: data.boys};
+      }
+      retryMs = 1000;
+      showCounts();
+      if (queue.length) scheduleFlush(0);
+    } catch (e) {
+      retryMs = Math.min(retryMs * 2, 30000);
+      scheduleFlush(retryMs);
+    } finally {
+      inflight = false;
+    }
+  }
+
+  function bump(who, delta){
+    queue.push({id: idPrefix + "-" + (opSeq++), who, delta, client_ts: Date.now()});
+    saveQueue();
+    showCounts();
+    scheduleFlush(FLUSH_MS);
+  }
+
+  // Enter/exit events are sent straight away (the order matters for the
+  // occupancy); a failed send is retried with the same id, so it counts once.
+  async function occupancyEvent(who, event){
+    const body = JSON.stringify({id: idPrefix + "-" + (opSeq++), who, event});
+    for (let ms = 1000; ; ms = Math.min(ms * 2, 30000)) {
+      try {
+        const r = await fetch(OCCUPANCY_URL, {method: "POST", headers: {"Content-Type": "application/json"}, body});
+        if (r.status < 500) {
+          if (r.ok) {
+            const data = await r.json();
+            updateCountsUI(data.counters.girls, data.counters.boys);
+            updateOccupancy(data);
+          }
+          return;
+        }
+      } catch (e) { /* offline: retry below */ }
+      await new Promise(res => setTimeout(res, ms));
+    }
+  }
+
+  function press(who, delta){
+    if (OCCUPANCY_URL) occupancyEvent(who, delta > 0 ? "enter" : "exit");
+    else bump(who, delta);
+  }
+
+  window.addEventListener("online", () => scheduleFlush(0));
+  if (queue.length) scheduleFlush(0);  // replay anything left from before a reload
+
+  // Ignore key presses when typing in inputs/textareas (admin or other pages)
+  function isTypingInField(ev){
+    const t = ev.target;
+    const tag = (t.tagName || "").toLowerCase();
+    return (tag === "input" || tag === "textarea" || t.isContentEditable);
+  }
+
+  window.addEventListener("keydown", (ev) => {
+    if (isTypingInField(ev)) return;
+
+    // Left/Right arrow to increment; Shift+arrow to decrement
+    if (ev.key === "ArrowLeft") {
+      ev.preventDefault();
+      const delta = ev.shiftKey ? -1 : 1;
+      press("girls", delta);
+    } else if (ev.key === "ArrowRight") {
+      ev.preventDefault();
+      const delta = ev.shiftKey ? -1 : 1;
+      press("boys", delta);
+    }
+  });
+
+  // Optional: Clickable fallback buttons (if you want to tap on touchscreen)
+  document.getElementById("girlsPlus").addEventListener("click", ()=>press("girls", +1));
+  document.getElementById("girlsMinus").addEventListener("click", ()=>press("girls", -1));
+  document.getElementById("boysPlus").addEventListener("click", ()=>press("boys", +1));
+  document.getElementById("boysMinus").addEventListener("click", ()=>press("boys", -1));
+});
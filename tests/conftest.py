@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    # app.py keeps its files relative to the working directory and builds the
+    # default tenant on import, so import it from an empty directory.
+    os.chdir(tmp_path_factory.mktemp("work"))
+    import app
+    return app
+
+
+@pytest.fixture
+def tenant(app_module, tmp_path):
+    """A tenant of its own whose files live in ``tmp_path``."""
+    t = app_module.Tenant("test", {"dir": str(tmp_path), "peers": "http://127.0.0.1:9"})
+    yield t
+    t.close()
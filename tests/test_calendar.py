@@ -0,0 +1,76 @@
+import json
+from datetime import date
+
+import pytest
+
+
+@pytest.fixture
+def calendar(app_module):
+    return lambda data: app_module.Calendar(app_module.WEEKDAY_TO_KEY, data)
+
+
+def test_weekdays_without_calendar(calendar):
+    cal = calendar(None)
+    assert cal.resolve(date(2025, 11, 3)) == ("monday", None)
+    assert cal.resolve(date(2025, 11, 4)) == ("tue-fri", None)
+    assert cal.resolve(date(2025, 11, 8)) == (None, None)
+
+
+def test_range_override_skips_weekends(calendar):
+    cal = calendar({"overrides": {"2026-05-08..2026-05-18": "testing"}})
+    assert cal.resolve(date(2026, 5, 8)) == ("testing", None)    # Friday
+    assert cal.resolve(date(2026, 5, 9)) == (None, None)         # Saturday
+    assert cal.resolve(date(2026, 5, 10)) == (None, None)        # Sunday
+    assert cal.resolve(date(2026, 5, 18)) == ("testing", None)   # Monday
+    assert cal.resolve(date(2026, 5, 19)) == ("tue-fri", None)
+
+
+def test_single_date_override_applies_on_weekend(calendar):
+    cal = calendar({"overrides": {"2026-05-09": "saturday-school"}})
+    assert cal.resolve(date(2026, 5, 9)) == ("saturday-school", None)
+    assert cal.templates == ["saturday-school"]
+
+
+def test_single_date_beats_range(calendar):
+    cal = calendar({"overrides": {"2026-05-11": "minimum", "2026-05-04..2026-05-15": "testing"}})
+    assert cal.resolve(date(2026, 5, 11)) == ("minimum", None)
+    assert cal.resolve(date(2026, 5, 12)) == ("testing", None)
+
+
+def test_later_range_beats_earlier(calendar):
+    cal = calendar({"overrides": {"2026-05-11..2026-05-15": "late", "2026-05-04..2026-05-12": "early"}})
+    assert cal.resolve(date(2026, 5, 8)) == ("early", None)
+    assert cal.resolve(date(2026, 5, 11)) == ("late", None)
+    assert cal.resolve(date(2026, 5, 12)) == ("late", None)
+
+
+def test_holiday_beats_override_of_same_kind(calendar):
+    cal = calendar({
+        "overrides": {"2025-11-11": "minimum", "2025-12-15..2025-12-31": "finals"},
+        "holidays": {"2025-11-11": "Veterans Day", "2025-12-22..2026-01-02": "Winter Break"},
+    })
+    assert cal.resolve(date(2025, 11, 11)) == (None, "Veterans Day")
+    assert cal.resolve(date(2025, 12, 19)) == ("finals", None)
+    assert cal.resolve(date(2025, 12, 22)) == (None, "Winter Break")
+    assert cal.resolve(date(2025, 12, 27)) == (None, "Winter Break")  # holidays cover weekends
+
+
+def test_single_override_beats_holiday_range(calendar):
+    cal = calendar({"overrides": {"2025-12-23": "minimum"},
+                    "holidays": {"2025-12-22..2026-01-02": "Winter Break"}})
+    assert cal.resolve(date(2025, 12, 23)) == ("minimum", None)
+
+
+@pytest.mark.parametrize("spec", ["2026-05-15..2026-05-01", "2025-01-01..2026-12-31", "May 1"])
+def test_bad_date_spec(calendar, spec):
+    with pytest.raises(ValueError):
+        calendar({"holidays": {spec: "x"}})
+
+
+def test_holiday_in_timeline(app_module, tenant):
+    with open(tenant.calendar_path, "w", encoding="utf-8") as f:
+        json.dump({"holidays": {"2025-11-11": "Veterans Day"}}, f)
+    tl = tenant.get_timeline(date(2025, 11, 11))
+    status, reason, nxt = tl.segments[0]
+    assert (status, reason) == ("OUTSIDE", "No school today – Veterans Day")
+    assert nxt == app_module.as_dt(date(2025, 11, 12), app_module.parse_hhmm("08:10"), tenant.tz)
@@ -0,0 +1,58 @@
+import pytest
+
+BASE = {"id": "r1", "label": "Period 2", "is_class": 1, "start": "08:10", "end": "08:48"}
+
+
+def status_of(app_module, fn, *args):
+    with pytest.raises(app_module.ScheduleEditError) as e:
+        fn(*args)
+    return e.value.status
+
+
+def test_replace_and_add(app_module):
+    ops = [{"op": "replace", "path": "/start", "value": "08:15"},
+           {"op": "add", "path": "/label", "value": "Advisory"}]
+    assert app_module.apply_block_patch(ops, BASE) == {"start": "08:15", "label": "Advisory"}
+
+
+def test_test_op_passes(app_module):
+    ops = [{"op": "test", "path": "/is_class", "value": True},
+           {"op": "test", "path": "/start", "value": "08:10"},
+           {"op": "replace", "path": "/end", "value": "08:50"}]
+    assert app_module.apply_block_patch(ops, BASE) == {"end": "08:50"}
+
+
+def test_test_op_sees_earlier_ops(app_module):
+    ops = [{"op": "replace", "path": "/start", "value": "08:15"},
+           {"op": "test", "path": "/start", "value": "08:15"}]
+    assert app_module.apply_block_patch(ops, BASE) == {"start": "08:15"}
+
+
+@pytest.mark.parametrize("ops, status", [
+    ([{"op": "test", "path": "/start", "value": "08:00"}, {"op": "replace", "path": "/start", "value": "09:00"}], 409),
+    ([{"op": "test", "path": "/room", "value": "12"}], 409),
+    ([{"op": "remove", "path": "/label"}], 422),
+    ([{"op": "move", "from": "/start", "path": "/end"}], 422),
+    ([{"op": "replace", "path": "/start"}], 400),
+    ([{"path": "/start", "value": "08:00"}], 400),
+    (["replace"], 400),
+    ([], 400),
+    ({"op": "replace", "path": "/start", "value": "08:00"}, 400),
+])
+def test_rejected(app_module, ops, status):
+    assert status_of(app_module, app_module.apply_block_patch, ops, BASE) == status
+
+
+def test_block_from_patch_is_validated(app_module):
+    block = app_module.block_from_json([{"op": "replace", "path": "/end", "value": "9:05"}], BASE)
+    assert block == {"label": "Period 2", "is_class": 1, "start": "08:10", "end": "09:05"}
+    bad = [{"op": "replace", "path": "/end", "value": "08:00"}]
+    assert status_of(app_module, app_module.block_from_json, bad, BASE) == 422
+    unknown = [{"op": "add", "path": "/room", "value": "12"}]
+    assert status_of(app_module, app_module.block_from_json, unknown, BASE) == 422
+
+
+def test_merge_patch(app_module):
+    block = app_module.block_from_json({"start": "08:00", "is_class": False}, BASE)
+    assert block == {"label": "Period 2", "is_class": 0, "start": "08:00", "end": "08:48"}
+    assert status_of(app_module, app_module.block_from_json, {}, BASE) == 400
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+
+def tallies(gi, gd, bi, bd):
+    return {"girls": [gi, gd], "boys": [bi, bd]}
+
+
+@pytest.fixture
+def sync(app_module, tenant, monkeypatch):
+    monkeypatch.setattr(app_module, "_node_id", "me")
+    return tenant.sync
+
+
+def saved_nodes(sync):
+    with open(sync.path, encoding="utf-8") as f:
+        return json.load(f)["nodes"]
+
+
+def test_merge_takes_max_per_tally(sync):
+    assert sync.merge({"a": tallies(5, 1, 2, 0)})
+    assert sync.merge({"a": tallies(3, 4, 2, 0), "b": tallies(1, 0, 0, 0)})
+    nodes = saved_nodes(sync)
+    assert nodes["a"] == tallies(5, 4, 2, 0)
+    assert nodes["b"] == tallies(1, 0, 0, 0)
+    assert sync.totals() == {"girls": 5 - 4 + 1, "boys": 2}
+
+
+def test_merge_is_idempotent(sync):
+    state = {"a": tallies(5, 1, 2, 0), "b": tallies(0, 0, 7, 3)}
+    assert sync.merge(state)
+    assert not sync.merge(state)
+    assert not sync.merge({"a": tallies(4, 0, 1, 0)})
+
+
+def test_merge_order_does_not_matter(app_module, tenant, tmp_path, sync):
+    updates = [{"a": tallies(5, 1, 0, 0)}, {"a": tallies(2, 3, 4, 0), "b": tallies(1, 1, 1, 1)}]
+    other = app_module.PeerSync(tenant, ["http://127.0.0.1:9"], str(tmp_path / "other.json"))
+    for u in updates:
+        sync.merge(u)
+    for u in reversed(updates):
+        other.merge(u)
+    assert saved_nodes(sync) == saved_nodes(other)
+
+
+def test_local_counts_are_added(tenant, sync):
+    tenant.counters.add("girls", 2)
+    tenant.counters.add("girls", -1)
+    sync.merge({"a": tallies(3, 0, 0, 0)})
+    assert sync.state()["me"] == tallies(2, 1, 0, 0)
+    assert sync.totals() == {"girls": 4, "boys": 0}
+
+
+def test_own_node_only_taken_from_answers(tenant, sync):
+    assert not sync.merge({"me": tallies(9, 0, 0, 0)})
+    assert tenant.counters.snapshot() == {"girls": 0, "boys": 0}
+    assert sync.merge({"me": tallies(9, 2, 1, 0)}, own=True)
+    assert tenant.counters.tallies() == tallies(9, 2, 1, 0)
+    assert tenant.counters.snapshot() == {"girls": 7, "boys": 1}
+
+
+def test_node_cap(app_module, sync, monkeypatch):
+    monkeypatch.setattr(app_module, "SYNC_MAX_NODES", 3)
+    sync.merge({"a": tallies(1, 0, 0, 0), "b": tallies(1, 0, 0, 0)})
+    assert not sync.merge({"c": tallies(1, 0, 0, 0)})
+    assert sync.merge({"a": tallies(2, 0, 0, 0), "c": tallies(1, 0, 0, 0)})
+    assert sorted(saved_nodes(sync)) == ["a", "b", "me"]
+
+
+def test_parse_tallies(app_module):
+    assert app_module.parse_tallies({"a": {"girls": ["3", -2], "boys": [1, 0], "x": 1}}) == {"a": tallies(3, 0, 1, 0)}
+    for bad in ([], {"a": {"girls": [1, 0]}}, {"a": {"girls": "x", "boys": [0, 0]}}):
+        with pytest.raises((ValueError, TypeError, KeyError, IndexError)):
+            app_module.parse_tallies(bad)
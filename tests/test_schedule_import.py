@@ -0,0 +1,66 @@
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEADER = "day,label,is_class,start,end\n"
+
+
+def run(app_module, tenant, text):
+    return app_module.import_schedule_csv(text.splitlines(keepends=True), tenant)
+
+
+def test_export_round_trips(app_module, tenant):
+    with open(os.path.join(ROOT, "schedules_export.csv"), encoding="utf-8") as f:
+        schedules, report = app_module.import_schedule_csv(f, tenant)
+    assert report.errors == []
+    assert report.blocks == 17
+    assert schedules["monday"][0] == {"label": "Period 2", "is_class": 1, "start": "08:10", "end": "08:48"}
+    assert [b["label"] for b in schedules["tue-fri"]][-1] == "Period 7"
+
+
+def test_row_errors_name_their_lines(app_module, tenant):
+    schedules, report = run(app_module, tenant, HEADER + (
+        "monday,Period 1,1,08:00,08:40\n"
+        "monday,Period 2,1,8:45,08:30\n"
+        "sunday,Period 3,1,09:00,09:40\n"
+        "monday,,2,9am,10:00\n"
+    ))
+    assert schedules is None
+    assert [line for line, _ in report.errors] == [3, 4, 5, 5, 5]
+    assert "not after it starts at 08:45" in report.errors[0][1]
+    assert "unknown day 'sunday'" in report.errors[1][1]
+
+
+def test_overlap_and_order(app_module, tenant):
+    schedules, report = run(app_module, tenant, HEADER + (
+        "monday,Period 1,1,08:00,09:00\n"
+        "monday,Period 2,1,08:30,09:30\n"
+        "tue-fri,Period 2,1,09:00,09:40\n"
+        "tue-fri,Period 1,1,08:00,08:40\n"
+    ))
+    assert schedules is None
+    messages = dict(report.errors)
+    assert "overlaps Period 1 08:00-09:00 on line 2" in messages[3]
+    assert "rows must be in time order" in messages[5]
+
+
+def test_missing_column(app_module, tenant):
+    schedules, report = run(app_module, tenant, "day,label,start,end\nmonday,P1,08:00,09:00\n")
+    assert schedules is None
+    assert report.errors == [(1, "missing column(s): is_class")]
+
+
+def test_tenant_column_selects_rows(app_module, tenant):
+    schedules, report = run(app_module, tenant, "tenant," + HEADER + (
+        "other,monday,Other P1,1,07:00,08:00\n"
+        "test,monday,Period 1,1,08:00,08:40\n"
+        "other,monday,broken,1,xx,yy\n"
+    ))
+    assert report.errors == []
+    assert schedules == {"monday": [{"label": "Period 1", "is_class": 1, "start": "08:00", "end": "08:40"}],
+                         "tue-fri": []}
+
+
+def test_tenant_column_without_own_rows(app_module, tenant):
+    schedules, report = run(app_module, tenant, "tenant," + HEADER + "other,monday,P1,1,08:00,08:40\n")
+    assert schedules is None
+    assert report.errors == [(1, "no rows for tenant 'test'")]
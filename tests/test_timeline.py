@@ -0,0 +1,124 @@
+import json
+import os
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAY = date(2025, 11, 3)
+
+# Rows that stress list-order matching: out of order, nested, overlapping,
+# back to back, and classes shorter than twice the closed minutes.
+EDGE_TEMPLATES = {
+    "nested": [
+        {"label": "Block A", "is_class": 1, "start": "08:00", "end": "10:00"},
+        {"label": "Assembly", "is_class": 0, "start": "08:30", "end": "09:00"},
+        {"label": "Block B", "is_class": 1, "start": "10:00", "end": "10:20"},
+        {"label": "Lunch", "is_class": 0, "start": "10:20", "end": "11:00"},
+    ],
+    "unordered": [
+        {"label": "Period 2", "is_class": 1, "start": "09:00", "end": "09:50"},
+        {"label": "Period 1", "is_class": 1, "start": "08:00", "end": "08:50"},
+        {"label": "Break", "is_class": 0, "start": "09:40", "end": "10:05"},
+        {"label": "Period 3", "is_class": 1, "start": "10:00", "end": "10:45"},
+    ],
+    "single": [{"label": "Exam", "is_class": 1, "start": "08:00", "end": "08:10"}],
+}
+
+
+def baseline_status(now, rows, tz, closed_min):
+    """current_status() as it was before timelines were compiled: every rule
+    evaluated per request."""
+    blocks = []
+    for label, is_class, s, e in rows:
+        s_dt, e_dt = datetime.combine(now.date(), s, tz), datetime.combine(now.date(), e, tz)
+        blocks.append((label, is_class, s_dt, e_dt))
+
+    day_start = blocks[0][2]
+    day_end = blocks[-1][3]
+
+    if now < day_start:
+        return ("OUTSIDE", "Before school hours", day_start)
+    if now >= day_end:
+        return ("OUTSIDE", "After school hours", None)
+
+    for (label, is_class, s_dt, e_dt) in blocks:
+        if s_dt <= now < e_dt:
+            if is_class:
+                if now < s_dt + timedelta(minutes=closed_min):
+                    return ("CLOSED", f"{label}: first {closed_min} min", s_dt + timedelta(minutes=closed_min))
+                if now >= e_dt - timedelta(minutes=closed_min):
+                    return ("CLOSED", f"{label}: last {closed_min} min", e_dt)
+                return ("OPEN", f"{label}: middle of class", e_dt - timedelta(minutes=closed_min))
+            else:
+                return ("OPEN", f"{label}", e_dt)
+
+    for (label, is_class, s_dt, e_dt) in blocks:
+        if now < s_dt:
+            return ("OPEN", "Passing time", s_dt)
+
+    return ("OPEN", "Passing time", None)
+
+
+def templates(app_module):
+    with open(os.path.join(ROOT, "schedules.json"), encoding="utf-8") as f:
+        shipped = json.load(f)
+    out = {f"default/{k}": v for k, v in app_module.DEFAULT_SCHEDULES.items()}
+    out.update({f"schedules.json/{k}": v for k, v in shipped.items() if v})
+    out.update({f"edge/{k}": v for k, v in EDGE_TEMPLATES.items()})
+    return out
+
+
+def instants(app_module, rows, tz, closed_min):
+    """Every minute of the day, plus each instant a rule compares against and
+    a second either side of it."""
+    midnight = app_module.as_dt(DAY, datetime.min.time(), tz)
+    out = {midnight + timedelta(minutes=m) for m in range(24 * 60)}
+    for _, _, s, e in rows:
+        for t in (s, e):
+            dt = app_module.as_dt(DAY, t, tz)
+            for edge in (dt, dt + timedelta(minutes=closed_min), dt - timedelta(minutes=closed_min)):
+                out.update((edge - timedelta(seconds=1), edge, edge + timedelta(seconds=1)))
+    return sorted(t for t in out if t.date() == DAY)
+
+
+@pytest.mark.parametrize("closed_min", [15, 5, 30])
+def test_compile_day_matches_baseline(app_module, closed_min):
+    tz = app_module.TZ
+    for name, blocks in templates(app_module).items():
+        rows = app_module.parse_rows(blocks)
+        starts, segments, periods, _ = app_module.compile_day(DAY, rows, tz, closed_min)
+        segments = segments + [("OUTSIDE", "After school hours", None)]
+        assert len(starts) == len(segments) == len(periods) + 1
+        for now in instants(app_module, rows, tz, closed_min):
+            got = segments[bisect_right(starts, now) - 1]
+            assert got == baseline_status(now, rows, tz, closed_min), (name, now.time())
+
+
+def test_period_closed_min(app_module):
+    rows = app_module.parse_rows(app_module.DEFAULT_SCHEDULES["monday"])
+    tz = app_module.TZ
+    starts, segments, _, open_blocks = app_module.compile_day(DAY, rows, tz, 15, {"Period 2": 5})
+    at = lambda hhmm: segments[bisect_right(starts, app_module.as_dt(DAY, app_module.parse_hhmm(hhmm), tz)) - 1]
+    assert at("08:16")[:2] == ("OPEN", "Period 2: middle of class")
+    assert at("09:00")[:2] == ("CLOSED", "Period 3: first 15 min")
+    assert open_blocks[0][2] == "Period 2 (middle of class)"
+    assert open_blocks[0][0].time() == app_module.parse_hhmm("08:15")
+
+
+def test_open_blocks_match_status(app_module):
+    tz = app_module.TZ
+    for name, blocks in app_module.DEFAULT_SCHEDULES.items():
+        rows = app_module.parse_rows(blocks)
+        starts, segments, _, open_blocks = app_module.compile_day(DAY, rows, tz, 15)
+        for now in instants(app_module, rows, tz, 15):
+            inside = any(s <= now < e for s, e, _ in open_blocks)
+            assert inside == (baseline_status(now, rows, tz, 15)[0] == "OPEN"), (name, now.time())
+
+
+def test_timeline_after_school_points_at_next_day(app_module, tenant):
+    tl = tenant.get_timeline(date(2025, 11, 7))  # Friday
+    status, reason, nxt = tl.status_at(app_module.as_dt(date(2025, 11, 7), app_module.parse_hhmm("16:00"), tenant.tz))
+    assert (status, reason) == ("OUTSIDE", "After school hours")
+    assert nxt == app_module.as_dt(date(2025, 11, 10), app_module.parse_hhmm("08:10"), tenant.tz)